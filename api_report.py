@@ -0,0 +1,166 @@
+import atexit
+import json
+import math
+import re
+import sys
+import threading
+from urllib.parse import urlsplit
+
+from http_utils import add_request_hook
+
+# Formats of the API report written to a file
+api_report_formats = ['json', 'openmetrics']
+# Path segments replaced by a placeholder, so that calls to the same endpoint are reported together
+endpoint_placeholders = [(re.compile(r'/repos/[^/]+/[^/]+'), '/repos/{owner}/{repo}'),
+                         (re.compile(r'/[A-Z][A-Z0-9_]*-\d+(?=/|$)'), '/{issue_key}'),
+                         (re.compile(r'/\d+(?=/|$)'), '/{number}')]
+
+api_calls = []
+api_calls_lock = threading.Lock()
+
+
+def record_api_call(method, url, response, seconds):
+    api_call = {'method': method, 'endpoint': get_endpoint_template(url), 'seconds': seconds,
+                'status': response.status_code if response is not None else None,
+                'bytes': get_response_bytes(response) if response is not None else 0,
+                'rate_limit_remaining': None}
+    if response is not None and response.headers.get('X-RateLimit-Remaining'):
+        api_call['rate_limit_remaining'] = int(response.headers['X-RateLimit-Remaining'])
+    with api_calls_lock:
+        api_calls.append(api_call)
+
+
+def get_endpoint_template(url):
+    url_parts = urlsplit(url)
+    path = url_parts.path
+    for pattern, placeholder in endpoint_placeholders:
+        path = pattern.sub(placeholder, path)
+    return url_parts.netloc + path
+
+
+def get_response_bytes(response):
+    if response.headers.get('Content-Length'):
+        return int(response.headers['Content-Length'])
+    # The body of a projected response is replaced by the fields kept, see project_json_response()
+    if getattr(response, 'streamed_bytes', None) is not None:
+        return response.streamed_bytes
+    # Streamed responses are not read here, that would consume them
+    return len(response.content) if response._content_consumed else 0
+
+
+def summarize_api_calls():
+    """Summarize the recorded calls per endpoint: calls, statuses, p50/p95 latency, bytes and lowest rate limit left."""
+    with api_calls_lock:
+        calls = list(api_calls)
+    endpoints = {}
+    for api_call in calls:
+        endpoint = endpoints.setdefault((api_call['method'], api_call['endpoint']), {
+            'method': api_call['method'], 'endpoint': api_call['endpoint'], 'calls': 0, 'statuses': {},
+            'seconds': [], 'bytes': 0, 'rate_limit_remaining': None})
+        endpoint['calls'] += 1
+        status = str(api_call['status'] or 'error')
+        endpoint['statuses'][status] = endpoint['statuses'].get(status, 0) + 1
+        endpoint['seconds'].append(api_call['seconds'])
+        endpoint['bytes'] += api_call['bytes']
+        rate_limit_remaining = api_call['rate_limit_remaining']
+        if rate_limit_remaining is not None and (endpoint['rate_limit_remaining'] is None
+                                                 or rate_limit_remaining < endpoint['rate_limit_remaining']):
+            endpoint['rate_limit_remaining'] = rate_limit_remaining
+    summary = []
+    for endpoint in sorted(endpoints.values(), key=lambda e: (-sum(e['seconds']), e['endpoint'])):
+        seconds = sorted(endpoint.pop('seconds'))
+        endpoint.update({'p50_seconds': percentile(seconds, 0.5), 'p95_seconds': percentile(seconds, 0.95),
+                         'total_seconds': sum(seconds)})
+        summary.append(endpoint)
+    return summary
+
+
+def percentile(sorted_values, fraction):
+    # Nearest rank
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def print_api_report(summary, file=sys.stdout):
+    print(f'{"calls":>6} {"p50 ms":>8} {"p95 ms":>8} {"total KB":>9} {"limit left":>10}  {"statuses":<16} endpoint',
+          file=file)
+    for endpoint in summary:
+        statuses = ','.join(status + ':' + str(count) for status, count in sorted(endpoint['statuses'].items()))
+        rate_limit_remaining = endpoint['rate_limit_remaining']
+        print(f'{endpoint["calls"]:6d} {endpoint["p50_seconds"] * 1000:8.1f} {endpoint["p95_seconds"] * 1000:8.1f} '
+              f'{endpoint["bytes"] / 1024:9.1f} {"-" if rate_limit_remaining is None else rate_limit_remaining:>10}  '
+              f'{statuses:<16} {endpoint["method"]} {endpoint["endpoint"]}', file=file)
+    print(f'{sum(endpoint["calls"] for endpoint in summary)} API call(s), '
+          f'{sum(endpoint["bytes"] for endpoint in summary) / 1024:.1f} KB', file=file)
+
+
+def format_api_report(summary, report_format):
+    if report_format == 'json':
+        return json.dumps({'endpoints': summary}, indent=2) + '\n'
+    lines = ['# TYPE pr_scripts_api_calls counter', '# HELP pr_scripts_api_calls API calls by endpoint and status']
+    for endpoint in summary:
+        for status, count in sorted(endpoint['statuses'].items()):
+            lines.append('pr_scripts_api_calls_total' + format_labels(endpoint, status=status) + ' ' + str(count))
+    lines.extend(['# TYPE pr_scripts_api_call_seconds summary', '# UNIT pr_scripts_api_call_seconds seconds',
+                  '# HELP pr_scripts_api_call_seconds Latency of API calls, retries included'])
+    for endpoint in summary:
+        for quantile, key in (('0.5', 'p50_seconds'), ('0.95', 'p95_seconds')):
+            lines.append('pr_scripts_api_call_seconds' + format_labels(endpoint, quantile=quantile) + ' ' +
+                         str(endpoint[key]))
+        lines.append('pr_scripts_api_call_seconds_sum' + format_labels(endpoint) + ' ' + str(endpoint['total_seconds']))
+        lines.append('pr_scripts_api_call_seconds_count' + format_labels(endpoint) + ' ' + str(endpoint['calls']))
+    lines.extend(['# TYPE pr_scripts_api_response_bytes counter', '# UNIT pr_scripts_api_response_bytes bytes',
+                  '# HELP pr_scripts_api_response_bytes Size of API response bodies'])
+    for endpoint in summary:
+        lines.append('pr_scripts_api_response_bytes_total' + format_labels(endpoint) + ' ' + str(endpoint['bytes']))
+    lines.extend(['# TYPE pr_scripts_api_rate_limit_remaining gauge',
+                  '# HELP pr_scripts_api_rate_limit_remaining Lowest X-RateLimit-Remaining seen'])
+    for endpoint in summary:
+        if endpoint['rate_limit_remaining'] is not None:
+            lines.append('pr_scripts_api_rate_limit_remaining' + format_labels(endpoint) + ' ' +
+                         str(endpoint['rate_limit_remaining']))
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def format_labels(endpoint, **labels):
+    labels = dict({'method': endpoint['method'], 'endpoint': endpoint['endpoint']}, **labels)
+    return '{' + ','.join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+                          for name, value in labels.items()) + '}'
+
+
+def write_api_report(summary, path, report_format):
+    with open(path, 'w') as report_file:
+        report_file.write(format_api_report(summary, report_format))
+
+
+def report_api_calls(path=None, report_format='json'):
+    summary = summarize_api_calls()
+    # stderr, so that the report does not mix with output meant for other tools, such as the JIRA comment
+    print_api_report(summary, file=sys.stderr)
+    if path:
+        try:
+            write_api_report(summary, path, report_format)
+        except OSError as e:
+            print(f'Unable to write API report {path}. Error: {e}', file=sys.stderr)
+
+
+def enable_api_report(path=None, report_format='json'):
+    """Record every API call and report them when the script exits, also when it exits with sys.exit()."""
+    add_request_hook(record_api_call)
+    atexit.register(report_api_calls, path, report_format)
+
+
+def add_api_report_arguments(parser):
+    parser.add_argument('--api-report', dest='api_report', action='store_true',
+                        required=False,
+                        help='Print the API calls made, per endpoint, when done')
+    parser.add_argument('--api-report-file', dest='api_report_file', action='store', type=str,
+                        required=False,
+                        help='File the API report is also written to. Implies --api-report')
+    parser.add_argument('--api-report-format', dest='api_report_format', action='store', type=str,
+                        required=False,
+                        default='json',
+                        choices=api_report_formats,
+                        help='Format of the API report file. Default is json')
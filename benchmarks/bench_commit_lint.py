@@ -0,0 +1,71 @@
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(benchmarks_dir, '..')
+linter_path = os.path.join(repo_dir, 'github_pull_request_linter.py')
+
+
+def create_repository(path, commit_count, invalid_every):
+    """A repository of commit_count empty commits on main, every invalid_every-th of them with an invalid subject."""
+    subprocess.run(['git', 'init', '--quiet', path], check=True)
+    commands = []
+    for i in range(1, commit_count + 1):
+        subject = 'Update things' if i % invalid_every == 0 else 'feat: JIRA-' + str(i) + ' Change ' + str(i)
+        message = (subject + '\n\nDetails of change ' + str(i) + '\n').encode()
+        commands.append(b'commit refs/heads/main\nmark :' + str(i).encode() + b'\n'
+                        b'committer Benchmark <benchmark@example.com> ' + str(1700000000 + i).encode() + b' +0000\n'
+                        b'data ' + str(len(message)).encode() + b'\n' + message +
+                        (b'from :' + str(i - 1).encode() + b'\n' if i > 1 else b'') + b'\n')
+    subprocess.run(['git', '-C', path, 'fast-import', '--quiet'], input=b''.join(commands), check=True)
+
+
+def measure(path, revision_range):
+    """Run the linter on revision_range and time the first invalid commit it reports and the whole run."""
+    started_at = time.perf_counter()
+    process = subprocess.Popen([sys.executable, linter_path, '--commits', revision_range], cwd=path,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    first_report_seconds = None
+    reported = 0
+    for line in process.stderr:
+        if first_report_seconds is None:
+            first_report_seconds = time.perf_counter() - started_at
+        reported += 1
+    process.wait()
+    seconds = time.perf_counter() - started_at
+    # The largest resident set size of the linter, or of the git it ran, among the processes waited for so far
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {'seconds': seconds, 'first_report_seconds': first_report_seconds, 'reported_lines': reported,
+            'exit_code': process.returncode,
+            'peak_rss_bytes': max_rss if sys.platform == 'darwin' else max_rss * 1024}
+
+
+def parse_cli_arguments():
+    parser = ArgumentParser(description='Measure the time and peak memory of linting the subjects of commit ranges')
+    parser.add_argument('-n', '--commits', dest='commits', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='Sizes of the commit ranges linted, each in a repository of its own. '
+                             'Default is 1000 10000 50000')
+    parser.add_argument('--invalid-every', dest='invalid_every', type=int, default=100,
+                        help='Every how many commits one has an invalid subject. Default is 100')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = parse_cli_arguments()
+    print(f'{"commits":>8} {"first report ms":>16} {"total ms":>10} {"reported":>9} {"peak RSS MB":>12}')
+    # Smallest first, the peak resident set size of the processes waited for never goes down
+    for commit_count in sorted(args['commits']):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            create_repository(temp_dir, commit_count, args['invalid_every'])
+            result = measure(temp_dir, 'main')
+        print(f'{commit_count:8d} {result["first_report_seconds"] * 1000:16.1f} {result["seconds"] * 1000:10.1f} '
+              f'{result["reported_lines"]:9d} {result["peak_rss_bytes"] / 1024 / 1024:12.1f}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import asyncio
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from contextlib import redirect_stderr, redirect_stdout
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(benchmarks_dir, '..')
+sys.path.insert(0, repo_dir)
+
+import github_pull_request_linter
+import github_pull_request_utils
+import http_utils
+import jira_dev_resolution_template
+import jira_utils
+import pull_request_index
+import snapshot_store
+from pr_body_corpus import corpus_kinds, generate_pr_body
+
+default_output = 'benchmark-results.json'
+
+
+def start_server(config):
+    # A separate process, so that the server neither competes for the GIL nor shows up in the traced memory
+    server = subprocess.Popen([sys.executable, os.path.join(benchmarks_dir, 'fake_api_server.py'),
+                               '--config', json.dumps(config)], stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+
+def server_request(server_url, method, path):
+    return json.loads(http_utils.http_request(method, server_url + path).content)
+
+
+def point_scripts_to(server_url, temp_dir):
+    github_pull_request_utils.base_url = server_url + '/repos'
+    jira_utils.jira_rest_api_url = server_url + '/rest/api/latest'
+    jira_utils.set_issue_type_cache_dir(temp_dir)
+    os.environ['GIT_TOKEN'] = 'benchmark'
+    os.environ['JIRA_TOKEN'] = 'benchmark'
+    # Pull request the dev resolution is commented on in GitHub mode
+    os.environ['REPO_NAME'] = github_pull_request_utils.org_name + '/benchmark'
+    os.environ['PR_NUMBER'] = '1'
+
+
+def clear_caches(args, temp_dir, run):
+    jira_utils.issue_type_cache.clear()
+    if jira_utils.issue_type_cache_file.exists():
+        jira_utils.issue_type_cache_file.unlink()
+    if not args['warm_cache']:
+        args['cache_dir'] = os.path.join(temp_dir, 'github-cache-' + str(run))
+    args['snapshot'] = os.path.join(temp_dir, 'snapshot-' + str(run) + '.json.gz')
+    args['index'] = os.path.join(temp_dir, 'pull-request-index-' + str(run) + '.sqlite')
+
+
+def dev_resolution_stages(args):
+    """Stages of jira_dev_resolution_template.main() in GitHub mode, each a function of the previous result."""
+    def fetch(_):
+        return github_pull_request_utils.generate_pull_request_details(args)
+
+    def render(pull_request_details):
+        jira_utils.populate_jira_comment(pull_request_details)
+        return pull_request_details
+
+    def post_to_jira(pull_request_details):
+        results = jira_dev_resolution_template.post_dev_resolution_on_jira_issues(args, pull_request_details)
+        failures = [error for issue_key, result, error in results if error]
+        if failures:
+            raise Exception('Posting to JIRA failed: ' + str(failures[0]))
+        return results
+
+    def sequential(_):
+        # The whole flow of jira_dev_resolution_template.main(), one stage after the other
+        pull_request_details = github_pull_request_utils.generate_pull_request_details(args)
+        jira_utils.populate_jira_comment(pull_request_details)
+        jira_dev_resolution_template.post_resolution_comment(args, pull_request_details)
+        post_to_jira(pull_request_details)
+
+    def pipeline(_):
+        asyncio.run(jira_dev_resolution_template.generate_dev_resolution(args))
+
+    def fetch_with_snapshot(mode):
+        def fetch_snapshot(_):
+            store = snapshot_store.SnapshotStore(args['snapshot'], mode)
+            http_utils.set_response_store(store)
+            try:
+                return github_pull_request_utils.generate_pull_request_details(args)
+            finally:
+                http_utils.set_response_store(None)
+                store.save()
+        return fetch_snapshot
+
+    def bulk(_):
+        # Bulk mode over every merged pull request the fake server finds, rendered per issue key
+        bulk_args = dict(args, pr=None, merged_since='2024-01-01')
+        for issue_key, pull_request_details in \
+                github_pull_request_utils.iter_pull_request_details_by_issue_key(bulk_args):
+            jira_utils.populate_jira_comment(pull_request_details)
+
+    def bulk_with_index(_):
+        index = pull_request_index.PullRequestIndex(args['index'])
+        github_pull_request_utils.set_pull_request_index(index)
+        try:
+            bulk(None)
+        finally:
+            github_pull_request_utils.set_pull_request_index(None)
+            index.close()
+
+    stages = [('dev-resolution/fetch', fetch), ('dev-resolution/render', render),
+              ('dev-resolution/jira', post_to_jira),
+              ('dev-resolution/sequential', sequential),
+              ('dev-resolution/pipeline', pipeline),
+              # The fetch recorded to a snapshot, then replayed from it without any round trip
+              ('dev-resolution/record', fetch_with_snapshot('record')),
+              ('dev-resolution/replay', fetch_with_snapshot('replay'))]
+    if args['merged_prs']:
+        stages.append(('dev-resolution/bulk', bulk))
+        # Bulk mode filling the pull request index, then again taking every pull request from it
+        stages.append(('dev-resolution/bulk-index', bulk_with_index))
+        stages.append(('dev-resolution/bulk-indexed', bulk_with_index))
+    return stages
+
+
+def linter_stages(args):
+    def lint_corpus(kind):
+        bodies = [generate_pr_body(kind, pr_number) for pr_number in range(1, args['lint_bodies'] + 1)]
+
+        def lint(_):
+            for pr_number, body in enumerate(bodies, 1):
+                is_valid_pr, new_pr_title = github_pull_request_linter.lint_pull_request(
+                    'feat: JIRA-' + str(pr_number) + ' Change', body, offline=True)
+                if not is_valid_pr:
+                    raise Exception('Generated ' + kind + ' pull request body ' + str(pr_number) + ' is invalid')
+        return lint
+
+    def lint_and_update_title(_):
+        # A title without a conventional commit type, looked up in JIRA and updated on GitHub. The issue is not one
+        # of the dev resolution run, whose issue types are cached by then
+        pr_number = args['prs'] + 1
+        issue_key = 'JIRA-' + str(pr_number)
+        is_valid_pr, new_pr_title = github_pull_request_linter.lint_pull_request(
+            issue_key + ' Change', generate_pr_body('small', pr_number), branch_name=issue_key,
+            repo_name='pccofvns/' + args['repo'], pr_number=pr_number)
+        if not new_pr_title:
+            raise Exception('Pull request title was not updated')
+
+    return [('lint/' + kind, lint_corpus(kind)) for kind in corpus_kinds] + \
+        [('lint/update-title', lint_and_update_title)]
+
+
+def run_stages(stages, server_url, trace_memory):
+    measurements = {}
+    result = None
+    for name, stage in stages:
+        server_request(server_url, 'POST', '/_reset')
+        if trace_memory:
+            tracemalloc.start()
+        started_at = time.perf_counter()
+        # The scripts print their progress, which is not what is measured
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            result = stage(result)
+        seconds = time.perf_counter() - started_at
+        measurement = {'seconds': seconds, 'round_trips': server_request(server_url, 'GET', '/_stats')}
+        if trace_memory:
+            measurement['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        measurements[name] = measurement
+    return measurements
+
+
+def summarize(runs, traced_run):
+    stages = {}
+    for name in traced_run:
+        seconds = [run[name]['seconds'] for run in runs]
+        round_trips = runs[-1][name]['round_trips']
+        stages[name] = {
+            'seconds': seconds,
+            'best_seconds': min(seconds),
+            'median_seconds': statistics.median(seconds),
+            'round_trips': {endpoint: stats['calls'] for endpoint, stats in sorted(round_trips.items())},
+            'total_round_trips': sum(stats['calls'] for stats in round_trips.values()),
+            'rate_limited_responses': sum(stats['rate_limited'] for stats in round_trips.values()),
+            'response_bytes': sum(stats['bytes'] for stats in round_trips.values()),
+            'peak_memory_bytes': traced_run[name]['peak_memory_bytes']
+        }
+    return stages
+
+
+def get_commit():
+    completed = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir, capture_output=True, text=True)
+    return completed.stdout.strip() or None
+
+
+def print_results(stages, baseline=None):
+    print(f'{"stage":<28} {"best ms":>10} {"median ms":>10} {"round trips":>12} {"rate limited":>13} {"peak MB":>9}'
+          + (f' {"vs baseline":>12}' if baseline else ''))
+    for name, stage in stages.items():
+        line = (f'{name:<28} {stage["best_seconds"] * 1000:10.1f} {stage["median_seconds"] * 1000:10.1f} '
+                f'{stage["total_round_trips"]:12d} {stage["rate_limited_responses"]:13d} '
+                f'{stage["peak_memory_bytes"] / 1024 / 1024:9.1f}')
+        if baseline and name in baseline['stages']:
+            line += f' {stage["best_seconds"] / baseline["stages"][name]["best_seconds"]:11.2f}x'
+        print(line)
+
+
+def parse_cli_arguments():
+    args = {}
+    parser = ArgumentParser(description='Benchmark the dev resolution pipeline and the linter against a local fake '
+                                        'GitHub and JIRA server')
+    parser.add_argument('-n', '--prs', dest='prs', type=int, default=10,
+                        help='Number of pull requests of the dev resolution run. Default is 10')
+    parser.add_argument('--repo', dest='repo', default='benchmark', help='Name of the emulated repository')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=github_pull_request_utils.default_workers,
+                        help='Number of workers of the dev resolution run. Default is '
+                             + str(github_pull_request_utils.default_workers))
+    parser.add_argument('-B', '--backend', dest='backend', default='rest',
+                        choices=github_pull_request_utils.fetch_backends,
+                        help='Backend used to fetch pull request details. Default is rest')
+    parser.add_argument('--warm-cache', dest='warm_cache', action='store_true',
+                        help='Keep the GitHub response cache between runs, so that later runs revalidate it')
+    parser.add_argument('--lint-bodies', dest='lint_bodies', type=int, default=5,
+                        help='Number of generated pull request bodies linted of each corpus kind. Default is 5')
+    parser.add_argument('-l', '--latency-ms', dest='latency_ms', type=float, default=20,
+                        help='Latency of every answer of the fake server in milliseconds. Default is 20')
+    parser.add_argument('--files-per-pr', dest='files_per_pr', type=int, default=250,
+                        help='Changed files of every pull request. Default is 250')
+    parser.add_argument('--reviews-per-pr', dest='reviews_per_pr', type=int, default=5,
+                        help='Reviews of every pull request. Default is 5')
+    parser.add_argument('--patch-bytes', dest='patch_bytes', type=int, default=2048,
+                        help='Size of the patch of every changed file. Default is 2048')
+    parser.add_argument('--bulk-prs', dest='merged_prs', type=int, default=100,
+                        help='Merged pull requests found by the bulk mode search. 0 skips the bulk mode. Default is 100')
+    parser.add_argument('--chunked', dest='chunked', action='store_true',
+                        help='Make the fake server send bodies in chunks without a Content-Length, as GitHub does')
+    parser.add_argument('--corpus', dest='corpus', default='medium', choices=corpus_kinds,
+                        help='Kind of the pull request bodies of the dev resolution run. Default is medium')
+    parser.add_argument('--rate-limit', dest='rate_limit', type=int, default=0,
+                        help='GitHub requests allowed by the fake server per rate limit window. Default is unlimited')
+    parser.add_argument('--rate-limit-window', dest='rate_limit_window_seconds', type=float, default=60,
+                        help='Seconds after which the GitHub rate limit resets. Default is 60')
+    parser.add_argument('--secondary-rate-limit', dest='secondary_rate_limit', type=int, default=0,
+                        help='Concurrent GitHub requests beyond which the fake server asks to retry later. '
+                             'Default is unlimited')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='Number of timed runs. A further run measures peak memory. Default is 3')
+    parser.add_argument('-o', '--output', dest='output', default=default_output,
+                        help='JSON file the results are written to. Default is ' + default_output)
+    parser.add_argument('--compare', dest='compare', required=False,
+                        help='JSON results of an earlier run, for example of another commit, to compare with')
+    args.update(parser.parse_args().__dict__)
+    return args
+
+
+def main():
+    args = parse_cli_arguments()
+    server_config = {name: args[name] for name in ('latency_ms', 'files_per_pr', 'reviews_per_pr', 'patch_bytes',
+                                                   'corpus', 'rate_limit', 'rate_limit_window_seconds',
+                                                   'secondary_rate_limit', 'merged_prs', 'chunked')}
+    args.update({'pr': [str(pr_number) for pr_number in range(1, args['prs'] + 1)], 'gt': None, 'jt': 'benchmark',
+                 'mode': 'github', 'no_cache': False,
+                 'issue_key': None})
+    server, server_url = start_server(server_config)
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            point_scripts_to(server_url, temp_dir)
+            stages = dev_resolution_stages(args) + linter_stages(args)
+            runs = []
+            for run in range(args['repeat']):
+                clear_caches(args, temp_dir, run)
+                runs.append(run_stages(stages, server_url, trace_memory=False))
+            # Tracing allocations slows the scripts down, so memory is measured in a run of its own
+            clear_caches(args, temp_dir, args['repeat'])
+            traced_run = run_stages(stages, server_url, trace_memory=True)
+    finally:
+        server.terminate()
+        server.wait()
+    results = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'arguments': {name: value for name, value in args.items() if name not in ('pr', 'gt', 'jt', 'compare')},
+        'server': server_config,
+        'stages': summarize(runs, traced_run)
+    }
+    baseline = None
+    if args['compare']:
+        with open(args['compare'], 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f'Compared with {baseline.get("commit")} ({args["compare"]})')
+    print_results(results['stages'], baseline)
+    with open(args['output'], 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f'Results written to {args["output"]}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+SAMPLE_TITLE = 'fix: JIRA-1234 Invalidate the user cache on update'
+SAMPLE_BODY = '''## Description of Changes
+### RCA
+The cache was not invalidated when the user id changed.
+### Code Changes
+Invalidate the cache in UserService.update()
+### Impact Analysis
+Only the user service is affected.
+## Issue ticket number(s)
+JIRA-1234
+## Tests
+- [x] Unit tests
+'''
+# Modules an offline run of the linter must not import
+network_modules = ['requests', 'urllib3']
+import_time_pattern = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+def run_with_import_times(command):
+    completed = subprocess.run([sys.executable, '-X', 'importtime'] + command, cwd=repo_dir,
+                               capture_output=True, text=True)
+    imported_modules = {}
+    for line in completed.stderr.splitlines():
+        match = import_time_pattern.match(line)
+        # Top-level imports only, their cumulative time includes their own imports
+        if match and len(match.group(3)) == 1:
+            imported_modules[match.group(4)] = int(match.group(2))
+        elif match:
+            imported_modules.setdefault(match.group(4), 0)
+    return completed.returncode, imported_modules
+
+
+def report(name, command, max_import_ms):
+    returncode, imported_modules = run_with_import_times(command)
+    # Imports done by the interpreter itself, before the script starts
+    _, baseline_modules = run_with_import_times(['-c', 'pass'])
+    import_ms = sum(cumulative for module, cumulative in imported_modules.items()
+                    if module not in baseline_modules) / 1000
+    loaded_network_modules = [module for module in network_modules
+                              if any(imported == module or imported.startswith(module + '.')
+                                     for imported in imported_modules)]
+    print(f'{name:<20} exit {returncode}  imports {import_ms:8.1f} ms  network modules: '
+          + (', '.join(loaded_network_modules) or 'none'))
+    return import_ms <= max_import_ms and not loaded_network_modules
+
+
+def main():
+    parser = ArgumentParser(description='Measure the import time of the pull request linter')
+    parser.add_argument('--max-import-ms', dest='max_import_ms', type=float, default=100,
+                        help='Fail when the imports of a run take longer than this. Default is 100 ms')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        title_file = os.path.join(temp_dir, 'title.txt')
+        body_file = os.path.join(temp_dir, 'body.md')
+        with open(title_file, 'w') as f:
+            f.write(SAMPLE_TITLE)
+        with open(body_file, 'w') as f:
+            f.write(SAMPLE_BODY)
+        results = [report('import', ['-c', 'import github_pull_request_linter'], args.max_import_ms),
+                   report('offline lint', ['github_pull_request_linter.py', '--offline', '-t', title_file,
+                                           '-b', body_file], args.max_import_ms)]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import timeit
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from jira_utils import transform_text_from_markdown_to_jira_syntax
+
+SAMPLE_MARKDOWN = '''## Description of Changes
+### RCA
+The **cache** was not invalidated when `user_id` changed.
+### Code Changes
+- Invalidate the cache in `UserService.update()`
+- [x] Added a unit test
+- [ ] Load test
+```java
+// **not bold** inside code
+cache.invalidate(userId);
+```
+#### Logs
+    2024-01-01 12:00:00 INFO request served in 12ms
+'''
+
+
+def legacy_inline_code(text):
+    new_string = ""
+    back_tick_count = 0
+    for char in text:
+        if char == "`":
+            back_tick_count += 1
+            if back_tick_count % 2 == 0:
+                new_char = "}}"
+            else:
+                new_char = "{{"
+            new_string += new_char
+        else:
+            new_string += char
+    return new_string
+
+
+def legacy_transform_text_from_markdown_to_jira_syntax(value):
+    # Multi-pass converter the single-pass one replaced, kept as the baseline
+    if isinstance(value, bool):
+        return 'Yes' if value else 'No'
+    if not value:
+        return value
+    value = value.replace('**', '*')
+    text_lines = value.splitlines()
+    for i, line in enumerate(text_lines):
+        if line and line.strip().startswith("```"):
+            if len(line.strip()) == 3:
+                text_lines[i] = "{code}"
+            else:
+                text_lines[i] = "{code:" + line.strip()[3:].strip() + "}"
+        elif line and line.strip().startswith("#####"):
+            text_lines[i] = "h5. " + line.strip()[5:]
+        elif line and line.strip().startswith("####"):
+            text_lines[i] = "h4. " + line.strip()[4:]
+        elif line and line.strip().startswith("###"):
+            text_lines[i] = "h3. " + line.strip()[3:]
+        elif line and line.strip().startswith("##"):
+            text_lines[i] = "h2. " + line.strip()[2:]
+    value = "\n".join(text_lines)
+    value = legacy_inline_code(value)
+    value = value.replace("- [ ]", "(x)")
+    value = value.replace("- [x]", "(/)")
+    value = os.linesep.join([s for s in value.splitlines() if s])
+    return value
+
+
+def generate_markdown(size):
+    return (SAMPLE_MARKDOWN * (size // len(SAMPLE_MARKDOWN) + 1))[:size]
+
+
+def main():
+    parser = ArgumentParser(description='Compare the markdown to JIRA converters on generated markdown')
+    parser.add_argument('-s', '--size', dest='size', type=int, default=1024 * 1024,
+                        help='Size of the generated markdown in characters. Default is 1 MB')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=5,
+                        help='Number of timed runs of each converter. Best run is reported. Default is 5')
+    args = parser.parse_args()
+    markdown = generate_markdown(args.size)
+    for name, converter in (('legacy multi-pass', legacy_transform_text_from_markdown_to_jira_syntax),
+                            ('single-pass', transform_text_from_markdown_to_jira_syntax)):
+        best = min(timeit.repeat(lambda: converter(markdown), number=1, repeat=args.repeat))
+        print(f'{name:<20} {best * 1000:10.1f} ms  {len(markdown) / best / 1024 / 1024:8.1f} MB/s')
+
+
+if __name__ == "__main__":
+    main()
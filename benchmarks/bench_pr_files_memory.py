@@ -0,0 +1,93 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from argparse import SUPPRESS, ArgumentParser
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(benchmarks_dir, '..')
+sys.path.insert(0, repo_dir)
+
+# How the files of a pull request are decoded. projected keeps the fields the scripts read while the pages are read,
+# full decodes whole pages as the scripts did before
+decoding_modes = ['projected', 'full']
+
+
+def start_server(config):
+    server = subprocess.Popen([sys.executable, os.path.join(benchmarks_dir, 'fake_api_server.py'),
+                               '--config', json.dumps(config)], stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+
+def get_max_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def read_files(server_url, mode, prs):
+    """Read the files of pull requests 1 to prs in this process and print what it took as JSON."""
+    import github_pull_request_utils
+
+    github_pull_request_utils.base_url = server_url + '/repos'
+    if mode == 'full':
+        github_pull_request_utils.pull_request_file_fields = None
+    os.environ['GIT_TOKEN'] = 'benchmark'
+    args = {'no_cache': True}
+    # Memory of the interpreter and of the imported modules, before any page is read
+    import requests  # noqa: F401
+    rss_before = get_max_rss_bytes()
+    started_at = time.perf_counter()
+    files = 0
+    for pr_number in range(1, prs + 1):
+        files += len(github_pull_request_utils.get_pull_request_files(args, pr_number, 'benchmark'))
+    print(json.dumps({'seconds': time.perf_counter() - started_at, 'files': files,
+                      'rss_before_bytes': rss_before, 'peak_rss_bytes': get_max_rss_bytes()}))
+
+
+def measure(server_url, mode, prs):
+    # Every mode in a process of its own, the peak resident set size of a process never goes down
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--read', mode, '--server', server_url,
+                                '--prs', str(prs)], capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def parse_cli_arguments():
+    parser = ArgumentParser(description='Measure the peak memory of reading pull request files with oversized '
+                                        'patches from a fake GitHub API')
+    parser.add_argument('-n', '--prs', dest='prs', type=int, default=3, help='Pull requests read. Default is 3')
+    parser.add_argument('--files-per-pr', dest='files_per_pr', type=int, default=300,
+                        help='Files of each pull request, 100 to a page. Default is 300')
+    parser.add_argument('--patch-bytes', dest='patch_bytes', type=int, default=256 * 1024,
+                        help='Size of the patch of each file. Default is 262144, pages of 25 MB')
+    parser.add_argument('--chunked', dest='chunked', action='store_true',
+                        help='Make the fake server send pages in chunks without a Content-Length, as GitHub does')
+    # Given by the benchmark to the processes it starts
+    parser.add_argument('--read', dest='read', choices=decoding_modes, required=False, help=SUPPRESS)
+    parser.add_argument('--server', dest='server', required=False, help=SUPPRESS)
+    return vars(parser.parse_args())
+
+
+def main():
+    args = parse_cli_arguments()
+    if args['read']:
+        read_files(args['server'], args['read'], args['prs'])
+        return
+    server, server_url = start_server({'files_per_pr': args['files_per_pr'], 'patch_bytes': args['patch_bytes'],
+                                       'etag': False, 'chunked': args['chunked']})
+    try:
+        results = {mode: measure(server_url, mode, args['prs']) for mode in decoding_modes}
+    finally:
+        server.terminate()
+        server.wait()
+    print(f'{"mode":<10} {"files":>6} {"seconds":>8} {"peak RSS MB":>12} {"read MB":>8}')
+    for mode, result in results.items():
+        print(f'{mode:<10} {result["files"]:6d} {result["seconds"]:8.2f} '
+              f'{result["peak_rss_bytes"] / 1024 / 1024:12.1f} '
+              f'{(result["peak_rss_bytes"] - result["rss_before_bytes"]) / 1024 / 1024:8.1f}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+import hashlib
+import itertools
+import json
+import math
+import re
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from pr_body_corpus import corpus_kinds, generate_pr_body
+
+# Emulated latency and payloads, overridden with --config
+default_config = {
+    # Milliseconds each answer is delayed by, as a round trip to api.github.com would be
+    'latency_ms': 0,
+    'files_per_pr': 30,
+    'reviews_per_pr': 3,
+    # Size of the patch of each changed file, which the scripts download but never read
+    'patch_bytes': 512,
+    # Kind of the generated pull request bodies, see pr_body_corpus.py
+    'corpus': 'medium',
+    # Answer 304 to requests revalidating an unchanged response
+    'etag': True,
+    # Send bodies in chunks without a Content-Length, as GitHub sends large lists such as the files of a pull request
+    'chunked': False,
+    'chunk_bytes': 16 * 1024,
+    # GitHub requests allowed per window, as the primary rate limit. 0 is unlimited
+    'rate_limit': 0,
+    'rate_limit_window_seconds': 60,
+    # Concurrent GitHub requests beyond which 403 with a Retry-After is answered, as the secondary rate limit.
+    # 0 is unlimited
+    'secondary_rate_limit': 0,
+    'secondary_retry_after_seconds': 1,
+    # GitHub and JIRA requests answered 503 without a Retry-After first, as by an overloaded server
+    'unavailable_requests': 0,
+    # Endpoints, such as 'GET /rest/api/latest/search', answered 400 as to a query the server rejects
+    'rejected_endpoints': [],
+    # Comments of an issue returned by a search, further ones have to be paged through
+    'search_comments': 20,
+    # Merged pull requests found by a pull request search, numbered from 1
+    'merged_prs': 100,
+    # Consecutive pull requests referencing the same issue
+    'prs_per_issue': 1,
+}
+graphql_alias_pattern = re.compile(r'(\w+): pullRequest\(number: (\d+)\) \{')
+graphql_connection_pattern = re.compile(r'(reviews|files)\(first: (\d+)(?:, after: "([^"]*)")?\)')
+jql_keys_pattern = re.compile(r'key in \(([^)]*)\)')
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeApiRequestHandler)
+        self.config = config
+        # Round trips, bytes and rate limited answers per endpoint, reset with POST /_reset
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.quota_used = 0
+        self.quota_reset_at = 0
+        self.github_requests_in_flight = 0
+        self.unavailable_requests = config['unavailable_requests']
+        # Fields of pull requests updated with PATCH, keyed by pull request number
+        self.pull_request_updates = {}
+        # Comments posted on JIRA issues, keyed by issue key
+        self.comments = {}
+        self.comment_ids = itertools.count(10000)
+        self.comments_lock = threading.Lock()
+
+    def count(self, endpoint, body_bytes, rate_limited=False):
+        with self.stats_lock:
+            stats = self.stats.setdefault(endpoint, {'calls': 0, 'bytes': 0, 'rate_limited': 0})
+            stats['calls'] += 1
+            stats['bytes'] += body_bytes
+            stats['rate_limited'] += rate_limited
+
+    def enter_github_request(self):
+        """Count a GitHub request against the rate limits.
+
+        Returns the X-RateLimit-* headers to answer with, and a (status, payload, headers) rejection if a limit is hit.
+        """
+        limit = self.config['rate_limit']
+        with self.stats_lock:
+            self.github_requests_in_flight += 1
+            secondary_rate_limit = self.config['secondary_rate_limit']
+            if secondary_rate_limit and self.github_requests_in_flight > secondary_rate_limit:
+                return {}, (403, {'message': 'You have exceeded a secondary rate limit. Please wait a few minutes '
+                                             'before you try again.'},
+                            {'Retry-After': str(self.config['secondary_retry_after_seconds'])})
+            if not limit:
+                return {}, None
+            now = time.time()
+            if now >= self.quota_reset_at:
+                self.quota_used = 0
+                self.quota_reset_at = math.ceil(now + self.config['rate_limit_window_seconds'])
+            exhausted = self.quota_used >= limit
+            if not exhausted:
+                self.quota_used += 1
+            headers = {'X-RateLimit-Limit': str(limit), 'X-RateLimit-Remaining': str(limit - self.quota_used),
+                       'X-RateLimit-Reset': str(self.quota_reset_at), 'X-RateLimit-Used': str(self.quota_used),
+                       'X-RateLimit-Resource': 'core'}
+        if exhausted:
+            return headers, (403, {'message': 'API rate limit exceeded'}, {})
+        return headers, None
+
+    def take_unavailable_request(self):
+        # Whether the request is one of the first ones answered 503
+        with self.stats_lock:
+            if self.unavailable_requests <= 0:
+                return False
+            self.unavailable_requests -= 1
+            return True
+
+    def leave_github_request(self):
+        with self.stats_lock:
+            self.github_requests_in_flight -= 1
+
+
+class FakeApiRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Method, path pattern and endpoint template of the emulated GitHub and JIRA endpoints
+    routes = [
+        ('GET', re.compile(r'/repos/([^/]+)/([^/]+)/pulls/(\d+)'), 'GET /repos/{repo}/pulls/{number}'),
+        ('GET', re.compile(r'/repos/([^/]+)/([^/]+)/pulls/(\d+)/reviews'),
+         'GET /repos/{repo}/pulls/{number}/reviews'),
+        ('GET', re.compile(r'/repos/([^/]+)/([^/]+)/pulls/(\d+)/files'), 'GET /repos/{repo}/pulls/{number}/files'),
+        ('PATCH', re.compile(r'/repos/([^/]+)/([^/]+)/pulls/(\d+)'), 'PATCH /repos/{repo}/pulls/{number}'),
+        ('POST', re.compile(r'/repos/([^/]+)/([^/]+)/issues/(\d+)/comments'),
+         'POST /repos/{repo}/issues/{number}/comments'),
+        ('POST', re.compile(r'/graphql'), 'POST /graphql'),
+        ('GET', re.compile(r'/search/issues'), 'GET /search/issues'),
+        ('GET', re.compile(r'/rest/api/latest/issue/([A-Z]+-\d+)'), 'GET /rest/api/latest/issue/{key}'),
+        ('PUT', re.compile(r'/rest/api/latest/issue/([A-Z]+-\d+)'), 'PUT /rest/api/latest/issue/{key}'),
+        ('POST', re.compile(r'/rest/api/latest/issue/([A-Z]+-\d+)/comment'),
+         'POST /rest/api/latest/issue/{key}/comment'),
+        ('GET', re.compile(r'/rest/api/latest/issue/([A-Z]+-\d+)/comment'), 'GET /rest/api/latest/issue/{key}/comment'),
+        ('PUT', re.compile(r'/rest/api/latest/issue/([A-Z]+-\d+)/comment/(\d+)'),
+         'PUT /rest/api/latest/issue/{key}/comment/{id}'),
+        ('GET', re.compile(r'/rest/api/latest/search'), 'GET /rest/api/latest/search'),
+    ]
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_PUT(self):
+        self.dispatch()
+
+    def do_PATCH(self):
+        self.dispatch()
+
+    def dispatch(self):
+        request_body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == '/_stats':
+            with self.server.stats_lock:
+                self.send_json(200, self.server.stats)
+            return
+        if url.path == '/_reset':
+            with self.server.stats_lock:
+                self.server.stats.clear()
+            self.send_json(200, {})
+            return
+        for method, path_pattern, endpoint in self.routes:
+            match = path_pattern.fullmatch(url.path)
+            if method == self.command and match:
+                self.answer(endpoint, match, query, request_body)
+                return
+        self.send_json(404, {'message': 'Not Found'})
+
+    def answer(self, endpoint, match, query, request_body):
+        is_github_request = not url_path(endpoint).startswith('/rest/')
+        rate_limit_headers, rejection = {}, None
+        if is_github_request:
+            rate_limit_headers, rejection = self.server.enter_github_request()
+        try:
+            time.sleep(self.server.config['latency_ms'] / 1000)
+            if rejection:
+                status, payload, headers = rejection
+            elif self.server.take_unavailable_request():
+                status, payload, headers = 503, {'message': 'Service Unavailable'}, {}
+                rejection = (status, payload, headers)
+            elif endpoint in self.server.config['rejected_endpoints']:
+                status, payload, headers = 400, {'errorMessages': ['Rejected by the fake server'], 'errors': {}}, {}
+            else:
+                handler = getattr(self, 'handle_' + re.sub(r'\W+', '_', endpoint.lower()).strip('_'))
+                status, payload, headers = handler(match, query, request_body)
+            body_bytes = self.send_json(status, payload, dict(rate_limit_headers, **headers))
+            self.server.count(endpoint, body_bytes, rejection is not None)
+        finally:
+            if is_github_request:
+                self.server.leave_github_request()
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if status == 200 and self.command == 'GET' and self.server.config['etag'] and \
+                self.headers.get('If-None-Match') == etag:
+            status, body = 304, b''
+        chunked = self.server.config['chunked']
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        if self.command == 'GET' and self.server.config['etag']:
+            self.send_header('ETag', etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if chunked:
+            chunk_bytes = self.server.config['chunk_bytes']
+            for start in range(0, len(body), chunk_bytes):
+                chunk = body[start:start + chunk_bytes]
+                self.wfile.write(('%x' % len(chunk)).encode() + b'\r\n' + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.wfile.write(body)
+        return len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+    def page(self, items, query):
+        per_page = int(query.get('per_page', 30))
+        page = int(query.get('page', 1))
+        headers = {}
+        if page * per_page < len(items):
+            # Other parameters, such as the query of a search, are carried over as GitHub does
+            next_url = 'http://' + self.headers['Host'] + urlsplit(self.path).path + '?' + \
+                       urlencode(dict(query, per_page=per_page, page=page + 1))
+            headers['Link'] = '<' + next_url + '>; rel="next"'
+        return 200, items[(page - 1) * per_page:page * per_page], headers
+
+    def handle_get_repos_repo_pulls_number(self, match, query, request_body):
+        return 200, generate_pull_request(self.server.config, match.group(2), int(match.group(3))), {}
+
+    def handle_get_repos_repo_pulls_number_reviews(self, match, query, request_body):
+        return self.page(generate_reviews(self.server.config, int(match.group(3))), query)
+
+    def handle_get_repos_repo_pulls_number_files(self, match, query, request_body):
+        return self.page(generate_files(self.server.config, int(match.group(3))), query)
+
+    def handle_patch_repos_repo_pulls_number(self, match, query, request_body):
+        pull_request = generate_pull_request(self.server.config, match.group(2), int(match.group(3)))
+        with self.server.stats_lock:
+            self.server.pull_request_updates.setdefault(int(match.group(3)), {}).update(json.loads(request_body))
+        pull_request.update(json.loads(request_body))
+        return 200, pull_request, {}
+
+    def handle_post_repos_repo_issues_number_comments(self, match, query, request_body):
+        return 201, {'id': int(match.group(3)), 'body': json.loads(request_body)['body']}, {}
+
+    def handle_post_graphql(self, match, query, request_body):
+        request = json.loads(request_body)
+        return 200, {'data': {'repository': answer_graphql_query(self.server.config, request['query'],
+                                                                 request['variables']['name'])}}, {}
+
+    def handle_get_search_issues(self, match, query, request_body):
+        items = [{'number': pr_number, 'title': get_pull_request_title(self.server.config, pr_number),
+                  'pull_request': {'merged_at': '2024-01-01T00:00:00Z'}}
+                 for pr_number in range(1, self.server.config['merged_prs'] + 1)]
+        status, page, headers = self.page(items, query)
+        return status, {'total_count': len(items), 'incomplete_results': False, 'items': page}, headers
+
+    def handle_get_rest_api_latest_issue_key(self, match, query, request_body):
+        return 200, generate_issue(match.group(1)), {}
+
+    def handle_put_rest_api_latest_issue_key(self, match, query, request_body):
+        return 204, None, {}
+
+    def handle_post_rest_api_latest_issue_key_comment(self, match, query, request_body):
+        comment = {'id': str(next(self.server.comment_ids)), 'body': json.loads(request_body)['body']}
+        with self.server.comments_lock:
+            self.server.comments.setdefault(match.group(1), []).append(comment)
+        return 201, comment, {}
+
+    def handle_get_rest_api_latest_issue_key_comment(self, match, query, request_body):
+        start_at = int(query.get('startAt', 0))
+        max_results = int(query.get('maxResults', 50))
+        with self.server.comments_lock:
+            comments = list(self.server.comments.get(match.group(1), []))
+        return 200, {'startAt': start_at, 'maxResults': max_results, 'total': len(comments),
+                     'comments': comments[start_at:start_at + max_results]}, {}
+
+    def handle_put_rest_api_latest_issue_key_comment_id(self, match, query, request_body):
+        with self.server.comments_lock:
+            for comment in self.server.comments.get(match.group(1), []):
+                if comment['id'] == match.group(2):
+                    comment['body'] = json.loads(request_body)['body']
+                    return 200, comment, {}
+        return 404, {'errorMessages': ['Comment ' + match.group(2) + ' not found'], 'errors': {}}, {}
+
+    def handle_get_rest_api_latest_search(self, match, query, request_body):
+        keys_match = jql_keys_pattern.search(query.get('jql', ''))
+        issue_keys = [key.strip() for key in keys_match.group(1).split(',')] if keys_match else []
+        issues = [generate_issue(issue_key) for issue_key in issue_keys]
+        if 'comment' in query.get('fields', '').split(','):
+            with self.server.comments_lock:
+                for issue in issues:
+                    comments = list(self.server.comments.get(issue['key'], []))
+                    issue['fields']['comment'] = {'startAt': 0, 'maxResults': self.server.config['search_comments'],
+                                                  'total': len(comments),
+                                                  'comments': comments[:self.server.config['search_comments']]}
+        return 200, {'startAt': 0, 'maxResults': len(issues), 'total': len(issues), 'issues': issues}, {}
+
+
+def url_path(endpoint):
+    return endpoint.split(' ', 1)[1]
+
+
+def get_issue_number(config, pr_number):
+    return (pr_number - 1) // config['prs_per_issue'] + 1
+
+
+def get_pull_request_title(config, pr_number):
+    return 'feat: JIRA-' + str(get_issue_number(config, pr_number)) + ' Change ' + str(pr_number)
+
+
+def generate_pull_request(config, repo_name, pr_number):
+    return {
+        'number': pr_number,
+        'title': get_pull_request_title(config, pr_number),
+        'body': generate_pr_body(config['corpus'], pr_number, get_issue_number(config, pr_number)),
+        'html_url': 'https://github.com/pccofvns/' + repo_name + '/pull/' + str(pr_number),
+        'base': {'ref': 'main'},
+        'merged_at': '2024-01-01T00:00:00Z',
+        'head': {'repo': {'name': repo_name}}
+    }
+
+
+def generate_reviews(config, pr_number):
+    return [{'user': {'login': 'reviewer' + str(i), 'html_url': 'https://github.com/reviewer' + str(i)},
+             'body': 'Looks good to me' if i % 2 else ''}
+            for i in range(config['reviews_per_pr'])]
+
+
+def generate_files(config, pr_number):
+    files_per_pr = config['files_per_pr']
+    # Lines of a usual width, so that the patch is as full of escaped new lines as the ones GitHub returns
+    line = '+    ' + 'x' * 74 + '\n'
+    patch = ('@@ -1 +1 @@\n' + line * (config['patch_bytes'] // len(line) + 1))[:max(12, config['patch_bytes'])]
+    files = [{'filename': 'src/main/java/com/example/module' + str(pr_number) + '/File' + str(i) + '.java',
+              'status': 'modified', 'additions': 1, 'deletions': 1, 'patch': patch}
+             for i in range(max(0, files_per_pr - 2))]
+    # Database and property changes come last, the worst case of the early exit on classified file types
+    files.extend([{'filename': 'db/migration/V' + str(pr_number) + '__change.sql', 'status': 'added',
+                   'additions': 1, 'deletions': 0, 'patch': patch},
+                  {'filename': 'config/application.properties', 'status': 'modified', 'additions': 1,
+                   'deletions': 1, 'patch': patch}][:files_per_pr])
+    return files
+
+
+def generate_issue(issue_key):
+    # Odd issue numbers are defects, even ones stories
+    issue_type = 'Defect' if int(issue_key.rsplit('-', 1)[1]) % 2 else 'Story'
+    return {'key': issue_key, 'fields': {'issuetype': {'name': issue_type}, 'parent': None,
+                                         'customfield_12345': None}}
+
+
+def answer_graphql_query(config, query, repo_name):
+    # Answers the queries of fetch_pull_request_batch_with_graphql(), cursors are offsets
+    repository = {}
+    aliases = list(graphql_alias_pattern.finditer(query))
+    for i, alias_match in enumerate(aliases):
+        selection = query[alias_match.end():aliases[i + 1].start() if i + 1 < len(aliases) else len(query)]
+        pr_number = int(alias_match.group(2))
+        node = {}
+        if 'title body' in selection:
+            pull_request = generate_pull_request(config, repo_name, pr_number)
+            node.update({'title': pull_request['title'], 'body': pull_request['body'], 'number': pr_number,
+                         'url': pull_request['html_url'], 'baseRefName': 'main',
+                         'mergedAt': pull_request['merged_at'], 'headRepository': {'name': repo_name}})
+        for connection_match in graphql_connection_pattern.finditer(selection):
+            connection, first, after = connection_match.group(1), int(connection_match.group(2)), \
+                connection_match.group(3)
+            if connection == 'reviews':
+                items = [{'author': {'login': review['user']['login'], 'url': review['user']['html_url']},
+                          'body': review['body']} for review in generate_reviews(config, pr_number)]
+            else:
+                items = [{'path': pr_file['filename']} for pr_file in generate_files(config, pr_number)]
+            start = int(after or 0)
+            end = start + first
+            node[connection] = {'pageInfo': {'hasNextPage': end < len(items), 'endCursor': str(end)},
+                                'nodes': items[start:end]}
+        repository[alias_match.group(1)] = node
+    return repository
+
+
+def start_fake_api_server(config=None, host='127.0.0.1', port=0):
+    server = FakeApiServer((host, port), dict(default_config, **(config or {})))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = ArgumentParser(description='Serve fake GitHub and JIRA REST APIs for benchmarks')
+    parser.add_argument('--host', dest='host', default='127.0.0.1', help='Address to listen on. Default is 127.0.0.1')
+    parser.add_argument('-p', '--port', dest='port', type=int, default=0,
+                        help='Port to listen on. Default is any free port')
+    parser.add_argument('-c', '--config', dest='config', type=json.loads, default={},
+                        help='JSON object overriding the defaults ' + json.dumps(default_config).replace('%', '%%'))
+    args = parser.parse_args()
+    if args.config.get('corpus', default_config['corpus']) not in corpus_kinds:
+        parser.error('corpus must be one of ' + ', '.join(corpus_kinds))
+    server = start_fake_api_server(args.config, args.host, args.port)
+    # The first line tells the benchmark where to send its requests
+    print('http://' + args.host + ':' + str(server.server_address[1]), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import random
+
+# Kinds of generated pull request bodies, from the common case to inputs that stress the parsers
+corpus_kinds = ['small', 'medium', 'large', 'pathological']
+# Approximate size in characters of the generated bodies of each kind
+corpus_sizes = {'small': 512, 'medium': 16 * 1024, 'large': 1024 * 1024, 'pathological': 1024 * 1024}
+
+PARAGRAPH = ('The **cache** of `UserService` was not invalidated when the `user_id` of a session changed, so '
+             'stale profiles were served until the entry expired.\n')
+LIST_ITEMS = '- Invalidate the cache in `UserService.update()`\n- [x] Unit tests\n- [ ] Load tests\n'
+CODE_BLOCK = '```java\n// **not bold** inside code\ncache.invalidate(userId);\n```\n'
+
+
+def generate_pr_body(kind, pr_number=1, issue_number=None):
+    """Generate a pull request body following the pull request template, valid for the linter.
+
+    The body references the issue JIRA-<issue_number>, by default the one numbered as the pull request.
+    """
+    issue_key = 'JIRA-' + str(issue_number or pr_number)
+    if kind not in corpus_sizes:
+        raise ValueError('Unknown corpus kind ' + kind + '. Supported kinds are ' + ', '.join(corpus_kinds))
+    size = corpus_sizes[kind]
+    if kind == 'pathological':
+        # Any heading ends the sub-section, so the sub-section starts with text of its own
+        code_changes = PARAGRAPH + generate_pathological_text(size, pr_number)
+    else:
+        code_changes = fill(PARAGRAPH + LIST_ITEMS + CODE_BLOCK, size)
+    return ('## Description of Changes\n'
+            '### RCA\n'
+            'Root cause of ' + issue_key + ': ' + PARAGRAPH +
+            '### Code Changes\n' +
+            code_changes +
+            '### Impact Analysis\n'
+            'Only the user service of pull request ' + str(pr_number) + ' is affected.\n'
+            '## Issue ticket number(s)\n' +
+            issue_key + '\n'
+            '## Tests\n' +
+            LIST_ITEMS)
+
+
+def generate_pathological_text(size, pr_number):
+    # Deterministic for a pull request, so that runs of different commits parse the same input
+    rng = random.Random(pr_number)
+    fragments = [
+        # Heading markers that are not at the start of a line, and headings that are not in the template
+        'a ## b ### c #### d\n',
+        '## Not a template section\n',
+        '###### h6 is not converted\n',
+        '####### seven hashes\n',
+        # Unbalanced inline code and bold markers
+        'unbalanced ` back tick and ** bold\n',
+        '``` not a fence in the middle of a line\n',
+        # Issue keys of the project and of other projects, and lookalikes
+        'JIRA-1 OTHER-2 jira 3 JIRA-4JIRA-5 XJIRA-6\n',
+        # Near misses of the non compliant template comments
+        '<!--- Describe the code changes -->\n',
+        # Windows line endings and trailing white space
+        'windows line\r\n',
+        '   \t  \n',
+        '- [ ]- [x]- [ ]\n',
+    ]
+    parts = []
+    length = 0
+    while length < size // 2:
+        fragment = rng.choice(fragments)
+        parts.append(fragment)
+        length += len(fragment)
+    # A single very long line, as left by pasted logs or minified files
+    parts.append('x' * (size - length) + '\n')
+    return ''.join(parts)
+
+
+def fill(text, size):
+    return text * max(1, size // len(text))
@@ -0,0 +1,136 @@
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from contextlib import closing
+
+# Seconds a git command, other than one whose output is streamed, may take before the local clone is given up on
+git_timeout = 120
+# Bytes read at a time from the output of a streamed git command
+git_chunk_size = 64 * 1024
+# Statuses of git diff --name-status, named as the GitHub API names the status of a pull request file
+git_file_statuses = {'A': 'added', 'C': 'copied', 'D': 'removed', 'M': 'modified', 'R': 'renamed', 'T': 'changed'}
+# Owner and name of a GitHub repository at the end of a remote URL, of the https, ssh or scp-like kind
+remote_repository_pattern = re.compile(r'[/:]([^/:]+/[^/]+?)(?:\.git)?/?$')
+# Top-level directory of the clone each directory is in, and the repository its origin remote points to
+local_clones = {}
+local_clones_lock = threading.Lock()
+# Fetches in the same clone are not run concurrently, they would compete for its lock files
+fetch_lock = threading.Lock()
+
+
+def run_git(clone_dir, *git_args):
+    """Run git in clone_dir. Returns the completed process, None if git is missing or took too long."""
+    try:
+        return subprocess.run(['git', '-C', clone_dir] + list(git_args), stdin=subprocess.DEVNULL,
+                              capture_output=True, timeout=git_timeout)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def get_local_clone(repository, directory=None):
+    """Top-level directory of the clone directory is in if its origin remote is the GitHub repository owner/name,
+    None otherwise."""
+    directory = os.path.abspath(directory or os.getcwd())
+    with local_clones_lock:
+        if directory not in local_clones:
+            local_clones[directory] = find_local_clone(directory)
+    clone = local_clones[directory]
+    if clone and clone[1].lower() == repository.lower():
+        return clone[0]
+    return None
+
+
+def find_local_clone(directory):
+    completed = run_git(directory, 'rev-parse', '--show-toplevel')
+    if not completed or completed.returncode != 0:
+        return None
+    clone_dir = os.fsdecode(completed.stdout.rstrip(b'\n'))
+    completed = run_git(clone_dir, 'config', '--get', 'remote.origin.url')
+    if not completed or completed.returncode != 0:
+        return None
+    match = remote_repository_pattern.search(os.fsdecode(completed.stdout.strip()))
+    return (clone_dir, match.group(1)) if match else None
+
+
+def has_local_commits(clone_dir, revisions):
+    for revision in revisions:
+        completed = run_git(clone_dir, 'cat-file', '-e', revision + '^{commit}')
+        if not completed or completed.returncode != 0:
+            return False
+    return True
+
+
+def ensure_local_commits(clone_dir, revisions, refs):
+    """Whether the clone holds the commits revisions, fetching refs from origin when it does not."""
+    if has_local_commits(clone_dir, revisions):
+        return True
+    with fetch_lock:
+        # Fetched by another thread in the meantime
+        if has_local_commits(clone_dir, revisions):
+            return True
+        # Refs come from the GitHub API, one starting with - must not be taken for an option
+        completed = run_git(clone_dir, 'fetch', '--quiet', '--no-tags', '--end-of-options', 'origin', *refs)
+        if not completed or completed.returncode != 0:
+            return False
+    return has_local_commits(clone_dir, revisions)
+
+
+def has_merge_base(clone_dir, base, head):
+    # Shallow clones, such as the ones actions/checkout makes by default, may not reach the commit both started from
+    completed = run_git(clone_dir, 'merge-base', base, head)
+    return bool(completed) and completed.returncode == 0
+
+
+def iter_git_records(clone_dir, *git_args):
+    """Stream the NUL separated records git writes, as text, while git is still running.
+
+    git is stopped when the records are not read to the end.
+    """
+    # A file rather than a pipe, which git would block on once full of warnings, as stdout is only read
+    error_file = tempfile.TemporaryFile()
+    process = subprocess.Popen(['git', '-C', clone_dir] + list(git_args), stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=error_file)
+    try:
+        pending = b''
+        for chunk in iter(lambda: process.stdout.read1(git_chunk_size), b''):
+            records = (pending + chunk).split(b'\0')
+            pending = records.pop()
+            for record in records:
+                yield os.fsdecode(record)
+        if pending:
+            yield os.fsdecode(pending)
+        process.wait()
+        if process.returncode != 0:
+            error_file.seek(0)
+            raise Exception('git ' + ' '.join(git_args) + ' failed. Error: ' +
+                            os.fsdecode(error_file.read()).strip())
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        error_file.close()
+
+
+def iter_local_changed_files(clone_dir, base, head):
+    """Stream the files changed from the commit base and head started from to head, as the GitHub API lists the
+    files of a pull request: {filename, status}, with the new name of renamed files."""
+    with closing(iter_git_records(clone_dir, 'diff', '--name-status', '-z', '--find-renames', '--no-ext-diff',
+                                  '--end-of-options', base + '...' + head, '--')) as records:
+        for status in records:
+            filename = next(records)
+            if status[0] in 'RC':
+                # Renamed and copied files are followed by the old name and the new one
+                filename = next(records)
+            yield {'filename': filename, 'status': git_file_statuses.get(status[0], 'changed')}
+
+
+def iter_local_commits(clone_dir, revision_range, no_merges=False):
+    """Stream the commits of revision_range, such as BASE..HEAD, as {sha, subject}, newest first."""
+    git_args = ['log', '-z', '--format=%H%x00%s'] + (['--no-merges'] if no_merges else []) + \
+        ['--end-of-options', revision_range, '--']
+    with closing(iter_git_records(clone_dir, *git_args)) as records:
+        for sha in records:
+            yield {'sha': sha, 'subject': next(records)}
@@ -0,0 +1,197 @@
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from github_pull_request_linter import eprint, lint_pull_request
+
+# Pull request actions that are linted. Others, such as closed or labeled, are acknowledged and ignored
+linted_actions = ['opened', 'synchronize', 'reopened', 'edited']
+# Seconds to wait for further events of the same pull request before linting it
+default_debounce_seconds = 2.0
+default_workers = 4
+# Largest payload read, the limit of GitHub for webhook payloads. Larger ones are rejected before being read
+max_payload_bytes = 25 * 1024 * 1024
+
+server_properties = {}
+# Debounce timers of pull requests waiting to be linted, keyed by repository and pull request number
+pending_lints = {}
+pending_lints_lock = threading.Lock()
+lint_executor = None
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        try:
+            content_length = int(self.headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            content_length = -1
+        if content_length < 0:
+            self.send_text(400, 'Invalid Content-Length')
+            return
+        if content_length > max_payload_bytes:
+            self.send_text(413, 'Payload too large')
+            return
+        payload_bytes = self.rfile.read(content_length)
+        if not is_valid_signature(server_properties.get('secret'), payload_bytes,
+                                  self.headers.get('X-Hub-Signature-256')):
+            self.send_text(401, 'Invalid signature')
+            return
+        event = self.headers.get('X-GitHub-Event')
+        if event == 'ping':
+            self.send_text(200, 'pong')
+            return
+        try:
+            payload = json.loads(payload_bytes)
+        except ValueError:
+            self.send_text(400, 'Invalid JSON payload')
+            return
+        if event != 'pull_request' or not isinstance(payload, dict) or payload.get('action') not in linted_actions:
+            self.send_text(200, 'Ignored')
+            return
+        pull_request_key = get_pull_request_key(payload)
+        if not pull_request_key:
+            self.send_text(400, 'Invalid pull_request payload')
+            return
+        if pull_request_key[0].lower() not in server_properties['repositories']:
+            self.send_text(403, 'Repository not linted by this server')
+            return
+        schedule_lint(pull_request_key, payload)
+        self.send_text(202, 'Accepted')
+
+    def send_text(self, status, text):
+        body = text.encode()
+        self.send_response(status)
+        if status in (400, 413):
+            # The body of the request was not read, the connection can not be reused
+            self.close_connection = True
+            self.send_header('Connection', 'close')
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print(f'{self.address_string()} - {format % args}')
+
+
+def is_valid_signature(secret, payload_bytes, signature_header):
+    if not secret or not signature_header or not signature_header.startswith('sha256='):
+        return False
+    expected_signature = hmac.new(secret.encode(), payload_bytes, hashlib.sha256).hexdigest()
+    return hmac.compare_digest('sha256=' + expected_signature, signature_header)
+
+
+def get_pull_request_key(payload):
+    # Repository and number of the pull request of a payload holding what linting it reads, None otherwise
+    repository = payload.get('repository')
+    pull_request = payload.get('pull_request')
+    if not isinstance(repository, dict) or not isinstance(pull_request, dict) or \
+            not isinstance(pull_request.get('head'), dict):
+        return None
+    repo_name = repository.get('full_name')
+    pr_number = pull_request.get('number')
+    if not isinstance(repo_name, str) or not isinstance(pr_number, int) or isinstance(pr_number, bool) or \
+            not isinstance(pull_request['head'].get('ref'), str):
+        return None
+    return repo_name, pr_number
+
+
+def schedule_lint(pull_request_key, payload):
+    # A burst of edited/synchronize events of a pull request is linted once, with the payload of the last event
+    with pending_lints_lock:
+        if pull_request_key in pending_lints:
+            pending_lints[pull_request_key].cancel()
+        timer = threading.Timer(server_properties.get('debounce', default_debounce_seconds), submit_lint,
+                                args=(pull_request_key, payload))
+        timer.daemon = True
+        pending_lints[pull_request_key] = timer
+        timer.start()
+
+
+def submit_lint(pull_request_key, payload):
+    with pending_lints_lock:
+        if pending_lints.get(pull_request_key) is threading.current_thread():
+            del pending_lints[pull_request_key]
+    lint_executor.submit(lint_webhook_payload, payload)
+
+
+def lint_webhook_payload(payload):
+    pull_request = payload['pull_request']
+    repo_name = payload['repository']['full_name']
+    pr_number = pull_request['number']
+    try:
+        is_valid_pr, new_pr_title = lint_pull_request(pull_request.get('title') or '', pull_request.get('body') or '',
+                                                      pull_request['head']['ref'], repo_name=repo_name,
+                                                      pr_number=pr_number)
+        print(f'{repo_name}#{pr_number}: PR is {"valid" if is_valid_pr else "invalid"}'
+              + (f', title updated to: {new_pr_title}' if new_pr_title else ''))
+        return is_valid_pr
+    except Exception as e:
+        eprint(f'{repo_name}#{pr_number}: Error while linting. Error: {e}')
+        return False
+
+
+def parse_cli_arguments():
+    parser = ArgumentParser(description='Lint pull requests from GitHub pull_request webhook events')
+    parser.add_argument('--host', dest='host', action='store', type=str,
+                        required=False, default='127.0.0.1',
+                        help='Address to listen on. Default is 127.0.0.1, behind a reverse proxy forwarding the '
+                             'webhook events')
+    parser.add_argument('-p', '--port', dest='port', action='store', type=int,
+                        required=False, default=8080, help='Port to listen on. Default is 8080')
+    parser.add_argument('-s', '--secret', dest='secret', action='store', type=str,
+                        required=False, default=os.environ.get('GITHUB_WEBHOOK_SECRET'),
+                        help='Webhook secret used to verify X-Hub-Signature-256. Required, default is '
+                             '$GITHUB_WEBHOOK_SECRET')
+    parser.add_argument('-r', '--repos', dest='repos', action='store', type=str,
+                        required=False, default=os.environ.get('GITHUB_WEBHOOK_REPOSITORIES'),
+                        help='Comma separated owner/name of the repositories whose pull requests are linted. Events '
+                             'of other repositories are rejected. Required, default is $GITHUB_WEBHOOK_REPOSITORIES')
+    parser.add_argument('-w', '--workers', dest='workers', action='store', type=int,
+                        required=False, default=default_workers,
+                        help='Number of pull requests linted concurrently. Default is ' + str(default_workers))
+    parser.add_argument('-d', '--debounce', dest='debounce', action='store', type=float,
+                        required=False, default=default_debounce_seconds,
+                        help='Seconds to wait for further events of a pull request before linting it. Default is '
+                             + str(default_debounce_seconds))
+    server_properties.update(parser.parse_args().__dict__)
+    # Events lead to pull request titles being updated with the token of the server, only signed ones are trusted
+    if not server_properties['secret']:
+        parser.error('a webhook secret is required, with -s/--secret or $GITHUB_WEBHOOK_SECRET')
+    server_properties['repositories'] = {repository.strip().lower()
+                                         for repository in (server_properties['repos'] or '').split(',')
+                                         if repository.strip()}
+    if not server_properties['repositories']:
+        parser.error('the repositories to lint are required, with -r/--repos or $GITHUB_WEBHOOK_REPOSITORIES')
+
+
+def start_server(host, port, workers):
+    global lint_executor
+    lint_executor = ThreadPoolExecutor(max_workers=workers)
+    return ThreadingHTTPServer((host, port), WebhookRequestHandler)
+
+
+def main():
+    parse_cli_arguments()
+    server = start_server(server_properties['host'], server_properties['port'], server_properties['workers'])
+    print(f'Listening for pull_request events on {server_properties["host"]}:{server_properties["port"]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        lint_executor.shutdown(wait=True)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,29 @@
-from jira_utils import *
+import io
+import json
+import os
 import re
+import sys
+import time
+from argparse import ArgumentParser
+from collections import deque
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+
+# The JIRA client is imported only when an issue type has to be looked up, see get_conventional_commit_type(). The
+# HTTP stack behind update_pull_request_title() is imported only when the title is actually updated
+from api_report import add_api_report_arguments, enable_api_report
+from snapshot_store import add_snapshot_arguments, enable_snapshot
+from github_pull_request_utils import *
 
 DEFAULT_TEST_CASE_RUN_MESSAGE = "This the detail of the first test case that you've run. You can add more below."
 
 issue_pattern = '^(JIRA|MYPROJECT|TECHOPS)-[0-9]+$'
 properties = {}
+NON_COMPLIANT_TEXT = 'non_compliant_text'
+ISSUE_KEY = 'issue_key'
 commit_regex = r'^(feat|fix|docs|style|refactor|perf|test|ops|chore|ci)(\(\w+\))?!?:\s.*$'
+# Compiled once, for PR titles and for every commit subject of a commit range
+commit_pattern = re.compile(commit_regex)
 conventional_commit_types = ['feat', 'fix', 'docs', 'style', 'refactor', 'perf', 'test', 'ops', 'chore', 'ci']
 jira_issue_type_conventional_commit_type_mapping = {
     'User Story': 'feat',
@@ -25,61 +43,79 @@ branch_name_conventional_commit_type_mapping = {
     'defect': 'fix',
     'documentation': 'docs',
 }
-non_compliant_texts = [
-    '<!--- Root Cause Analysis. The title of the story shall be enough in case the changes are related to a user story -->',
-    '<!--- Describe the code changes done to implement the story or to fix the defect-->',
-    '<!--- Describe the impact of this change on other modules and/features -->',
-    'JIRA-0000'
-]
+# Rules checked against pull request titles and bodies. Compiled by load_lint_rules()
+default_lint_rules_path = Path(__file__).resolve().with_name('pull_request_lint_rules.json')
+lint_rules = {}
+branch_prefix_pattern = re.compile(r'\w+/')
+# Number of JSONL records sent to a worker process at once in batch mode
+batch_chunk_size = 64
+# Seconds between two progress reports in batch mode
+batch_progress_interval = 2
+# Messages about problems that do not make a pull request invalid, collected by warn() while a batch record is linted
+batch_warnings = None
 
 
 def lint():
-    pull_request = {}
     pr_title_path = Path(properties['pt'])
     pr_title = pr_title_path.read_text()
     pr_body_path = Path(properties['pb'])
     pr_body = pr_body_path.read_text()
+    is_valid_pr, new_pr_title = lint_pull_request(pr_title, pr_body, offline=properties.get('offline'))
+    return is_valid_pr
+
 
-    # check for unwanted texts in PR body
-    unwanted_texts = collect_non_compliant_texts(pr_body)
-    if unwanted_texts:
+def lint_pull_request(pr_title, pr_body, branch_name=None, offline=False, repo_name=None, pr_number=None):
+    """Lint a pull request title and body.
+
+    Returns whether the pull request is valid and the title it should be updated to, if any. The title is updated on
+    GitHub unless offline, in which case the JIRA issue type is only taken from the issue types cached earlier.
+    repo_name and pr_number default to the pull request of the GitHub Actions run.
+    """
+    pull_request = {}
+    # Non compliant texts and issue keys of the whole body in a single scan
+    pr_body_hits = scan_text(pr_body)
+    unwanted_text_hits = [hit for hit in pr_body_hits if hit['rule'] == NON_COMPLIANT_TEXT]
+    if unwanted_text_hits:
         eprint(f'Found below unwanted text(s) in PR body')
-        for unwanted_text in unwanted_texts:
-            eprint(f'\'{unwanted_text}\'')
+        for hit in unwanted_text_hits:
+            eprint(f'\'{hit["text"]}\' at line {hit["line"]}')
         eprint(f'Please remove the unwanted text(s) from PR body')
-        return False
+        return False, None
 
     new_pr_title = ' '.join(pr_title.strip().split())
-    new_pr_title = re.sub(r'\w+/', '', new_pr_title)
+    new_pr_title = branch_prefix_pattern.sub('', new_pr_title)
     new_pr_title = capitalize_jira_project_name(new_pr_title)
     new_pr_title = ' '.join(new_pr_title.split())
-    new_pr_title = re.sub(r'\w+/', '', new_pr_title)
     new_pr_title = new_pr_title.strip()
-    issue_keys_in_title = find_specific_issue_keys(new_pr_title)
-    pull_request[DESCRIPTION_OF_CHANGES] = extract_description_from_pr_body(pr_body)
-    pull_request[ISSUES] = extract_issue_ticket_numbers_from_pr_body(pr_body)
-    pull_request[TESTS] = extract_tests_from_pr_body(pr_body)
-    populate_sub_headings_of_description(pull_request, pull_request[DESCRIPTION_OF_CHANGES])
+    issue_keys_in_title = find_issue_keys(new_pr_title)
+    sections = parse_pr_body_sections(pr_body)
+    if any(header not in sections for header in pull_request_template_headers):
+        mandatory_sections = ', '.join(f'"{header}"' for header in pull_request_template_headers)
+        eprint(f'Missing mandatory sections {mandatory_sections} in PR body')
+        return False, None
+    pull_request[DESCRIPTION_OF_CHANGES] = get_section_content(sections, DESCRIPTION_OF_CHANGES_HEADING)
+    pull_request[ISSUES] = get_section_content(sections, ISSUE_TICKET_NUMBER_HEADING)
+    pull_request[ISSUE_KEYS] = hits_in_section(pr_body_hits, ISSUE_KEY, sections[ISSUE_TICKET_NUMBER_HEADING])
+    pull_request[TESTS] = get_section_content(sections, TESTS_HEADING)
+    populate_sub_headings_of_description(pull_request, sections)
     # check if any of these two subheadings are same
-    if pull_request[RCA] == pull_request[CODE_CHANGES] or pull_request[RCA] == pull_request[IMPACT_ANALYSIS] or pull_request[CODE_CHANGES] == pull_request[IMPACT_ANALYSIS]:
+    sub_heading_texts = [pull_request[key] for key in (RCA, CODE_CHANGES, IMPACT_ANALYSIS) if pull_request.get(key)]
+    if len(set(sub_heading_texts)) != len(sub_heading_texts):
         eprint(f'Root Cause Analysis, Code Changes, and Impact Analysis should be different')
-        return False
+        return False, None
     if not issue_keys_in_title or len(issue_keys_in_title) == 0:
-        eprint(f'Missing JIRA number in title \'{pr_title}\'')
-        issue_keys_in_pr_body = find_specific_issue_keys(pull_request[ISSUES].strip())
+        warn(f'Missing JIRA number in title \'{pr_title}\'')
+        issue_keys_in_pr_body = list(pull_request[ISSUE_KEYS])
         remove_unwanted_issue_keys(issue_keys_in_pr_body)
         if len(issue_keys_in_pr_body) == 0:
             eprint(f'Missing JIRA number in PR body and title')
-            return False
+            return False, None
         else:
             new_pr_title = update_pr_title_with_issue_key(issue_keys_in_pr_body, issue_keys_in_title, new_pr_title)
-    if DESCRIPTION_OF_CHANGES_HEADING not in pr_body or ISSUE_TICKET_NUMBER_HEADING not in pr_body or TESTS_HEADING not in pr_body:
-        eprint(f'Missing mandatory sections "## Description of Changes", "## Issue ticket number(s)", and "## Tests" in PR body')
-        return False
 
     is_valid_pr = validate(pull_request)
     if not is_valid_pr:
-        return False
+        return False, None
     pr_update_needed = False
     if new_pr_title != pr_title:
         print(f'PR title needs to be updated to: {new_pr_title}')
@@ -88,20 +124,22 @@ def lint():
     print(f'Is conventional commit: {is_conventional_commit}')
     if not pr_update_needed and is_conventional_commit:
         print('PR title is already in conventional commit format and no update is needed')
-        return True
+        return True, None
 
     if not is_conventional_commit:
         print(f'PR title \'{new_pr_title}\' is not in conventional commit format')
-        conventional_commit_type = get_conventional_commit_type(issue_keys_in_title)
+        conventional_commit_type = get_conventional_commit_type(issue_keys_in_title, branch_name, offline)
         new_pr_title = conventional_commit_type + ': ' + new_pr_title
         print(f'Will have to update PR title to: {new_pr_title}')
         pr_update_needed = True
 
     # Update GitHub PR title using GitHub REST API via Python requests module
-    if pr_update_needed:
+    if pr_update_needed and offline:
+        print(f'PR update needed. Offline, not updating PR title to: {new_pr_title}')
+    elif pr_update_needed:
         print(f'PR update needed. Updating PR title to: {new_pr_title}')
-        update_pull_request_title(new_pr_title)
-    return True
+        update_pull_request_title(new_pr_title, repo_name, pr_number)
+    return True, new_pr_title if pr_update_needed else None
 
 
 def update_pr_title_with_issue_key(issue_keys_in_pr_body, issue_keys_in_title, new_pr_title):
@@ -118,18 +156,71 @@ def update_pr_title_with_issue_key(issue_keys_in_pr_body, issue_keys_in_title, n
     return new_pr_title
 
 
+def warn(message):
+    eprint(message)
+    if batch_warnings is not None:
+        batch_warnings.extend(message.splitlines())
+
+
 def capitalize_jira_project_name(pr_title):
-    text = pr_title
-    for project in specified_projects_keys:
-        # Create a regex pattern to match any prefix followed by the project name and a numerical ID
-        pattern = re.compile(r'(\S+)?\s*(' + project + r')\s+(\d+)', re.IGNORECASE)
-        # Replace the found pattern with the correct format
-        text = pattern.sub(lambda m: (m.group(1) + ' ' if m.group(1) else '') + m.group(2).upper() + '-' + m.group(3), text)
-    return text
+    # Replace any prefix followed by a project name and a numerical ID with the issue key format
+    return lint_rules['project_name_pattern'].sub(
+        lambda m: (m.group(1) + ' ' if m.group(1) else '') + m.group(2).upper() + '-' + m.group(3), pr_title)
 
 
-def get_conventional_commit_type(issue_keys_in_title):
-    branch_name = os.environ['BRANCH_NAME']
+def load_lint_rules(path):
+    """Load the lint rules from a JSON file and compile them once into the patterns used by lint()."""
+    rules = json.loads(Path(path).read_text())
+    project_keys = rules.get('project_keys', specified_projects_keys)
+    # Longest first, so that a text that contains another one is reported as a whole
+    non_compliant_texts = sorted(rules.get('non_compliant_texts', []), key=len, reverse=True)
+    project_keys_pattern = '|'.join(re.escape(project_key) for project_key in project_keys)
+    issue_key_regex = r'\b(?:' + project_keys_pattern + r')-\d+\b'
+    non_compliant_texts_regex = '|'.join(re.escape(text) for text in non_compliant_texts) or '(?!)'
+    lint_rules.clear()
+    lint_rules.update({
+        'path': str(path),
+        'non_compliant_texts': rules.get('non_compliant_texts', []),
+        'issue_key_pattern': re.compile(issue_key_regex),
+        # Every rule in a single alternation, so that a text is scanned once for all of them
+        'text_pattern': re.compile('(?P<' + NON_COMPLIANT_TEXT + '>' + non_compliant_texts_regex + ')|(?P<' +
+                                   ISSUE_KEY + '>' + issue_key_regex + ')'),
+        'project_name_pattern': re.compile(r'(\S+)?\s*(' + project_keys_pattern + r')\s+(\d+)', re.IGNORECASE)
+    })
+
+
+def scan_text(text):
+    """Find every non compliant text and issue key in text in a single pass.
+
+    Returns hits as dicts with the rule, the matched text, its position in text and its line number, in text order.
+    """
+    hits = []
+    line = 1
+    last_position = 0
+    for match in lint_rules['text_pattern'].finditer(text):
+        line += text.count('\n', last_position, match.start())
+        last_position = match.start()
+        hits.append({'rule': match.lastgroup, 'text': match.group(), 'position': match.start(), 'line': line})
+        if match.lastgroup == NON_COMPLIANT_TEXT:
+            # Issue keys within a non compliant text, such as JIRA-0000, are issue keys as well
+            for issue_key_match in lint_rules['issue_key_pattern'].finditer(match.group()):
+                hits.append({'rule': ISSUE_KEY, 'text': issue_key_match.group(),
+                             'position': match.start() + issue_key_match.start(), 'line': line})
+    return hits
+
+
+def hits_in_section(hits, rule, section):
+    return [hit['text'] for hit in hits
+            if hit['rule'] == rule and section['content_start'] <= hit['position'] < section['end']]
+
+
+def find_issue_keys(text):
+    return lint_rules['issue_key_pattern'].findall(text)
+
+
+def get_conventional_commit_type(issue_keys_in_title, branch_name=None, offline=False):
+    if branch_name is None:
+        branch_name = os.environ['BRANCH_NAME']
     print(f'Branch name: {branch_name}')
     conventional_commit_type = get_commit_type_from_branch_name(branch_name)
     issue_key = issue_keys_in_title[0]
@@ -140,14 +231,19 @@ def get_conventional_commit_type(issue_keys_in_title):
     if not conventional_commit_type:
         print('Need to update PR title using JIRA details to match conventional commit pattern')
         try:
-            issue_type, issue_key = get_issue_type({}, issue_key)
+            if offline:
+                from jira_utils import get_issue_type_offline
+                issue_type, issue_key = get_issue_type_offline(issue_key)
+            else:
+                from jira_utils import get_issue_type
+                issue_type, issue_key = get_issue_type({}, issue_key)
             print(f'Issue type: {issue_type} and issue key: {issue_key} and original issue key: {original_issue_key}')
             if not conventional_commit_type:
                 conventional_commit_type = jira_issue_type_conventional_commit_type_mapping[issue_type]
         except Exception as e:
-            eprint(f'Unable to determine conventional commit type for issue key {issue_key}. Error: {e}')
+            warn(f'Unable to determine conventional commit type for issue key {issue_key}. Error: {e}')
     if not conventional_commit_type:
-        eprint(f'Unable to determine conventional commit type for issue key {issue_key}')
+        warn(f'Unable to determine conventional commit type for issue key {issue_key}')
         conventional_commit_type = 'chore'
     print(f'Conventional commit type: {conventional_commit_type}')
     return conventional_commit_type
@@ -184,8 +280,7 @@ def validate(pull_request):
     if IMPACT_ANALYSIS not in pull_request or not pull_request[IMPACT_ANALYSIS].strip():
         eprint(f'Mandatory sub-section "Impact Analysis" can not be empty')
         return False
-    issues_text = pull_request[ISSUES]
-    issues = find_specific_issue_keys(issues_text)
+    issues = pull_request[ISSUE_KEYS] if ISSUE_KEYS in pull_request else find_issue_keys(pull_request[ISSUES])
     if len(issues) != 0 and ('JIRA-0000' in issues):
         eprint('Invalid Issues JIRA-0000')
         return False
@@ -196,29 +291,185 @@ def validate(pull_request):
 
 def is_valid_conventional_commit(message):
     """Check if the commit message is valid according to the conventional commits pattern."""
-    return re.match(commit_regex, message.strip()) is not None
+    return commit_pattern.match(message.strip()) is not None
+
+
+def lint_commits(revision_range):
+    """Lint the subject of every commit of revision_range, such as BASE..HEAD, in the clone the linter runs in.
+
+    Commits are read from git log while it writes them and invalid ones reported as they are found, so that memory
+    stays flat on ranges of thousands of commits. Merge commits are not linted. Returns whether every commit is valid.
+    """
+    started_at = time.monotonic()
+    commit_count = 0
+    invalid_count = 0
+    for commit in iter_local_commits(os.getcwd(), revision_range, no_merges=True):
+        commit_count += 1
+        reasons = lint_commit_subject(commit['subject'])
+        if reasons:
+            invalid_count += 1
+            eprint(f'{commit["sha"][:12]} \'{commit["subject"]}\': {", ".join(reasons)}')
+    elapsed = time.monotonic() - started_at
+    eprint(f'Linted {commit_count} commits of {revision_range} in {elapsed:.1f}s, {invalid_count} invalid')
+    return invalid_count == 0
+
+
+def lint_commit_subject(subject):
+    """Reasons the commit subject is invalid, none if it is valid."""
+    reasons = []
+    if not is_valid_conventional_commit(subject):
+        reasons.append('not in conventional commit format')
+    issue_keys = find_issue_keys(subject)
+    if not issue_keys:
+        reasons.append('missing JIRA number')
+    elif 'JIRA-0000' in issue_keys:
+        reasons.append('invalid issue JIRA-0000')
+    return reasons
 
 
 def collect_non_compliant_texts(text):
-    found_texts = []
-    for non_compliant_text in non_compliant_texts:
-        if non_compliant_text in text:
-            found_texts.append(non_compliant_text)
-    return found_texts
+    found_texts = {hit['text'] for hit in scan_text(text) if hit['rule'] == NON_COMPLIANT_TEXT}
+    return [non_compliant_text for non_compliant_text in lint_rules['non_compliant_texts']
+            if non_compliant_text in found_texts]
+
+
+def lint_batch(batch_path, output_path, workers):
+    """Lint every record of a JSONL file of pull requests on a pool of processes, offline.
+
+    Records are {"title": ..., "body": ..., "branch": ...}. One verdict per record is written to output_path in the
+    order of the records, with the other fields of the record, whether it is valid, the title it should have and the
+    reasons it is not valid. Warnings are kept apart from the reasons, valid records can have some.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    started_at = time.monotonic()
+    reported_at = started_at
+    record_count = 0
+    invalid_count = 0
+    output = sys.stdout if output_path == '-' else open(output_path, 'w')
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_lint_rules,
+                                 initargs=(lint_rules['path'],)) as executor:
+            for verdicts in map_in_order(executor, lint_jsonl_lines, iter_line_chunks(batch_path), workers * 2):
+                for verdict in verdicts:
+                    output.write(json.dumps(verdict) + '\n')
+                    record_count += 1
+                    invalid_count += 0 if verdict['valid'] else 1
+                if time.monotonic() - reported_at >= batch_progress_interval:
+                    reported_at = time.monotonic()
+                    eprint(f'Linted {record_count} records, {record_count / (reported_at - started_at):.0f} records/s')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.monotonic() - started_at
+    eprint(f'Linted {record_count} records in {elapsed:.1f}s, {record_count / max(elapsed, 1e-9):.0f} records/s, '
+           f'{invalid_count} invalid')
+
+
+def iter_line_chunks(path):
+    chunk = []
+    with open(path, 'r') as batch_file:
+        for line in batch_file:
+            if line.strip():
+                chunk.append(line)
+            if len(chunk) == batch_chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def map_in_order(executor, function, items, max_pending):
+    # Like executor.map, but only max_pending items are read ahead so that memory stays flat on large inputs
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def lint_jsonl_lines(lines):
+    return [lint_jsonl_line(line) for line in lines]
+
+
+def lint_jsonl_line(line):
+    global batch_warnings
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return {'valid': False, 'new_title': None, 'reasons': [], 'warnings': [],
+                'error': f'Invalid JSON record: {e}'}
+    verdict = {key: value for key, value in record.items() if key not in ('title', 'body', 'branch')}
+    output = io.StringIO()
+    messages = io.StringIO()
+    batch_warnings = []
+    try:
+        with redirect_stdout(output), redirect_stderr(messages):
+            is_valid_pr, new_pr_title = lint_pull_request(record.get('title') or '', record.get('body') or '',
+                                                          record.get('branch') or '', offline=True)
+        verdict.update({'valid': is_valid_pr, 'new_title': new_pr_title})
+    except Exception as e:
+        verdict.update({'valid': False, 'new_title': None, 'error': str(e)})
+    reasons = messages.getvalue().splitlines()
+    for warning in batch_warnings:
+        reasons.remove(warning)
+    verdict.update({'reasons': reasons, 'warnings': batch_warnings})
+    batch_warnings = None
+    return verdict
 
 
 def parse_cli_arguments():
     parser = ArgumentParser()
     parser.add_argument('-t', '--pt', dest='pt', action='store', type=str,
-                        required=True, help='Path to Pull Request title file')
+                        required=False, help='Path to Pull Request title file')
     parser.add_argument('-b', '--pb', dest='pb', action='store', type=str,
-                        required=True, help='Path to Pull Request body file')
+                        required=False, help='Path to Pull Request body file')
+    parser.add_argument('-r', '--rules', dest='rules', action='store', type=str,
+                        required=False, default=str(default_lint_rules_path),
+                        help='Path to the JSON file of lint rules. Default is ' + default_lint_rules_path.name)
+    parser.add_argument('--offline', dest='offline', action='store_true',
+                        required=False,
+                        help='Never call GitHub or JIRA. The PR title is not updated and the JIRA issue type is only '
+                             'taken from the issue types cached by earlier runs')
+    parser.add_argument('--batch', dest='batch', action='store', type=str,
+                        required=False,
+                        help='Path to a JSONL file of pull requests {"title", "body", "branch"} to lint offline')
+    parser.add_argument('--commits', dest='commits', action='store', type=str,
+                        required=False,
+                        help='Range of commits, such as BASE..HEAD, whose subjects are linted instead of a PR, in the '
+                             'git clone the linter runs in')
+    parser.add_argument('-o', '--output', dest='output', action='store', type=str,
+                        required=False, default='-',
+                        help='Path to the JSONL file the batch verdicts are written to. Default is standard output')
+    parser.add_argument('-w', '--workers', dest='workers', action='store', type=int,
+                        required=False, default=os.cpu_count() or 1,
+                        help='Number of processes linting in batch mode. Default is the number of CPUs')
+    add_api_report_arguments(parser)
+    add_snapshot_arguments(parser)
     properties.update(parser.parse_args().__dict__)
+    if not properties['batch'] and not properties['commits'] and not (properties['pt'] and properties['pb']):
+        parser.error('the following arguments are required: -t/--pt, -b/--pb')
 
 
 def main():
     try:
         parse_cli_arguments()
+        if properties['api_report'] or properties['api_report_file']:
+            enable_api_report(properties['api_report_file'], properties['api_report_format'])
+        if properties['snapshot']:
+            enable_snapshot(properties['snapshot'], properties['snapshot_mode'])
+        load_lint_rules(properties['rules'])
+        if properties['batch']:
+            lint_batch(properties['batch'], properties['output'], properties['workers'])
+            sys.exit(0)
+        if properties['commits']:
+            if lint_commits(properties['commits']):
+                print('Commits are valid')
+                sys.exit(0)
+            eprint('Commits are invalid')
+            sys.exit(1)
         success = lint()
         if success:
             print('PR is valid')
@@ -231,5 +482,7 @@ def main():
         sys.exit(1)
 
 
+load_lint_rules(default_lint_rules_path)
+
 if __name__ == "__main__":
     main()
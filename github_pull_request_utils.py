@@ -1,10 +1,16 @@
+import hashlib
+import json
 import os
 import subprocess
 import sys
 import re
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+from http_utils import *
+from git_utils import *
+
 # Name of GitHub Organization of project owner
 org_name = 'pccofvns'
 # List of specified project keys
@@ -16,6 +22,43 @@ hyperlink_style = 'JIRA'
 # Positive lookbehind assertion to include only specified projects
 issue_key_pattern = r'\b(?:' + '|'.join(specified_projects_keys) + r')-\d+\b'
 base_url = 'https://api.github.com/repos'
+# Maximum number of concurrent requests made while fetching pull requests
+default_workers = 8
+# Number of items requested per page from paginated GitHub endpoints
+page_size = 100
+# Fields kept from the pull request files GitHub returns. The others, above all the patches, are skipped while read
+pull_request_file_fields = ['filename', 'status', 'additions', 'deletions']
+# Supported backends for fetching pull request details. Default rest
+fetch_backends = ['rest', 'graphql']
+# Number of pull requests requested in a single GraphQL query
+graphql_batch_size = 20
+# Priorities of GitHub requests waiting for the rate limit, lowest first. Nothing else of a pull request is fetched
+# before its details
+github_request_priorities = {'pull_request': 0, 'reviews': 1, 'files': 2}
+github_rate_limiter = RateLimitScheduler('GitHub', default_workers)
+# The search API has a quota of its own, of 30 requests per minute
+github_search_rate_limiter = RateLimitScheduler('GitHub search', 1)
+# Rules sorting changed files into categories, in the shape of .github/labeler.yml. Compiled by
+# load_changed_file_rules()
+default_changed_file_rules_path = Path(__file__).resolve().with_name('changed_file_rules.json')
+# Changed file categories, in the order of the rules
+changed_file_categories = []
+changed_file_rules = {}
+# Ways a changed file rule matches a file. any-regex-to-any-file is not one of .github/labeler.yml
+changed_file_matchers = ['any-glob-to-any-file', 'all-globs-to-any-file', 'any-regex-to-any-file']
+# Characters splitting a path into the tokens changed file conditions are indexed by, and glob wildcards
+glob_separator_pattern = re.compile(r'[/.]')
+glob_wildcard_pattern = re.compile(r'[*?\[\]{}\\]')
+# Results the GitHub search API returns for a query at most
+github_search_result_limit = 1000
+# Pull requests fetched together in bulk mode. Only the pull requests of one chunk are held in memory at a time
+bulk_chunk_size = 50
+# Temporary SQLite file the details of the pull requests found in bulk mode are grouped by issue key in
+bulk_details_schema = '''
+CREATE TABLE pull_requests (position INTEGER PRIMARY KEY, details TEXT NOT NULL);
+CREATE TABLE issue_keys (issue_key TEXT NOT NULL, position INTEGER NOT NULL, PRIMARY KEY (issue_key, position))
+    WITHOUT ROWID;
+'''
 DESCRIPTION_OF_CHANGES = 'Description of Changes'
 RCA = 'Root Cause Analysis'
 CODE_CHANGES = 'Code Changes'
@@ -28,11 +71,14 @@ REVIEW_COMMENTS = 'Review Comments'
 REVIEWER_USERNAMES = 'Reviewer Usernames'
 DATABASE_CHANGES = 'Database Changes'
 PROPERTY_CHANGES = 'Property Changes'
+MIGRATION_CHANGES = 'Migration Changes'
+INFRASTRUCTURE_CHANGES = 'Infrastructure Changes'
+DOCUMENTATION_CHANGES = 'Documentation Changes'
 PULL_REQUEST_LINKS = 'Pull Request Link(s)'
 PULL_REQUEST_TITLE = 'Title'
 
 H2 = '##'
-H3 = '##'
+H3 = '###'
 DESCRIPTION_OF_CHANGES_HEADING = '## Description of Changes'
 ISSUE_TICKET_NUMBER_HEADING = '## Issue ticket number(s)'
 TESTS_HEADING = '## Tests'
@@ -43,16 +89,37 @@ RCA_HEADING = '### RCA'
 pull_request_template_headers = ["## Description of Changes", "## Issue ticket number(s)", "## Tests"]
 pull_request_template_sub_headers = {"## Description of Changes": ["### RCA", "### Code Changes",
                                                                    "### Impact Analysis"]}
+# Keys under which the content of each pull request template section is collected
+pull_request_template_section_keys = {DESCRIPTION_OF_CHANGES_HEADING: DESCRIPTION_OF_CHANGES,
+                                      ISSUE_TICKET_NUMBER_HEADING: ISSUES,
+                                      TESTS_HEADING: TESTS,
+                                      RCA_HEADING: RCA,
+                                      CODE_CHANGES_HEADING: CODE_CHANGES,
+                                      IMPACT_ANALYSIS_HEADING: IMPACT_ANALYSIS}
+# Markdown headings (## to ######) of a pull request body. Starting with a literal keeps the scan fast on long
+# bodies, is_at_line_start() then drops matches that are not at the start of a line
+heading_pattern = re.compile(r'##(#{0,4})(?![^ \t\r\n])([^\n]*)')
+# GitHub tokens already resolved in this run, keyed by the token given on the command line
+git_auth_tokens = {}
+# Index pull requests are recorded in and merged ones taken from, see set_pull_request_index()
+pull_request_index = None
 
 
 def git_auth_token(args):
+    if args.get('gt') not in git_auth_tokens:
+        git_auth_tokens[args.get('gt')] = read_git_auth_token(args)
+    return git_auth_tokens[args.get('gt')]
+
+
+def read_git_auth_token(args):
     token = None
     token_url = None
     home_dir = Path.home()
     if args.get('gt'):
         token_url = args['gt']
     elif os.path.isfile(home_dir / ".git-credentials"):
-        token_url = open(home_dir / ".git-credentials", "r").readline()
+        with open(home_dir / ".git-credentials", "r") as git_credentials:
+            token_url = git_credentials.readline()
     if token_url:
         token = token_url.split(':')[2].replace('@github.com', '').strip()
     if not token:
@@ -66,52 +133,554 @@ def get_git_headers(args):
     return headers
 
 
+def github_get(args, url, params=None, priority=0, json_fields=None):
+    if args.get('no_cache'):
+        response = http_get(url, headers=get_git_headers(args), params=params, rate_limiter=github_rate_limiter,
+                            priority=priority, json_fields=json_fields)
+    else:
+        response = cached_http_get(url, args.get('cache_dir'), headers=get_git_headers(args), params=params,
+                                   json_fields=json_fields, rate_limiter=github_rate_limiter, priority=priority)
+    check_github_response(response)
+    return response
+
+
+def check_github_response(response):
+    # Error bodies are not what the callers expect, fail with GitHub's message instead
+    if response.status_code < 400:
+        return
+    try:
+        body = response.json()
+        message = body.get('message', '') if isinstance(body, dict) else str(body)
+    except ValueError:
+        message = response.text[:200]
+    error = 'GitHub request ' + response.url + ' failed with status ' + str(response.status_code) + ': ' + message
+    if response.headers.get('X-RateLimit-Remaining') == '0' and response.headers.get('X-RateLimit-Reset'):
+        reset_at = time.localtime(int(response.headers['X-RateLimit-Reset']))
+        error += '. The rate limit is exhausted until ' + time.strftime('%Y-%m-%d %H:%M:%S', reset_at)
+    raise Exception(error)
+
+
 def generate_pull_request_details(args):
-    pull_request_details = {
+    pull_request_details = new_pull_request_details()
+    pr_numbers = args['pr']
+    repo_name = get_repo_name(args)
+    fetched_pull_requests = fetch_pull_requests(args, pr_numbers, repo_name)
+    # Merge in the order the pull requests were given so that the result matches a sequential run
+    for pr, pr_reviews, pr_files in fetched_pull_requests:
+        merge_pull_request(args, pull_request_details, pr, pr_reviews, pr_files)
+    return pull_request_details
+
+
+async def generate_pull_request_details_async(args, on_pull_requests=None):
+    """generate_pull_request_details() for asyncio. on_pull_requests(prs) is called once the details of all pull
+    requests are there, while their reviews and files are still being fetched."""
+    pull_request_details = new_pull_request_details()
+    repo_name = get_repo_name(args)
+    fetched_pull_requests = await fetch_pull_requests_async(args, args['pr'], repo_name, on_pull_requests)
+    for pr, pr_reviews, pr_files in fetched_pull_requests:
+        merge_pull_request(args, pull_request_details, pr, pr_reviews, pr_files)
+    return pull_request_details
+
+
+def new_pull_request_details():
+    return {
         REVIEW_COMMENTS: set(),
         REVIEWER_USERNAMES: set(),
         ISSUE_KEYS: set(),
-        DATABASE_CHANGES: False,
-        PROPERTY_CHANGES: False
+        **new_file_type_changes()
     }
-    pr_numbers = args['pr']
+
+
+def merge_pull_request(args, pull_request_details, pr, pr_reviews, pr_files):
+    populate_title(pull_request_details, pr['title'])
+    populate_pull_request_details_from_pr_body(args, pull_request_details, pr, pr_reviews, pr_files)
+
+
+def generate_single_pull_request_details(args, pr, pr_reviews, pr_files):
+    pr_details = new_pull_request_details()
+    merge_pull_request(args, pr_details, pr, pr_reviews, pr_files)
+    return pr_details
+
+
+def combine_pull_request_details(pull_request_details, pr_details):
+    """Merge the details of a single pull request into pull_request_details, as merge_pull_request() merges the pull
+    request itself."""
+    populate_title(pull_request_details, pr_details[PULL_REQUEST_TITLE])
+    merge_section_content(pull_request_details, DESCRIPTION_OF_CHANGES, pr_details[DESCRIPTION_OF_CHANGES])
+    for header_sub_headers in pull_request_template_sub_headers.values():
+        for sub_header in header_sub_headers:
+            key = pull_request_template_section_keys.get(sub_header, sub_header)
+            if key in pr_details:
+                pull_request_details[key] = pr_details[key]
+    merge_section_content(pull_request_details, TESTS, pr_details[TESTS])
+    pull_request_details[ISSUE_KEYS].update(pr_details[ISSUE_KEYS])
+    add_pull_request_link(pull_request_details, pr_details[PULL_REQUEST_LINKS])
+    pull_request_details[REVIEWER_USERNAMES].update(pr_details[REVIEWER_USERNAMES])
+    pull_request_details[REVIEW_COMMENTS].update(pr_details[REVIEW_COMMENTS])
+    for category in changed_file_categories:
+        pull_request_details[category] = pull_request_details[category] or pr_details[category]
+
+
+def iter_pull_request_details_by_issue_key(args):
+    """Bulk mode: generate the details of the merged pull requests found by search, grouped by issue key.
+
+    Pull requests are streamed from the search results and fetched bulk_chunk_size at a time. Yields
+    (issue_key, pull_request_details) by issue key, merging every pull request referencing the issue in creation
+    order: the search API can not sort by merge date. Each pull request is merged once and its details are kept in a
+    temporary SQLite file until every pull request has been read, so that memory does not grow with the search window.
+    """
+    # Imported here, so that the linter does not pay for importing them
+    import sqlite3
+    import tempfile
+
     repo_name = get_repo_name(args)
-    for pr_num in pr_numbers:
-        pr = get_pull_request_details(args, pr_num, repo_name)
-        populate_title(pull_request_details, pr['title'])
-
-        populate_pull_request_details_from_pr_body(args, pull_request_details, pr)
-
-        issue_keys = find_specific_issue_keys(pr['title'])
-        issue_ticket_numbers_text = extract_issue_ticket_numbers_from_pr_body(pr['body'])
-        if issue_ticket_numbers_text:
-            issue_keys_in_pr_body = find_specific_issue_keys(issue_ticket_numbers_text.strip())
-            remove_unwanted_issue_keys(issue_keys_in_pr_body)
-            issue_keys = issue_keys + issue_keys_in_pr_body
-        pull_request_details[ISSUE_KEYS].update(set(issue_keys))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        connection = sqlite3.connect(os.path.join(temp_dir, 'pull-request-details.sqlite'))
+        try:
+            connection.executescript(bulk_details_schema)
+            pull_request_count = 0
+            for pr_numbers in iter_chunks(iter_merged_pull_request_numbers(args, repo_name), bulk_chunk_size):
+                with connection:
+                    for pr_num, pr_details in zip(pr_numbers, fetch_pull_requests_details(args, pr_numbers,
+                                                                                          repo_name)):
+                        pull_request_count += 1
+                        if not pr_details[ISSUE_KEYS]:
+                            print(f'Pull request {pr_num} references no issue, skipping it')
+                            continue
+                        connection.execute('INSERT INTO pull_requests (position, details) VALUES (?, ?)',
+                                           (pull_request_count, dump_pull_request_details(pr_details)))
+                        connection.executemany('INSERT INTO issue_keys (issue_key, position) VALUES (?, ?)',
+                                               [(issue_key, pull_request_count) for issue_key in pr_details[ISSUE_KEYS]])
+                issue_count = connection.execute('SELECT COUNT(DISTINCT issue_key) FROM issue_keys').fetchone()[0]
+                print(f'Fetched {pull_request_count} pull request(s) referencing {issue_count} issue(s)')
+            issue_keys = connection.execute('SELECT DISTINCT issue_key FROM issue_keys ORDER BY issue_key')
+            for issue_key, in issue_keys:
+                pull_request_details = new_pull_request_details()
+                for details, in connection.execute(
+                        'SELECT p.details FROM issue_keys k JOIN pull_requests p ON p.position = k.position '
+                        'WHERE k.issue_key = ? ORDER BY k.position', (issue_key,)):
+                    combine_pull_request_details(pull_request_details, load_pull_request_details(details))
+                yield issue_key, pull_request_details
+        finally:
+            connection.close()
+
+
+def dump_pull_request_details(pull_request_details):
+    return json.dumps({key: sorted(value) if isinstance(value, set) else value
+                       for key, value in pull_request_details.items()})
+
+
+def load_pull_request_details(details):
+    pull_request_details = json.loads(details)
+    for key in (REVIEW_COMMENTS, REVIEWER_USERNAMES, ISSUE_KEYS):
+        pull_request_details[key] = set(pull_request_details[key])
     return pull_request_details
 
 
-def populate_pull_request_details_from_pr_body(args, pull_request_details, pr):
-    populate_resolution_summary(pull_request_details, pr['body'])
-    populate_test_cases_run(pull_request_details, pr['body'])
+def iter_chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_merged_pull_request_numbers(args, repo_name):
+    """Stream the numbers of the merged pull requests matching the search criteria of args, oldest created first."""
+    url = get_search_url()
+    params = {"q": build_pull_request_search_query(args, repo_name), "sort": "created", "order": "asc",
+              "per_page": page_size}
+    print(f'Searching pull requests: {params["q"]}')
+    while url:
+        response = http_get(url, headers=get_git_headers(args), params=params, rate_limiter=github_search_rate_limiter)
+        check_github_response(response)
+        search_results = response.json()
+        if params and search_results['total_count'] > github_search_result_limit:
+            eprint(f'{search_results["total_count"]} pull requests found, GitHub returns the first '
+                   f'{github_search_result_limit} only. Narrow down the search, for example by merge date')
+        for item in search_results['items']:
+            yield str(item['number'])
+        url = response.links.get('next', {}).get('url')
+        # The next page link already carries the query
+        params = None
+
+
+def build_pull_request_search_query(args, repo_name):
+    qualifiers = ['repo:' + get_repository_full_name(repo_name), 'is:pr', 'is:merged']
+    if args.get('merged_since') or args.get('merged_until'):
+        qualifiers.append('merged:' + (args.get('merged_since') or '*') + '..' + (args.get('merged_until') or '*'))
+    if args.get('base'):
+        qualifiers.append('base:' + args['base'])
+    if args.get('milestone'):
+        qualifiers.append('milestone:"' + args['milestone'] + '"')
+    return ' '.join(qualifiers)
+
+
+def get_search_url():
+    return base_url.rsplit('/repos', 1)[0] + '/search/issues'
+
+
+def fetch_pull_requests(args, pr_numbers, repo_name):
+    """Fetch pull requests, reviews and files in parallel. Returns (pr, reviews, files) in pr_numbers order.
+
+    Merged pull requests the pull request index holds are taken from it, the others are added to it.
+    """
+    indexed_pull_requests = get_indexed_pull_requests(args, pr_numbers, repo_name)
+    missing_pr_numbers = [str(pr_num) for pr_num in pr_numbers if str(pr_num) not in indexed_pull_requests]
+    fetched_pull_requests = fetch_pull_requests_from_github(args, missing_pr_numbers, repo_name) \
+        if missing_pr_numbers else []
+    index_pull_requests(args, repo_name, fetched_pull_requests)
+    return order_pull_requests(pr_numbers, indexed_pull_requests, dict(zip(missing_pr_numbers, fetched_pull_requests)))
+
+
+def fetch_pull_requests_details(args, pr_numbers, repo_name):
+    """fetch_pull_requests() returning the details of each pull request, see generate_single_pull_request_details().
+
+    Each pull request is merged once, the details of the ones fetched are indexed as well.
+    """
+    indexed_pull_requests = get_indexed_pull_requests(args, pr_numbers, repo_name)
+    missing_pr_numbers = [str(pr_num) for pr_num in pr_numbers if str(pr_num) not in indexed_pull_requests]
+    fetched_pull_requests = fetch_pull_requests_from_github(args, missing_pr_numbers, repo_name) \
+        if missing_pr_numbers else []
+    fetched_details = [generate_single_pull_request_details(args, pr, pr_reviews, pr_files)
+                       for pr, pr_reviews, pr_files in fetched_pull_requests]
+    index_pull_requests(args, repo_name, fetched_pull_requests, fetched_details)
+    fetched_details = dict(zip(missing_pr_numbers, fetched_details))
+    return [fetched_details.get(str(pr_num)) or
+            generate_single_pull_request_details(args, *indexed_pull_requests[str(pr_num)])
+            for pr_num in pr_numbers]
+
+
+def order_pull_requests(pr_numbers, indexed_pull_requests, fetched_pull_requests):
+    return [indexed_pull_requests.get(str(pr_num)) or fetched_pull_requests[str(pr_num)] for pr_num in pr_numbers]
+
+
+def fetch_pull_requests_from_github(args, pr_numbers, repo_name):
+    if args.get('backend') == 'graphql':
+        return fetch_pull_requests_with_graphql(args, pr_numbers, repo_name)
+    workers = args.get('workers') or default_workers
+    github_rate_limiter.set_max_concurrency(workers)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pr_futures = {executor.submit(get_pull_request_details, args, pr_num, repo_name): i
+                      for i, pr_num in enumerate(pr_numbers)}
+        prs = [None] * len(pr_numbers)
+        review_futures = [None] * len(pr_numbers)
+        file_futures = [None] * len(pr_numbers)
+        # Reviews and files of a pull request are fetched as soon as its details are there
+        for pr_future in as_completed(pr_futures):
+            i = pr_futures[pr_future]
+            pr = prs[i] = pr_future.result()
+            review_futures[i] = executor.submit(get_pull_request_reviews, args, pr['number'],
+                                                pr['head']['repo']['name'])
+            file_futures[i] = executor.submit(get_pull_request_files_until_classified, args, pr)
+        return [(pr, review_future.result(), file_future.result())
+                for pr, review_future, file_future in zip(prs, review_futures, file_futures)]
+
+
+async def fetch_pull_requests_async(args, pr_numbers, repo_name, on_pull_requests=None):
+    """fetch_pull_requests() for asyncio. Requests are sent from threads, at most workers at a time."""
+    indexed_pull_requests = get_indexed_pull_requests(args, pr_numbers, repo_name)
+    missing_pr_numbers = [str(pr_num) for pr_num in pr_numbers if str(pr_num) not in indexed_pull_requests]
+
+    def on_fetched_pull_requests(fetched_prs):
+        indexed_prs = {pr_num: indexed[0] for pr_num, indexed in indexed_pull_requests.items()}
+        on_pull_requests(order_pull_requests(pr_numbers, indexed_prs, dict(zip(missing_pr_numbers, fetched_prs))))
+
+    if missing_pr_numbers:
+        fetched_pull_requests = await fetch_pull_requests_from_github_async(
+            args, missing_pr_numbers, repo_name, on_fetched_pull_requests if on_pull_requests else None)
+    else:
+        fetched_pull_requests = []
+        if on_pull_requests:
+            on_fetched_pull_requests([])
+    index_pull_requests(args, repo_name, fetched_pull_requests)
+    return order_pull_requests(pr_numbers, indexed_pull_requests, dict(zip(missing_pr_numbers, fetched_pull_requests)))
+
+
+async def fetch_pull_requests_from_github_async(args, pr_numbers, repo_name, on_pull_requests=None):
+    # Imported here, so that the linter does not pay for importing asyncio
+    import asyncio
+
+    if args.get('backend') == 'graphql':
+        fetched_pull_requests = await asyncio.to_thread(fetch_pull_requests_with_graphql, args, pr_numbers, repo_name)
+        if on_pull_requests:
+            on_pull_requests([pr for pr, pr_reviews, pr_files in fetched_pull_requests])
+        return fetched_pull_requests
+    workers = args.get('workers') or default_workers
+    github_rate_limiter.set_max_concurrency(workers)
+    semaphore = asyncio.Semaphore(max(1, workers))
+    prs = [None] * len(pr_numbers)
+
+    async def run(function, *function_args):
+        async with semaphore:
+            return await asyncio.to_thread(function, args, *function_args)
+
+    async def fetch_pull_request(i, pr_num):
+        pr = prs[i] = await run(get_pull_request_details, pr_num, repo_name)
+        if on_pull_requests and all(prs):
+            on_pull_requests(prs)
+        # Reviews and files of a pull request are fetched as soon as its details are there
+        pr_reviews, pr_files = await asyncio.gather(
+            run(get_pull_request_reviews, pr['number'], pr['head']['repo']['name']),
+            run(get_pull_request_files_until_classified, pr))
+        return pr, pr_reviews, pr_files
+
+    return await asyncio.gather(*(fetch_pull_request(i, pr_num) for i, pr_num in enumerate(pr_numbers)))
+
+
+def set_pull_request_index(index):
+    """Record the pull requests fetched with index.update(), and take merged ones from index.get_pull_requests()
+    instead of fetching them again. None fetches every pull request."""
+    global pull_request_index
+    pull_request_index = index
+
+
+def get_indexed_pull_requests(args, pr_numbers, repo_name):
+    # --no-cache asks GitHub for everything again, the pull request index is then only updated
+    if not pull_request_index or args.get('no_cache') or not pr_numbers:
+        return {}
+    return pull_request_index.get_pull_requests(get_repository_full_name(repo_name), pr_numbers,
+                                                changed_file_rules['fingerprint'])
+
+
+def index_pull_requests(args, repo_name, fetched_pull_requests, fetched_details=None):
+    # fetched_details are the details of fetched_pull_requests, when they were already generated
+    if not pull_request_index:
+        return
+    entries = []
+    for i, (pr, pr_reviews, pr_files) in enumerate(fetched_pull_requests):
+        pr_details = fetched_details[i] if fetched_details else \
+            generate_single_pull_request_details(args, pr, pr_reviews, pr_files)
+        entries.append({
+            'number': int(pr['number']), 'title': pr['title'], 'base_ref': pr['base']['ref'],
+            'merged_at': pr.get('merged_at'), 'url': pr['html_url'],
+            'issue_keys': sorted(pr_details[ISSUE_KEYS]),
+            'file_categories': [category for category in changed_file_categories if pr_details[category]],
+            # Only what merge_pull_request() reads
+            'pull_request': {'number': pr['number'], 'title': pr['title'], 'body': pr['body'],
+                             'html_url': pr['html_url'], 'base': {'ref': pr['base']['ref']},
+                             'merged_at': pr.get('merged_at'),
+                             'head': {'repo': {'name': pr['head']['repo']['name']}}},
+            'reviews': [{'user': {'login': pr_review['user']['login'], 'html_url': pr_review['user']['html_url']},
+                         'body': pr_review['body']} for pr_review in pr_reviews],
+            'classifying_files': get_classifying_files(pr_files),
+            'rules_fingerprint': changed_file_rules['fingerprint']
+        })
+    pull_request_index.update(get_repository_full_name(repo_name), entries)
+
+
+def get_classifying_files(pr_files):
+    # The files putting the pull request in a category no file before did, enough to classify it again
+    classifying_files = []
+    file_type_changes = new_file_type_changes()
+    for pr_file in pr_files:
+        if populate_file_type_changes_from_commits(file_type_changes, pr_file):
+            classifying_files.append({'filename': pr_file['filename']})
+    return classifying_files
+
+
+def get_repository_full_name(repo_name):
+    return repo_name if '/' in repo_name else org_name + '/' + repo_name
+
+
+def populate_pull_request_details_from_pr_body(args, pull_request_details, pr, pr_reviews=None, pr_files=None):
+    sections = parse_pr_body_sections(pr['body'])
+    populate_resolution_summary(pull_request_details, sections)
+    populate_test_cases_run(pull_request_details, sections)
+    populate_issue_keys(pull_request_details, pr['title'], sections)
     populate_pull_request_links(pr, pull_request_details)
-    pr_reviews = get_pull_request_reviews(args, pr['number'], pr['head']['repo']['name'])
+    if pr_reviews is None:
+        pr_reviews = get_pull_request_reviews(args, pr['number'], pr['head']['repo']['name'])
     for pr_review in pr_reviews:
         populate_review_details_by_git_review(args, pull_request_details, pr_review)
-    pr_files = get_pull_request_files(args, pr['number'], pr['head']['repo']['name'])
+    if pr_files is None:
+        pr_files = iter_changed_files(args, pr)
+    populate_file_type_changes(pull_request_details, pr_files)
+
+
+def populate_file_type_changes(pull_request_details, pr_files):
+    # Files are consumed lazily, so no further pages are fetched once every file type has been seen
+    if all_file_type_changes_found(pull_request_details):
+        return
     for pr_file in pr_files:
-        populate_file_type_changes_from_commits(pull_request_details, pr_file)
+        if populate_file_type_changes_from_commits(pull_request_details, pr_file) and \
+                all_file_type_changes_found(pull_request_details):
+            return
+
+
+def all_file_type_changes_found(pull_request_details):
+    return all(pull_request_details[category] for category in changed_file_categories)
+
+
+def new_file_type_changes():
+    return {category: False for category in changed_file_categories}
+
+
+def get_pull_request_files_until_classified(args, pr):
+    pr_files = []
+    file_type_changes = new_file_type_changes()
+    for pr_file in iter_changed_files(args, pr):
+        pr_files.append(pr_file)
+        if populate_file_type_changes_from_commits(file_type_changes, pr_file) and \
+                all_file_type_changes_found(file_type_changes):
+            break
+    return pr_files
 
 
 def populate_file_type_changes_from_commits(pull_request_details, pr_file):
-    if pull_request_details[PROPERTY_CHANGES] is False and (
-            ('.properties' in pr_file['filename'].lower() and 'message' not in pr_file[
-                'filename'].lower()) or 'ddl' in pr_file['filename'].lower()
-            or '_config' in pr_file['filename'].lower()):
-        pull_request_details[PROPERTY_CHANGES] = True
-    if pull_request_details[DATABASE_CHANGES] is False and '.sql' in pr_file['filename'].lower():
-        pull_request_details[DATABASE_CHANGES] = True
+    """Set the changed file categories pr_file is in. Returns whether it is in one not seen before."""
+    path = pr_file['filename']
+    lowered_path = path.lower()
+    conditions_by_token = changed_file_rules['conditions_by_token']
+    found = False
+    # Only the conditions whose token or literal the path contains are matched against it
+    for token in lowered_path.replace('.', '/').split('/'):
+        if token in conditions_by_token:
+            found = match_changed_file_conditions(pull_request_details, path, conditions_by_token[token]) or found
+    for literal, conditions in changed_file_rules['conditions_by_literal']:
+        if literal in lowered_path:
+            found = match_changed_file_conditions(pull_request_details, path, conditions) or found
+    if changed_file_rules['unindexed_conditions']:
+        found = match_changed_file_conditions(pull_request_details, path,
+                                              changed_file_rules['unindexed_conditions']) or found
+    return found
+
+
+def match_changed_file_conditions(pull_request_details, path, conditions):
+    found = False
+    for category, pattern in conditions:
+        if not pull_request_details[category] and pattern.match(path):
+            pull_request_details[category] = True
+            found = True
+    return found
+
+
+def load_changed_file_rules(path):
+    """Load the changed file rules from a JSON, or with PyYAML a YAML, file shaped like .github/labeler.yml.
+
+    Every category is a list of globs, or of {"changed-files": [{matcher: globs}]}, matching a file if any of them
+    does. Each condition is indexed by a token or literal every path it matches contains, so that a path is only
+    matched against the few conditions it may match.
+    """
+    path = Path(path)
+    if path.suffix in ('.yml', '.yaml'):
+        try:
+            import yaml
+        except ImportError:
+            raise Exception('PyYAML is required to read the changed file rules ' + str(path) + '. Install it or '
+                            'use a JSON rules file')
+        rules = yaml.safe_load(path.read_text())
+    else:
+        rules = json.loads(path.read_text())
+    conditions_by_token = {}
+    conditions_by_literal = {}
+    unindexed_conditions = []
+    for category, rule in (rules or {}).items():
+        for anchor, pattern in compile_changed_file_rule(category, rule):
+            condition = (category, pattern)
+            if anchor is None:
+                unindexed_conditions.append(condition)
+            elif anchor[0] == 'token':
+                conditions_by_token.setdefault(anchor[1], []).append(condition)
+            else:
+                conditions_by_literal.setdefault(anchor[1], []).append(condition)
+    changed_file_categories[:] = list(rules or {})
+    changed_file_rules.clear()
+    changed_file_rules.update({'path': str(path),
+                               # Pull requests classified with other rules are not taken from the pull request index
+                               'fingerprint': hashlib.sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest(),
+                               'conditions_by_token': conditions_by_token,
+                               'conditions_by_literal': list(conditions_by_literal.items()),
+                               'unindexed_conditions': unindexed_conditions})
+
+
+def compile_changed_file_rule(category, rule):
+    """Compile the rule of a category into (anchor, pattern) conditions, any of which matches."""
+    conditions = []
+    for match_config in rule if isinstance(rule, list) else [rule]:
+        if isinstance(match_config, str):
+            conditions.extend(compile_changed_file_matcher(category, 'any-glob-to-any-file', match_config))
+            continue
+        if not isinstance(match_config, dict) or set(match_config) != {'changed-files'}:
+            raise Exception('Changed file rule ' + category + ' must be a list of globs or of {"changed-files": '
+                            '[...]}, found ' + json.dumps(match_config))
+        changed_files = match_config['changed-files']
+        if not isinstance(changed_files, list) or len(changed_files) != 1 or len(changed_files[0]) != 1:
+            # Conditions that have to hold for different files would have to be tracked across files
+            raise Exception('Changed file rule ' + category + ' must have a single matcher per "changed-files", '
+                            'list alternatives as separate "changed-files" instead')
+        (matcher, globs), = changed_files[0].items()
+        conditions.extend(compile_changed_file_matcher(category, matcher, globs))
+    return conditions
+
+
+def compile_changed_file_matcher(category, matcher, globs):
+    globs = [globs] if isinstance(globs, str) else globs
+    # Case-insensitive, as file names are classified whatever their case
+    flags = re.IGNORECASE | re.DOTALL
+    if matcher == 'any-glob-to-any-file':
+        return [(get_glob_anchor(glob), re.compile(translate_glob(glob) + r'\Z', flags)) for glob in globs]
+    if matcher == 'all-globs-to-any-file':
+        # Globs starting with ! must not match. Any glob that must match anchors the condition
+        positive_globs = [glob for glob in globs if not glob.startswith('!')]
+        pattern = ''.join('(?!' + translate_glob(glob[1:]) + r'\Z)' if glob.startswith('!')
+                          else '(?=' + translate_glob(glob) + r'\Z)' for glob in globs)
+        return [(get_glob_anchor(positive_globs[0]) if positive_globs else None, re.compile(pattern, flags))]
+    if matcher == 'any-regex-to-any-file':
+        # Searched anywhere in the path, and matched against every path
+        return [(None, re.compile('.*?(?:' + regex + ')', flags)) for regex in globs]
+    raise Exception('Unsupported matcher ' + matcher + ' of changed file rule ' + category + '. Supported matchers '
+                    'are ' + ', '.join(changed_file_matchers))
+
+
+def get_glob_anchor(glob):
+    """Return text every path matching glob contains, in lower case: ('token', token) for a path component or a
+    part of it between dots, ('literal', text) for any other text, None if there is none."""
+    tokens = [token for token in glob_separator_pattern.split(glob) if token and not glob_wildcard_pattern.search(token)]
+    if tokens:
+        return 'token', max(tokens, key=len).lower()
+    # Alternatives and character classes are not required as a whole, and **/ may match nothing at all
+    literals = re.split(r'[*?/]', re.sub(r'\{[^}]*\}|\[[^\]]*\]', '*', glob))
+    literal = max(literals, key=len).lower()
+    return ('literal', literal) if literal else None
+
+
+def translate_glob(glob):
+    """Translate a glob as used by .github/labeler.yml into a regular expression. ** matches across directories,
+    * and ? within one, dot files included. Braces list alternatives."""
+    regex = []
+    i = 0
+    while i < len(glob):
+        if glob.startswith('**/', i):
+            regex.append('(?:.*/)?')
+            i += 3
+        elif glob.startswith('**', i):
+            regex.append('.*')
+            i += 2
+        elif glob[i] == '*':
+            regex.append('[^/]*')
+            i += 1
+        elif glob[i] == '?':
+            regex.append('[^/]')
+            i += 1
+        elif glob[i] == '[' and ']' in glob[i + 2:]:
+            end = glob.index(']', i + 2)
+            characters = glob[i + 1:end]
+            if characters.startswith('!'):
+                characters = '^' + characters[1:]
+            regex.append('[' + characters + ']')
+            i = end + 1
+        elif glob[i] == '{' and '}' in glob[i:]:
+            end = glob.index('}', i)
+            regex.append('(?:' + '|'.join(translate_glob(part) for part in glob[i + 1:end].split(',')) + ')')
+            i = end + 1
+        else:
+            regex.append(re.escape(glob[i]))
+            i += 1
+    return ''.join(regex)
 
 
 def populate_review_details_by_git_review(args, pull_request_details, pr_review):
@@ -127,19 +696,170 @@ def populate_review_details_by_git_review(args, pull_request_details, pr_review)
 
 
 def get_pull_request_files(args, pr_num, repo_name):
-    pr_files_response = requests.get(
-        base_url + "/" + org_name + "/" + repo_name + "/pulls" + "/" + str(pr_num) + "/files",
-        headers=get_git_headers(args))
-    pr_files = pr_files_response.json()
-    return pr_files
+    return list(iter_pull_request_files(args, pr_num, repo_name))
 
 
 def get_pull_request_reviews(args, pr_num, repo_name):
-    pr_review_response = requests.get(
-        base_url + "/" + org_name + "/" + repo_name + "/pulls" + "/" + str(pr_num) + "/reviews",
-        headers=get_git_headers(args))
-    pr_reviews = pr_review_response.json()
-    return pr_reviews
+    return list(iter_pull_request_reviews(args, pr_num, repo_name))
+
+
+def iter_pull_request_files(args, pr_num, repo_name):
+    return iter_github_pages(args, base_url + "/" + org_name + "/" + repo_name + "/pulls" + "/" + str(pr_num) + "/files",
+                             github_request_priorities['files'], pull_request_file_fields)
+
+
+def iter_pull_request_reviews(args, pr_num, repo_name):
+    return iter_github_pages(args, base_url + "/" + org_name + "/" + repo_name + "/pulls" + "/" + str(pr_num) + "/reviews",
+                             github_request_priorities['reviews'])
+
+
+def iter_changed_files(args, pr):
+    """Stream the files changed by pr, from the local clone when it holds the pull request, else from the GitHub
+    API."""
+    clone_dir = get_local_clone_of_pull_request(args, pr)
+    if clone_dir:
+        return iter_local_changed_files(clone_dir, pr['base']['sha'], pr['head']['sha'])
+    return iter_pull_request_files(args, pr['number'], pr['head']['repo']['name'])
+
+
+def get_local_clone_of_pull_request(args, pr):
+    """Directory of the clone the scripts run in if it is a clone of the repository of pr and holds its commits,
+    None when the GitHub API has to be asked instead."""
+    base, head = pr.get('base') or {}, pr.get('head') or {}
+    repository = (base.get('repo') or {}).get('full_name')
+    if args.get('no_local_git') or not repository or not base.get('sha') or not head.get('sha'):
+        return None
+    clone_dir = get_local_clone(repository)
+    if not clone_dir:
+        return None
+    # Checkouts, such as the one of actions/checkout, hold the merge commit only. The base branch and the head of the
+    # pull request are fetched for the commits they miss
+    refs = [base['ref'], 'pull/' + str(pr['number']) + '/head']
+    if not ensure_local_commits(clone_dir, [base['sha'], head['sha']], refs) or \
+            not has_merge_base(clone_dir, base['sha'], head['sha']):
+        eprint(f'Pull request {pr["number"]} is not in the clone {clone_dir}, asking GitHub instead')
+        return None
+    return clone_dir
+
+
+def iter_github_pages(args, url, priority=0, json_fields=None):
+    # Follow the Link header page by page, fetching the next page only when the previous one is consumed
+    params = {"per_page": page_size}
+    while url:
+        response = github_get(args, url, params=params, priority=priority, json_fields=json_fields)
+        yield from response.json()
+        url = response.links.get('next', {}).get('url')
+        # The next page link already carries per_page
+        params = None
+
+
+def fetch_pull_requests_with_graphql(args, pr_numbers, repo_name):
+    """Fetch pull requests with their reviews and files in batched GitHub GraphQL queries.
+
+    Returns (pr, reviews, files) in pr_numbers order, shaped like the REST responses.
+    """
+    if '/' in repo_name:
+        owner, name = repo_name.split('/', 1)
+    else:
+        owner, name = org_name, repo_name
+    fetched_pull_requests = []
+    for start in range(0, len(pr_numbers), graphql_batch_size):
+        fetched_pull_requests.extend(
+            fetch_pull_request_batch_with_graphql(args, owner, name, pr_numbers[start:start + graphql_batch_size]))
+    return fetched_pull_requests
+
+
+def fetch_pull_request_batch_with_graphql(args, owner, name, pr_numbers):
+    batch = {}
+    selections = {}
+    for i, pr_num in enumerate(pr_numbers):
+        alias = 'pr' + str(i)
+        batch[alias] = {'pr': None, 'reviews': [], 'files': [], 'cursors': {'reviews': None, 'files': None},
+                        'file_type_changes': new_file_type_changes()}
+        selections[alias] = ('pullRequest(number: ' + str(int(pr_num)) + ') { title body number url baseRefName '
+                             'mergedAt headRepository { name } ' + graphql_connection('reviews', None) + ' ' +
+                             graphql_connection('files', None) + ' }')
+    repository = run_graphql_query(args, owner, name, selections)
+    for alias, pull_request in batch.items():
+        node = repository[alias]
+        if not node:
+            raise Exception('Pull request ' + str(pr_numbers[int(alias[2:])]) + ' not found in ' + owner + '/' + name)
+        pull_request['pr'] = {
+            'title': node['title'],
+            'body': node['body'],
+            'number': node['number'],
+            'html_url': node['url'],
+            'base': {'ref': node['baseRefName']},
+            'merged_at': node['mergedAt'],
+            'head': {'repo': {'name': node['headRepository']['name'] if node['headRepository'] else name}}
+        }
+        collect_graphql_connections(pull_request, node)
+
+    # Page reviews and files of every pull request in the batch together until all cursors are exhausted
+    while any(pull_request['cursors']['reviews'] or pull_request['cursors']['files'] for pull_request in batch.values()):
+        selections = {}
+        for alias, pull_request in batch.items():
+            connections = [graphql_connection(connection, cursor)
+                           for connection, cursor in pull_request['cursors'].items() if cursor]
+            if connections:
+                selections[alias] = ('pullRequest(number: ' + str(pull_request['pr']['number']) + ') { ' +
+                                     ' '.join(connections) + ' }')
+        repository = run_graphql_query(args, owner, name, selections)
+        for alias in selections:
+            collect_graphql_connections(batch[alias], repository[alias])
+    return [(pull_request['pr'], pull_request['reviews'], pull_request['files']) for pull_request in batch.values()]
+
+
+def graphql_connection(connection, cursor):
+    after = ', after: ' + json.dumps(cursor) if cursor else ''
+    if connection == 'reviews':
+        nodes = 'nodes { author { login url } body }'
+    else:
+        nodes = 'nodes { path }'
+    return connection + '(first: ' + str(page_size) + after + ') { pageInfo { hasNextPage endCursor } ' + nodes + ' }'
+
+
+def collect_graphql_connections(pull_request, node):
+    cursors = pull_request['cursors']
+    if 'reviews' in node:
+        for review in node['reviews']['nodes']:
+            author = review['author'] or {'login': 'ghost', 'url': 'https://github.com/ghost'}
+            pull_request['reviews'].append({'user': {'login': author['login'], 'html_url': author['url']},
+                                            'body': review['body']})
+        cursors['reviews'] = next_graphql_cursor(node['reviews'])
+    if 'files' in node:
+        for changed_file in node['files']['nodes']:
+            pr_file = {'filename': changed_file['path']}
+            pull_request['files'].append(pr_file)
+            populate_file_type_changes_from_commits(pull_request['file_type_changes'], pr_file)
+        cursors['files'] = next_graphql_cursor(node['files'])
+        # No need to page further through files once every file type has been seen
+        if all_file_type_changes_found(pull_request['file_type_changes']):
+            cursors['files'] = None
+
+
+def next_graphql_cursor(connection):
+    if connection['pageInfo']['hasNextPage']:
+        return connection['pageInfo']['endCursor']
+    return None
+
+
+def run_graphql_query(args, owner, name, selections):
+    query = ('query($owner: String!, $name: String!) { repository(owner: $owner, name: $name) { ' +
+             ' '.join(alias + ': ' + selection for alias, selection in selections.items()) + ' } }')
+    response = http_post(get_graphql_url(), headers=get_git_headers(args),
+                         json={"query": query, "variables": {"owner": owner, "name": name}},
+                         rate_limiter=github_rate_limiter, priority=github_request_priorities['pull_request'])
+    check_github_response(response)
+    result = response.json()
+    if result.get('errors'):
+        raise Exception('GitHub GraphQL query failed: ' + '; '.join(error.get('message', str(error))
+                                                                    for error in result['errors']))
+    return result['data']['repository']
+
+
+def get_graphql_url():
+    return base_url.rsplit('/repos', 1)[0] + '/graphql'
 
 
 def populate_pull_request_links(pr, pull_request_details):
@@ -147,6 +867,10 @@ def populate_pull_request_links(pr, pull_request_details):
     url = pr['html_url']
     hyperlink = create_hyperlink(display_text, url)
     pr_link = hyperlink + "@" + pr['base']['ref'] + " on " + str(pr['merged_at'])
+    add_pull_request_link(pull_request_details, pr_link)
+
+
+def add_pull_request_link(pull_request_details, pr_link):
     if PULL_REQUEST_LINKS in pull_request_details:
         pull_request_details[PULL_REQUEST_LINKS] = pull_request_details[PULL_REQUEST_LINKS] + \
                                                    "\n" + pr_link
@@ -169,20 +893,23 @@ def get_pull_request_details(args, pr_num, repo_name):
         url = base_url + "/" + org_name + "/" + repo_name + "/pulls" + "/" + pr_num
     else:
         url = base_url + "/" + repo_name + "/pulls" + "/" + pr_num
-    pr_response = requests.get(url, headers=get_git_headers(args))
+    pr_response = github_get(args, url, priority=github_request_priorities['pull_request'])
     pr = pr_response.json()
     return pr
 
 
-def update_pull_request_title(new_pr_title):
-    # Update PR Title
-    url = base_url + "/" + os.environ['REPO_NAME'] + "/pulls" + "/" + os.environ['PR_NUMBER']
+def update_pull_request_title(new_pr_title, repo_name=None, pr_number=None):
+    # Update PR Title. Repository and pull request default to the ones of the GitHub Actions run
+    repo_name = repo_name or os.environ['REPO_NAME']
+    pr_number = str(pr_number or os.environ['PR_NUMBER'])
+    url = base_url + "/" + repo_name + "/pulls" + "/" + pr_number
     headers = {
         "Authorization": "Bearer " + git_auth_token({}),
         "Accept": "application/vnd.github+json",
         "X-GitHub-Api-Version": "2022-11-28"
     }
-    requests.patch(url, headers=headers, json={"title": new_pr_title.strip()}, allow_redirects=True)
+    return http_patch(url, headers=headers, json={"title": new_pr_title.strip()}, allow_redirects=True,
+                      rate_limiter=github_rate_limiter, priority=github_request_priorities['pull_request'])
 
 
 def add_comment_to_github_issue(new_comment):
@@ -193,7 +920,10 @@ def add_comment_to_github_issue(new_comment):
         "Accept": "application/vnd.github+json",
         "X-GitHub-Api-Version": "2022-11-28"
     }
-    return requests.post(url, headers=headers, json={"body": new_comment.strip()}, allow_redirects=True).json()
+    response = http_post(url, headers=headers, json={"body": new_comment.strip()}, allow_redirects=True,
+                         rate_limiter=github_rate_limiter, priority=github_request_priorities['pull_request'])
+    check_github_response(response)
+    return response.json()
 
 
 def get_repo_name(args):
@@ -207,19 +937,20 @@ def get_repo_name(args):
 
 
 def inline_code(text):
-    new_string = ""
-    back_tick_count = 0
-    for char in text:
-        if char == "`":
-            back_tick_count += 1
-            if back_tick_count % 2 == 0:
-                new_char = "}}"
-            else:
-                new_char = "{{"
-            new_string += new_char
-        else:
-            new_string += char
-    return new_string
+    return convert_inline_code(text, 0)[0]
+
+
+def convert_inline_code(text, back_tick_count):
+    """Replace back ticks by alternating {{ and }}. Returns the text and the back tick count to continue from."""
+    parts = text.split("`")
+    if len(parts) == 1:
+        return text, back_tick_count
+    converted_parts = [parts[0]]
+    for part in parts[1:]:
+        back_tick_count += 1
+        converted_parts.append("}}" if back_tick_count % 2 == 0 else "{{")
+        converted_parts.append(part)
+    return "".join(converted_parts), back_tick_count
 
 
 def populate_title(pull_request, issue_title):
@@ -227,45 +958,109 @@ def populate_title(pull_request, issue_title):
         pull_request[PULL_REQUEST_TITLE] = issue_title
 
 
-def populate_resolution_summary(pull_request, pr_body):
-    description = extract_description_from_pr_body(pr_body)
-    if DESCRIPTION_OF_CHANGES in pull_request:
-        existing_resolution_summary = pull_request[DESCRIPTION_OF_CHANGES]
-        if existing_resolution_summary and existing_resolution_summary.strip() != description.strip():
-            pull_request[DESCRIPTION_OF_CHANGES] = pull_request[DESCRIPTION_OF_CHANGES] + "\n" + description
-        else:
-            pull_request[DESCRIPTION_OF_CHANGES] = description
-    else:
-        pull_request[DESCRIPTION_OF_CHANGES] = description
-    populate_sub_headings_of_description(pull_request, description)
+def populate_resolution_summary(pull_request, sections):
+    description = get_section_content(sections, DESCRIPTION_OF_CHANGES_HEADING) or ''
+    merge_section_content(pull_request, DESCRIPTION_OF_CHANGES, description)
+    populate_sub_headings_of_description(pull_request, sections)
 
 
-def populate_test_cases_run(pull_request, pr_body):
-    tests = extract_tests_from_pr_body(pr_body)
-    if TESTS in pull_request:
-        existing_tests = pull_request[TESTS]
-        if existing_tests and existing_tests.strip() != tests.strip():
-            pull_request[TESTS] = pull_request[TESTS] + "\n" + tests
-        else:
-            pull_request[TESTS] = tests
+def populate_test_cases_run(pull_request, sections):
+    tests = get_section_content(sections, TESTS_HEADING) or ''
+    merge_section_content(pull_request, TESTS, tests)
+
+
+def merge_section_content(pull_request, key, content):
+    # Appended to the content of the pull requests merged before, unless it is the same
+    existing_content = pull_request.get(key)
+    if existing_content and existing_content.strip() != content.strip():
+        pull_request[key] = existing_content + "\n" + content
     else:
-        pull_request[TESTS] = tests
+        pull_request[key] = content
+
+
+def populate_issue_keys(pull_request, pr_title, sections):
+    issue_keys = find_specific_issue_keys(pr_title)
+    issue_ticket_numbers_text = get_section_content(sections, ISSUE_TICKET_NUMBER_HEADING)
+    if issue_ticket_numbers_text:
+        issue_keys_in_pr_body = find_specific_issue_keys(issue_ticket_numbers_text)
+        remove_unwanted_issue_keys(issue_keys_in_pr_body)
+        issue_keys = issue_keys + issue_keys_in_pr_body
+    pull_request[ISSUE_KEYS].update(set(issue_keys))
+
+
+def parse_pr_body_sections(pr_body):
+    """Split a pull request body into the sections of the pull request template in a single pass over its headings.
+
+    Returns {heading: section} for the template headings found, in the order of the body. Each section is a dict
+    with its heading, the offsets start, content_start and end in pr_body, its stripped content and, for headings
+    listed in pull_request_template_sub_headers, the sub_sections found in it. A section ends at the next template
+    heading; a sub-section ends at the next heading of any level.
+    """
+    sections = {}
+    if not pr_body:
+        return sections
+    headers = {parse_heading(header): header for header in pull_request_template_headers}
+    sub_headers = {header: {parse_heading(sub_header): sub_header for sub_header in header_sub_headers}
+                   for header, header_sub_headers in pull_request_template_sub_headers.items()}
+    section = None
+    sub_section = None
+    for heading_match in heading_pattern.finditer(pr_body):
+        if not is_at_line_start(pr_body, heading_match.start()):
+            continue
+        heading = (len(heading_match.group(1)) + 2, heading_match.group(2).strip())
+        close_section(pr_body, sub_section, heading_match.start())
+        sub_section = None
+        if heading in headers:
+            close_section(pr_body, section, heading_match.start())
+            section = None
+            # Only the first occurrence of a template heading is taken
+            if headers[heading] not in sections:
+                section = open_section(headers[heading], heading_match)
+                sections[headers[heading]] = section
+        elif section and heading in sub_headers.get(section['heading'], {}):
+            sub_header = sub_headers[section['heading']][heading]
+            if sub_header not in section['sub_sections']:
+                sub_section = open_section(sub_header, heading_match)
+                section['sub_sections'][sub_header] = sub_section
+    close_section(pr_body, sub_section, len(pr_body))
+    close_section(pr_body, section, len(pr_body))
+    return sections
+
+
+def is_at_line_start(text, position):
+    while position > 0 and text[position - 1] in ' \t':
+        position -= 1
+    return position == 0 or text[position - 1] == '\n'
+
+
+def parse_heading(header):
+    level = len(header) - len(header.lstrip('#'))
+    return level, header[level:].strip()
+
+
+def open_section(header, heading_match):
+    return {'heading': header, 'start': heading_match.start(), 'content_start': heading_match.end(), 'end': None,
+            'content': None, 'sub_sections': {}}
+
+
+def close_section(pr_body, section, end):
+    if section:
+        section['end'] = end
+        section['content'] = pr_body[section['content_start']:end].strip()
+
+
+def get_section_content(sections, heading):
+    if heading in sections:
+        return sections[heading]['content']
+    return None
 
 
 def extract_description_from_pr_body(pr_body):
-    if pull_request_template_headers[0] not in pr_body:
-        return None
-    return pr_body[pr_body.index(
-        pull_request_template_headers[0]) + len(pull_request_template_headers[0]): pr_body.index(
-        pull_request_template_headers[1])].strip()
+    return get_section_content(parse_pr_body_sections(pr_body), DESCRIPTION_OF_CHANGES_HEADING)
 
 
 def extract_issue_ticket_numbers_from_pr_body(pr_body):
-    if pull_request_template_headers[1] not in pr_body:
-        return None
-    return pr_body[pr_body.index(pull_request_template_headers[1]) + len(
-        pull_request_template_headers[1]): pr_body.index(
-        pull_request_template_headers[2])].strip()
+    return get_section_content(parse_pr_body_sections(pr_body), ISSUE_TICKET_NUMBER_HEADING)
 
 
 def find_specific_issue_keys(text):
@@ -280,41 +1075,19 @@ def remove_unwanted_issue_keys(issue_keys_in_pr_body):
 
 
 def extract_tests_from_pr_body(pr_body):
-    if pull_request_template_headers[2] not in pr_body:
-        return None
-    return pr_body[pr_body.index(
-        pull_request_template_headers[2]) + len(pull_request_template_headers[2]):].strip()
+    return get_section_content(parse_pr_body_sections(pr_body), TESTS_HEADING)
 
 
-def populate_sub_headings_of_description(pull_request, description):
-    if RCA_HEADING in description:
-        rca_heading_start = description.index(RCA_HEADING)
-        right_part_of_text = description.split(RCA_HEADING)[1]
-        if right_part_of_text and right_part_of_text.find(H2) > 0:
-            pull_request[RCA] = description[rca_heading_start + 8: description.split(RCA_HEADING)[1].index(
-                H2) + rca_heading_start + 7].strip()
-        else:
-            pull_request[RCA] = description[rca_heading_start + 8:].strip()
-    if CODE_CHANGES_HEADING in description:
-        code_changes_heading_start = description.index(CODE_CHANGES_HEADING)
-        right_part_of_text = description.split(CODE_CHANGES_HEADING)[1]
-        if right_part_of_text and right_part_of_text.find(H2) > 0:
-            pull_request[CODE_CHANGES] = description[
-                                         code_changes_heading_start + 17: description.split(CODE_CHANGES_HEADING)[
-                                                                              1].index(
-                                             H2) + code_changes_heading_start + 16].strip()
-        else:
-            pull_request[CODE_CHANGES] = description[code_changes_heading_start + 17:].strip()
-    if IMPACT_ANALYSIS_HEADING in description:
-        impact_analysis_heading_start = description.index(IMPACT_ANALYSIS_HEADING)
-        right_part_of_text = description.split(IMPACT_ANALYSIS_HEADING)[1]
-        if right_part_of_text and right_part_of_text.find(H2) > 0:
-            pull_request[IMPACT_ANALYSIS] = description[impact_analysis_heading_start + 20:
-                                                        description.split(IMPACT_ANALYSIS_HEADING)[1].index(
-                                                            H2) + impact_analysis_heading_start + 19].strip()
-        else:
-            pull_request[IMPACT_ANALYSIS] = description[impact_analysis_heading_start + 20:].strip()
+def populate_sub_headings_of_description(pull_request, sections):
+    for header, sub_headers in pull_request_template_sub_headers.items():
+        if header not in sections:
+            continue
+        for sub_header, sub_section in sections[header]['sub_sections'].items():
+            pull_request[pull_request_template_section_keys.get(sub_header, sub_header)] = sub_section['content']
 
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
+
+
+load_changed_file_rules(default_changed_file_rules_path)
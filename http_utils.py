@@ -0,0 +1,533 @@
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+from json_stream import iter_json_array_items
+
+# requests and urllib3 are imported when the first session is created, so that scripts which end up not calling
+# any API, such as most runs of the pull request linter, do not pay for importing them
+
+# Seconds to wait for a connection to be established and for a response to be read
+connect_timeout = 10
+read_timeout = 60
+# Retries for server errors and rate limits, with exponential backoff between attempts
+max_retries = 3
+backoff_factor = 1
+retry_status_codes = [429, 500, 502, 503, 504]
+# Statuses that, together with a Retry-After header or an exhausted X-RateLimit-Remaining, pause a rate limiter
+# instead of only the calling thread
+rate_limit_status_codes = [403, 429, 503]
+# Rate limit statuses retried with backoff, as the other server errors are, when they do not tell when to retry
+backoff_status_codes = [code for code in retry_status_codes if code in rate_limit_status_codes]
+# Seconds waited after X-RateLimit-Reset, whose precision is a second, before the quota is used again
+rate_limit_reset_margin = 1
+# Longest wait for a rate limit to reset. Requests that would wait longer fail instead
+max_rate_limit_wait = 15 * 60
+# Share of the quota below which requests are spread evenly over the time left until the quota resets
+rate_limit_pacing_share = 0.1
+# Bytes read at a time from a streamed response whose JSON fields are projected
+json_chunk_size = 64 * 1024
+# Maximum number of keep-alive connections held per host
+pool_maxsize = 16
+# Directory of the conditional-request (ETag/Last-Modified) response cache
+default_cache_dir = os.environ.get('PR_SCRIPTS_CACHE_DIR', str(Path.home() / '.cache' / 'pr-scripts'))
+# Maximum total size of cached response bodies. Least recently used entries are evicted beyond it
+cache_max_bytes = 256 * 1024 * 1024
+# Response headers kept with a cached body
+cached_headers = ['Content-Type', 'Link', 'ETag', 'Last-Modified']
+
+sessions = {}
+sessions_lock = threading.Lock()
+cache_lock = threading.Lock()
+# Total size of the cached response bodies of each cache directory, read from it once and kept up to date by the
+# writes of this process. The directory is only walked again to evict entries
+cache_sizes = {}
+# Functions called as hook(method, url, response, seconds) after every request, see add_request_hook()
+request_hooks = []
+# Store answering requests from recorded responses and recording the others, see set_response_store()
+response_store = None
+
+
+class TokenBucket:
+    """Token bucket shared by threads, allowing `rate` requests per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, priority=0):
+        # Requests are let through in arrival order, whatever their priority
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # Every thread waits, not only the one that was told to retry later
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+    def release(self, response):
+        pass
+
+
+class RateLimitScheduler:
+    """Schedules requests to an API reporting its quota in X-RateLimit-* headers, such as GitHub.
+
+    At most `concurrency` requests are in flight. It is halved when the API asks to retry later, and grows back by one
+    after as many successful requests, up to below the concurrency that was asked to slow down. When the quota runs low, requests are spread evenly
+    until it resets; once it is exhausted, they wait until it resets. Waiting requests start lowest priority first.
+    """
+
+    def __init__(self, name, max_concurrency):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        # Concurrency below the one that was asked to slow down, None until that happens
+        self.concurrency_ceiling = None
+        self.in_flight = 0
+        self.successes = 0
+        # Quota left and its size, as last reported, and the time.time() it resets at
+        self.remaining = None
+        self.limit = None
+        self.reset_at = None
+        self.reported_reset_at = None
+        # time.monotonic() before which no request is started
+        self.paused_until = 0
+        self.next_start_at = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def set_max_concurrency(self, max_concurrency):
+        with self.condition:
+            self.max_concurrency = max(1, max_concurrency)
+            if self.concurrency_ceiling is None:
+                self.concurrency = self.max_concurrency
+            else:
+                self.concurrency = min(self.concurrency, self.max_concurrency)
+            self.condition.notify_all()
+
+    def acquire(self, priority=0):
+        with self.condition:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, ticket)
+            while True:
+                wait = self.get_wait(ticket)
+                if wait is not None and wait <= 0:
+                    break
+                self.condition.wait(wait)
+            heapq.heappop(self.waiting)
+            self.in_flight += 1
+            if self.remaining is not None:
+                # Reserved for this request until its response reports the quota
+                self.remaining -= 1
+            self.next_start_at = time.monotonic() + self.get_pacing_interval()
+            self.condition.notify_all()
+
+    def get_wait(self, ticket):
+        # Seconds to wait before the request of ticket can start, None to wait for another request to finish
+        if self.waiting[0] != ticket or self.in_flight >= self.concurrency:
+            return None
+        if self.remaining is not None and self.remaining <= 0:
+            reset_wait = self.get_reset_wait()
+            if reset_wait is None or reset_wait <= 0 or reset_wait > max_rate_limit_wait:
+                # The quota has reset, or is not known to reset in time. The response tells what is left
+                self.remaining = None
+            else:
+                return reset_wait
+        return max(self.paused_until, self.next_start_at) - time.monotonic()
+
+    def get_reset_wait(self):
+        if self.reset_at is None:
+            return None
+        return self.reset_at + rate_limit_reset_margin - time.time()
+
+    def get_pacing_interval(self):
+        if not self.remaining or not self.limit or self.remaining >= self.limit * rate_limit_pacing_share:
+            return 0
+        return max(0.0, self.get_reset_wait() or 0) / self.remaining
+
+    def pause(self, seconds):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.condition.notify_all()
+
+    def release(self, response):
+        with self.condition:
+            self.in_flight -= 1
+            if response is not None:
+                self.update(response)
+            self.condition.notify_all()
+
+    def update(self, response):
+        headers = response.headers
+        reset_at = float(headers['X-RateLimit-Reset']) if headers.get('X-RateLimit-Reset') else self.reset_at
+        # Responses of a quota window that has since reset are ignored
+        if headers.get('X-RateLimit-Remaining') and \
+                (self.reset_at is None or reset_at is None or reset_at >= self.reset_at):
+            # Requests still in flight will use the quota as well
+            remaining = int(headers['X-RateLimit-Remaining']) - self.in_flight
+            if self.remaining is not None and reset_at == self.reset_at:
+                # Responses of concurrent requests come back in any order, the quota only goes down until it resets
+                remaining = min(self.remaining, remaining)
+            self.remaining = remaining
+            self.limit = int(headers.get('X-RateLimit-Limit') or 0) or self.limit
+            self.reset_at = reset_at
+            if self.remaining <= 0 and self.reported_reset_at != self.reset_at:
+                self.reported_reset_at = self.reset_at
+                reset_wait = max(0.0, self.get_reset_wait() or 0)
+                if reset_wait > max_rate_limit_wait:
+                    print(f'{self.name} rate limit exhausted for {reset_wait:.0f}s, longer than the '
+                          f'{max_rate_limit_wait}s waited for it to reset')
+                else:
+                    print(f'{self.name} rate limit exhausted, waiting {reset_wait:.0f}s until it resets')
+        retry_after = get_retry_after(response)
+        if retry_after is not None and headers.get('Retry-After'):
+            # A secondary rate limit, hit by too many concurrent requests rather than by the quota. The requests in
+            # flight when it was hit are likely rejected too, concurrency is halved once for all of them
+            if time.monotonic() >= self.paused_until:
+                self.concurrency_ceiling = max(1, self.concurrency - 1)
+                self.concurrency = max(1, self.concurrency // 2)
+                self.successes = 0
+                print(f'{self.name} asked to slow down, limiting concurrent requests to {self.concurrency}')
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        elif response.status_code < 400:
+            self.successes += 1
+            if self.successes >= self.concurrency and \
+                    self.concurrency < min(self.max_concurrency, self.concurrency_ceiling or self.max_concurrency):
+                self.concurrency += 1
+                self.successes = 0
+
+
+def create_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    # Rate limit answers are left to send_http_request(), which pauses the shared rate limiter
+    retry = Retry(total=max_retries, backoff_factor=backoff_factor, raise_on_status=False,
+                  status_forcelist=[code for code in retry_status_codes if code not in rate_limit_status_codes])
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(url):
+    netloc = urlsplit(url).netloc
+    with sessions_lock:
+        if netloc not in sessions:
+            sessions[netloc] = create_session()
+        return sessions[netloc]
+
+
+def http_request(method, url, rate_limiter=None, priority=0, json_fields=None, **kwargs):
+    kwargs.setdefault('timeout', (connect_timeout, read_timeout))
+    if json_fields:
+        # Read by project_json_response() as it arrives, instead of all at once
+        kwargs['stream'] = True
+    response = response_store.replay(method, url, kwargs) if response_store else None
+    if response is None:
+        response = send_http_request(method, url, rate_limiter, priority, json_fields=json_fields, **kwargs)
+        if response_store:
+            response_store.record(method, url, kwargs, response)
+    elif json_fields:
+        # Responses recorded without projecting their fields hold complete bodies
+        response = project_json_response(response, json_fields)
+    return response
+
+
+def send_http_request(method, url, rate_limiter=None, priority=0, json_fields=None, **kwargs):
+    session = get_session(url)
+    for attempt in range(max_retries + 1):
+        if rate_limiter:
+            # Lower priorities are sent first when requests have to wait for the rate limit
+            rate_limiter.acquire(priority)
+            response = None
+            try:
+                response = send_request(session, method, url, json_fields=json_fields, **kwargs)
+            finally:
+                rate_limiter.release(response)
+        else:
+            response = send_request(session, method, url, json_fields=json_fields, **kwargs)
+        retry_after = get_retry_after(response)
+        if attempt == max_retries or (retry_after is None and response.status_code not in backoff_status_codes) or \
+                (retry_after or 0) > max_rate_limit_wait:
+            return response
+        if retry_after is None:
+            # Only this request backs off, nothing tells the others to slow down
+            time.sleep(backoff_factor * 2 ** attempt)
+            continue
+        print(f'Rate limited by {urlsplit(url).netloc}, retrying after {retry_after:.1f}s')
+        if rate_limiter:
+            rate_limiter.pause(retry_after)
+        else:
+            time.sleep(retry_after)
+    return response
+
+
+def send_request(session, method, url, json_fields=None, **kwargs):
+    started_at = time.monotonic()
+    response = None
+    try:
+        response = session.request(method, url, **kwargs)
+        if json_fields:
+            # Part of the call, a streamed body is only downloaded while its fields are projected
+            response = project_json_response(response, json_fields)
+        return response
+    finally:
+        # Retries done by the session are part of the call. A call that failed is reported without a response
+        seconds = time.monotonic() - started_at
+        for hook in request_hooks:
+            hook(method, url, response, seconds)
+
+
+def project_json_response(response, fields):
+    """Replace the body of a 200 answer, a JSON array of objects, with the same array keeping only the keys in fields.
+
+    The body is decoded as it is read, so the values that are not kept, such as the patches of pull request files,
+    are never held in memory as a whole. The size of the body read is kept in response.streamed_bytes.
+    """
+    if response.status_code != 200:
+        # Read now, so that the connection of a streamed response goes back to the pool
+        response.streamed_bytes = len(response.content)
+        return response
+    response.streamed_bytes = 0
+
+    def count_bytes(chunks):
+        for chunk in chunks:
+            response.streamed_bytes += len(chunk)
+            yield chunk
+
+    chunks = count_bytes(response.iter_content(json_chunk_size))
+    items = list(iter_json_array_items(chunks, fields))
+    # Whatever follows the array, such as a trailing new line, has to be read for the connection to be reused
+    for _ in chunks:
+        pass
+    response._content = json.dumps(items, separators=(',', ':')).encode()
+    response._content_consumed = True
+    return response
+
+
+def add_request_hook(hook):
+    """Call hook(method, url, response, seconds) after every request. response is None when the request failed."""
+    if hook not in request_hooks:
+        request_hooks.append(hook)
+
+
+def set_response_store(store):
+    """Answer requests with store.replay(method, url, kwargs) when it returns a response, and pass the responses of
+    the other requests to store.record(method, url, kwargs, response). None sends every request again."""
+    global response_store
+    response_store = store
+
+
+def get_retry_after(response):
+    # Seconds to wait before retrying a rate limited request, None if it was not rate limited
+    if response.status_code not in rate_limit_status_codes:
+        return None
+    if not response.headers.get('Retry-After'):
+        if response.headers.get('X-RateLimit-Remaining') == '0' and response.headers.get('X-RateLimit-Reset'):
+            return max(0.0, float(response.headers['X-RateLimit-Reset']) - time.time()) + rate_limit_reset_margin
+        return None
+    retry_after = response.headers['Retry-After']
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def fan_out(task, items, workers):
+    """Run task for every item on a pool of workers.
+
+    Returns (item, result, error) in the order of items. A failing item does not stop the others.
+    """
+    def run(item):
+        try:
+            return item, task(item), None
+        except Exception as e:
+            return item, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(run, items))
+
+
+def http_get(url, **kwargs):
+    return http_request('GET', url, **kwargs)
+
+
+def http_post(url, **kwargs):
+    return http_request('POST', url, **kwargs)
+
+
+def http_put(url, **kwargs):
+    return http_request('PUT', url, **kwargs)
+
+
+def http_patch(url, **kwargs):
+    return http_request('PATCH', url, **kwargs)
+
+
+def cached_http_get(url, cache_dir=None, headers=None, params=None, json_fields=None, **kwargs):
+    """GET through an on-disk cache revalidated with If-None-Match/If-Modified-Since.
+
+    A 304 answer is served from the cache and does not count against the GitHub rate limit. With json_fields, the
+    cache holds the projected body, see project_json_response().
+    """
+    cache_dir = Path(cache_dir or default_cache_dir)
+    headers = dict(headers or {})
+    prepared_url = prepare_url(url, params)
+    if response_store:
+        # A store keeps complete responses, not the 304 answers of a revalidation
+        return http_get(prepared_url, headers=headers, json_fields=json_fields, **kwargs)
+    # The authorization header is part of the key, so responses are never shared between tokens. So are the projected
+    # fields, so a body missing some of them is never served
+    key_source = prepared_url + "\n" + headers.get('Authorization', '')
+    if json_fields:
+        key_source += "\n" + ",".join(json_fields)
+    key = hashlib.sha256(key_source.encode()).hexdigest()
+    metadata_path = cache_dir / (key + '.json')
+    body_path = cache_dir / (key + '.body')
+    metadata = read_cache_metadata(metadata_path, body_path)
+    if metadata:
+        if metadata['headers'].get('ETag'):
+            headers['If-None-Match'] = metadata['headers']['ETag']
+        if metadata['headers'].get('Last-Modified'):
+            headers['If-Modified-Since'] = metadata['headers']['Last-Modified']
+    response = http_get(prepared_url, headers=headers, json_fields=json_fields, **kwargs)
+    if response.status_code == 304 and metadata:
+        try:
+            cached_response = build_cached_response(response, metadata, body_path.read_bytes())
+        except OSError:
+            # Evicted by a concurrent run in between, fetch it again unconditionally
+            headers.pop('If-None-Match', None)
+            headers.pop('If-Modified-Since', None)
+            return http_get(prepared_url, headers=headers, json_fields=json_fields, **kwargs)
+        touch_cache_entry(metadata_path, body_path)
+        return cached_response
+    if response.status_code == 200 and (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+        write_cache_entry(cache_dir, metadata_path, body_path, prepared_url, response)
+    return response
+
+
+def prepare_url(url, params=None):
+    return url + ('&' if '?' in url else '?') + urlencode(params, doseq=True) if params else url
+
+
+def read_cache_metadata(metadata_path, body_path):
+    try:
+        with open(metadata_path, 'r') as metadata_file:
+            metadata = json.load(metadata_file)
+    except (OSError, ValueError):
+        return None
+    return metadata if body_path.exists() else None
+
+
+def build_cached_response(not_modified_response, metadata, body):
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
+    response = requests.Response()
+    response.status_code = 200
+    response.url = metadata['url']
+    response.request = not_modified_response.request
+    response.encoding = not_modified_response.encoding or 'utf-8'
+    response.headers = CaseInsensitiveDict(not_modified_response.headers)
+    response.headers.update(metadata['headers'])
+    response.headers['Content-Length'] = str(len(body))
+    response._content = body
+    response._content_consumed = True
+    response.from_cache = True
+    return response
+
+
+def write_cache_entry(cache_dir, metadata_path, body_path, url, response):
+    metadata = {'url': url, 'headers': {name: response.headers[name] for name in cached_headers
+                                        if name in response.headers}}
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        replaced_bytes = body_path.stat().st_size if body_path.exists() else 0
+        write_file_atomically(body_path, response.content)
+        write_file_atomically(metadata_path, json.dumps(metadata).encode())
+        add_cache_bytes(cache_dir, len(response.content) - replaced_bytes)
+    except OSError as e:
+        print(f'Unable to cache response of {url}. Error: {e}')
+
+
+def write_file_atomically(path, content):
+    file_descriptor, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    with os.fdopen(file_descriptor, 'wb') as temp_file:
+        temp_file.write(content)
+    os.replace(temp_path, path)
+
+
+def touch_cache_entry(metadata_path, body_path):
+    try:
+        os.utime(metadata_path)
+        os.utime(body_path)
+    except OSError:
+        pass
+
+
+def add_cache_bytes(cache_dir, added_bytes):
+    with cache_lock:
+        if cache_dir in cache_sizes:
+            cache_sizes[cache_dir] += added_bytes
+        else:
+            # The walk already counts the body just written
+            cache_sizes[cache_dir] = sum(size for mtime, size, body_path in iter_cache_entries(cache_dir))
+        if cache_sizes[cache_dir] > cache_max_bytes:
+            cache_sizes[cache_dir] = evict_cache_entries(cache_dir)
+
+
+def iter_cache_entries(cache_dir):
+    for body_path in cache_dir.glob('*.body'):
+        try:
+            stat = body_path.stat()
+        except OSError:
+            continue
+        yield stat.st_mtime, stat.st_size, body_path
+
+
+def evict_cache_entries(cache_dir):
+    # Called with cache_lock held. Returns the total size of the bodies left
+    entries = list(iter_cache_entries(cache_dir))
+    # Other processes may have written to the directory as well, the total is counted again
+    total_bytes = sum(size for mtime, size, body_path in entries)
+    # Least recently used first
+    for mtime, size, body_path in sorted(entries):
+        if total_bytes <= cache_max_bytes:
+            break
+        for path in (body_path, body_path.with_suffix('.json')):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        total_bytes -= size
+    return total_bytes
@@ -1,5 +1,11 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
 
+from api_report import add_api_report_arguments, enable_api_report
+from pull_request_index import add_pull_request_index_arguments, enable_pull_request_index, \
+    get_pull_request_index_path
+from snapshot_store import add_snapshot_arguments, enable_snapshot
 from jira_utils import *
 
 jira_url = 'https://jira.mycompany.com'
@@ -11,7 +17,19 @@ def parse_cli_arguments():
     args = {}
     parser = ArgumentParser()
     parser.add_argument('-p', '--pr', nargs='+', dest='pr', action='store', type=str,
-                        required=True, help='The Pull Request number')
+                        required=False, help='The Pull Request number')
+    parser.add_argument('--merged-since', dest='merged_since', action='store', type=str,
+                        required=False,
+                        help='Bulk mode: pull requests merged on or after this date (YYYY-MM-DD) instead of --pr. One dev resolution is generated per issue key')
+    parser.add_argument('--merged-until', dest='merged_until', action='store', type=str,
+                        required=False,
+                        help='Bulk mode: pull requests merged on or before this date (YYYY-MM-DD)')
+    parser.add_argument('--base', dest='base', action='store', type=str,
+                        required=False,
+                        help='Bulk mode: pull requests merged into this branch')
+    parser.add_argument('--milestone', dest='milestone', action='store', type=str,
+                        required=False,
+                        help='Bulk mode: pull requests of this milestone')
     parser.add_argument('-j', '--jira', dest='issue_key', action='store', type=str,
                         required=False,
                         help='JIRA ticket ID. If provided, then jira username and password id also required')
@@ -32,10 +50,48 @@ def parse_cli_arguments():
                         required=False,
                         default='cli',
                         help='Request Mode. Possible values: github and cli. Default is cli')
+    parser.add_argument('-w', '--workers', dest='workers', action='store', type=int,
+                        required=False,
+                        default=default_workers,
+                        help='Number of pull requests, reviews and files fetched in parallel. Default is ' + str(default_workers))
+    parser.add_argument('-B', '--backend', dest='backend', action='store', type=str,
+                        required=False,
+                        default='rest',
+                        choices=fetch_backends,
+                        help='Backend used to fetch pull request details. graphql fetches all pull requests, reviews and files in batched queries. Default is rest')
+    parser.add_argument('--cache-dir', dest='cache_dir', action='store', type=str,
+                        required=False,
+                        default=default_cache_dir,
+                        help='Directory of the GitHub response cache revalidated with ETag/Last-Modified, and of the JIRA issue types looked up. Default is ' + default_cache_dir)
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                        required=False,
+                        help='Always download pull request details, reviews and files instead of revalidating cached responses, and look JIRA issue types up again')
+    parser.add_argument('--no-local-git', dest='no_local_git', action='store_true',
+                        required=False,
+                        help='Always ask GitHub for the changed files, even when run in a clone of the repository '
+                             'holding the pull requests')
+    parser.add_argument('--changed-file-rules', dest='changed_file_rules', action='store', type=str,
+                        required=False, default=str(default_changed_file_rules_path),
+                        help='Path to the JSON, or YAML, file of rules sorting changed files into categories, shaped '
+                             'like .github/labeler.yml. Default is ' + default_changed_file_rules_path.name)
+    add_api_report_arguments(parser)
+    add_snapshot_arguments(parser)
+    add_pull_request_index_arguments(parser)
     args.update(parser.parse_args().__dict__)
+    args['index'] = get_pull_request_index_path(args)
+    if not args['pr'] and not is_bulk_mode(args):
+        parser.error('either -p/--pr or one of --merged-since, --merged-until, --base, --milestone is required')
+    if args['pr'] and is_bulk_mode(args):
+        parser.error('-p/--pr can not be combined with --merged-since, --merged-until, --base or --milestone')
+    if args['issue_key'] and is_bulk_mode(args):
+        parser.error('-j/--jira can not be used in bulk mode, dev resolutions are posted to the issues found')
     return args
 
 
+def is_bulk_mode(args):
+    return any(args.get(criterion) for criterion in ('merged_since', 'merged_until', 'base', 'milestone'))
+
+
 def init_jira_auth(args):
     if args.get('jt'):
         return args['jt']
@@ -60,35 +116,171 @@ def post_resolution_comment(args, context):
 def main():
     # Parse CLI arguments
     args = parse_cli_arguments()
-    # Generate dev resolution template
-    pull_request_details = generate_pull_request_details(args)
-    populate_jira_comment(pull_request_details)
-    # Get issue details
+    if args['api_report'] or args['api_report_file']:
+        enable_api_report(args['api_report_file'], args['api_report_format'])
+    if args['snapshot']:
+        enable_snapshot(args['snapshot'], args['snapshot_mode'])
+    load_changed_file_rules(args['changed_file_rules'])
+    set_issue_type_cache_dir(None if args['no_cache'] else args['cache_dir'])
+    if not args['no_index']:
+        enable_pull_request_index(args['index'])
+    if is_bulk_mode(args):
+        generate_bulk_dev_resolutions(args)
+        return
+    asyncio.run(generate_dev_resolution(args))
+
+
+async def generate_dev_resolution(args):
+    """Generate the dev resolution of the pull requests of args and post it, as an asyncio pipeline.
+
+    JIRA is read while GitHub is still being fetched: the issue of -j from the start, the issues referenced by the pull
+    requests as soon as their details are there. The GitHub comment and the JIRA updates are posted together once the
+    comment is rendered. The JIRA updates are summarized as when posting one after the other, a failed GitHub comment
+    is reported after them and fails the run as well.
+    """
+    workers = args.get('workers') or default_workers
+    # Fetching from GitHub and posting to JIRA each use up to workers threads
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2 * max(1, workers) + 2))
     issue_key = args['issue_key']
+    jira_reads = None
+
+    def read_referenced_jira_issues(prs):
+        nonlocal jira_reads
+        referenced_details = new_pull_request_details()
+        for pr in prs:
+            merge_pull_request(args, referenced_details, pr, [], [])
+        jira_reads = start_in_thread(read_jira_issues, referenced_details)
+
     if issue_key:
         init_jira_auth(args)
-        issue = get_issue_details(args, issue_key)
+        jira_reads = start_in_thread(read_jira_issue, args, issue_key)
+        pull_request_details = await generate_pull_request_details_async(args)
+    else:
+        pull_request_details = await generate_pull_request_details_async(
+            args, read_referenced_jira_issues if args['mode'] == 'github' else None)
+    populate_jira_comment(pull_request_details)
+    if issue_key:
+        issue, previous_comment = await jira_reads
         fields = populate_jira_fields(args, pull_request_details, issue)
         if fields:
-            post_update(args, issue_key, fields)
+            await asyncio.to_thread(post_update, args, issue_key, fields)
         if pull_request_details['jira_comment']:
-            post_comment(args, issue_key, pull_request_details['jira_comment'])
+            await asyncio.to_thread(upsert_dev_resolution_comment, args, issue_key,
+                                    pull_request_details['jira_comment'], previous_comment)
     else:
         print(pull_request_details['jira_comment'])
         if args['mode'] == 'github':
-            post_resolution_comment(args, pull_request_details)
-            for issue_key in pull_request_details[ISSUE_KEYS]:
-                if pull_request_details['jira_comment']:
-                    post_comment_on_jira_with_token(str(issue_key), pull_request_details['jira_comment'])
-                issue = get_issue_details_with_token(issue_key)
-                if issue:
-                    fields = {}
-                    populate_jira_custom_field(pull_request_details, issue, fields)
-                    if fields:
-                        try:
-                            post_update_on_jira_with_token(issue_key, fields)
-                        except Exception as e:
-                            print('Error while updating issue: ', issue_key, e)
+            github_comment = start_in_thread(post_resolution_comment, args, pull_request_details)
+            previous_comments = await (jira_reads or asyncio.to_thread(read_jira_issues, pull_request_details))
+            results = await post_dev_resolution_on_jira_issues_async(args, pull_request_details, previous_comments)
+            # The JIRA updates are reported even when the GitHub comment failed, which counts as a failure as well
+            is_updated = print_jira_update_summary(results)
+            try:
+                await github_comment
+            except Exception as e:
+                eprint(f'GitHub comment: FAILED - {e}')
+                is_updated = False
+            if not is_updated:
+                sys.exit(1)
+
+
+def start_in_thread(function, *args):
+    task = asyncio.create_task(asyncio.to_thread(function, *args))
+    # Its failure is raised where it is awaited, or dropped when the pipeline failed before getting there
+    task.add_done_callback(lambda done_task: done_task.cancelled() or done_task.exception())
+    return task
+
+
+def read_jira_issue(args, issue_key):
+    issue = get_issue_details(args, issue_key)
+    previous_comments = find_dev_resolution_comments(args, [issue_key])
+    return issue, previous_comments.get(issue_key)
+
+
+def generate_bulk_dev_resolutions(args):
+    results = []
+    # The dev resolutions of bulk_chunk_size issues at a time are held in memory, rendered and posted
+    for chunk in iter_chunks(iter_pull_request_details_by_issue_key(args), bulk_chunk_size):
+        details_by_issue_key = dict(chunk)
+        for issue_key, pull_request_details in chunk:
+            populate_jira_comment(pull_request_details)
+            print(issue_key)
+            print(pull_request_details['jira_comment'])
+        if args['mode'] == 'github':
+            results.extend(post_bulk_dev_resolutions_on_jira_issues(args, details_by_issue_key))
+    if results and not print_jira_update_summary(results):
+        sys.exit(1)
+
+
+def post_bulk_dev_resolutions_on_jira_issues(args, details_by_issue_key):
+    issue_keys = sorted(details_by_issue_key)
+    if any(pull_request_details.get(RCA) for pull_request_details in details_by_issue_key.values()):
+        resolve_issue_types({}, issue_keys)
+    previous_comments = find_dev_resolution_comments({}, issue_keys)
+    return fan_out(lambda key: post_dev_resolution_on_jira_issue(details_by_issue_key[key], key,
+                                                                 previous_comments.get(key)),
+                   issue_keys, args.get('workers') or default_workers)
+
+
+def post_dev_resolution_on_jira_issues(args, pull_request_details):
+    previous_comments = read_jira_issues(pull_request_details, bool(pull_request_details['jira_comment']))
+    return fan_out(lambda key: post_dev_resolution_on_jira_issue(pull_request_details, key,
+                                                                 previous_comments.get(key)),
+                   sorted(pull_request_details[ISSUE_KEYS]), args.get('workers') or default_workers)
+
+
+async def post_dev_resolution_on_jira_issues_async(args, pull_request_details, previous_comments):
+    """post_dev_resolution_on_jira_issues() for asyncio, with the comments read by read_jira_issues()."""
+    semaphore = asyncio.Semaphore(max(1, args.get('workers') or default_workers))
+
+    async def post(issue_key):
+        async with semaphore:
+            try:
+                return issue_key, await asyncio.to_thread(post_dev_resolution_on_jira_issue, pull_request_details,
+                                                          issue_key, previous_comments.get(issue_key)), None
+            except Exception as e:
+                return issue_key, None, e
+
+    return await asyncio.gather(*(post(issue_key) for issue_key in sorted(pull_request_details[ISSUE_KEYS])))
+
+
+def read_jira_issues(pull_request_details, find_comments=True):
+    """Read what posting the dev resolution needs from JIRA. Returns the dev resolution comments of earlier runs."""
+    if pull_request_details.get(RCA):
+        # Issue types of all keys in one search. Only defects need their details for the custom field
+        resolve_issue_types({}, pull_request_details[ISSUE_KEYS])
+    if not find_comments:
+        return {}
+    # Comments of earlier runs of all keys in one search, so that they are updated instead of posted again
+    return find_dev_resolution_comments({}, sorted(pull_request_details[ISSUE_KEYS]))
+
+
+def post_dev_resolution_on_jira_issue(pull_request_details, issue_key, previous_comment=None):
+    updates = []
+    if pull_request_details['jira_comment']:
+        updates.append(upsert_dev_resolution_comment({}, str(issue_key), pull_request_details['jira_comment'],
+                                                     previous_comment))
+    # Issues whose type could not be searched for are read, their details tell whether they are defects
+    if pull_request_details.get(RCA) and get_cached_issue_type(issue_key) in ('Defect', None):
+        issue = get_issue_details_with_token(issue_key)
+        if issue:
+            fields = {}
+            populate_jira_custom_field(pull_request_details, issue, fields)
+            if fields:
+                post_update_on_jira_with_token(issue_key, fields).raise_for_status()
+                updates.append('fields updated: ' + ', '.join(fields))
+    return '; '.join(updates) or 'nothing to update'
+
+
+def print_jira_update_summary(results):
+    failures = [(issue_key, error) for issue_key, result, error in results if error]
+    print(f'Updated {len(results) - len(failures)} of {len(results)} JIRA issue(s)')
+    for issue_key, result, error in results:
+        if error:
+            eprint(f'{issue_key}: FAILED - {error}')
+        else:
+            print(f'{issue_key}: {result}')
+    return not failures
 
 
 def populate_jira_fields(args, context, issue):
@@ -1,13 +1,39 @@
+import hashlib
+import io
+import time
 from argparse import ArgumentParser
 
 from github_pull_request_utils import *
 
-JIRA_DEV_RESOLUTION_COMMENT_KEYS = [PULL_REQUEST_TITLE, DESCRIPTION_OF_CHANGES, TESTS, PULL_REQUEST_LINKS, REVIEWERS, DATABASE_CHANGES, PROPERTY_CHANGES]
+# Rows of the dev resolution comment. Rows of changed file categories missing from the changed file rules are left
+# out, categories of the rules missing from it are added after it
+JIRA_DEV_RESOLUTION_COMMENT_KEYS = [PULL_REQUEST_TITLE, DESCRIPTION_OF_CHANGES, TESTS, PULL_REQUEST_LINKS, REVIEWERS, DATABASE_CHANGES, PROPERTY_CHANGES,
+                                    MIGRATION_CHANGES, INFRASTRUCTURE_CHANGES, DOCUMENTATION_CHANGES]
 
 jira_rest_api_url = 'https://jira.mycompany.com/rest/api/latest'
 JIRA_CUSTOM_FIELD_XYZ = 'customfield_12345'
 header = '''{panel:title=Dev Resolution Comments|borderStyle=dashed|borderColor=#cccccc|titleBGColor=#f7d6c1|bgColor=#ffffce}'''
 footer = '''{panel}'''
+# Markdown heading prefixes and their JIRA equivalent, longest first
+markdown_jira_headings = [("#####", "h5. "), ("####", "h4. "), ("###", "h3. "), ("##", "h2. ")]
+# Issue types whose type is decided by their parent issue
+sub_task_issue_types = ['Sub-task', 'Dev Task', 'DB Task']
+# Seconds an issue type looked up in JIRA is reused before it is looked up again
+issue_type_cache_ttl = 24 * 60 * 60
+# File the issue types are kept in between runs, see set_issue_type_cache_dir(). None keeps them in memory only
+issue_type_cache_file_name = 'jira_issue_types.json'
+issue_type_cache_file = Path(default_cache_dir) / issue_type_cache_file_name
+# Maximum number of issue keys in a single JQL search
+jira_search_batch_size = 100
+# Comments requested per page when an issue has more comments than a search returns
+jira_comment_page_size = 100
+# Requests per second, and burst size, sent to JIRA when updating many issues at once
+jira_requests_per_second = 5
+jira_request_burst = 10
+jira_rate_limiter = TokenBucket(jira_requests_per_second, jira_request_burst)
+# Issue type and parent of issues looked up in JIRA, keyed by issue key
+issue_type_cache = {}
+issue_type_cache_lock = threading.Lock()
 
 
 def parse_cli_arguments():
@@ -27,119 +53,260 @@ def get_jira_headers(args):
     return {"Authorization": "Bearer " + args['jt'], "Content-Type": "application/json"}
 
 
-def get_issue_details(args, issue_key):
-    jira_issue = None
+def get_jira_request_options(args):
     if args.get('jt'):
-        jira_issue = requests.get(jira_rest_api_url + "/issue/" + issue_key, headers=get_jira_headers(args)).json()
-    elif args.get('jira_username') and args.get('jira_password'):
-        jira_issue = requests.get(jira_rest_api_url + "/issue/" + issue_key,
-                                  auth=(args['jira_username'], args['jira_password']),
-                                  headers={"Content-Type": "application/json"}).json()
-    elif os.environ['JIRA_TOKEN']:
-        args['jt'] = os.environ['JIRA_TOKEN']
-        jira_issue = requests.get(jira_rest_api_url + "/issue/" + issue_key,
-                                  headers={"Authorization": "Bearer " + os.environ['JIRA_TOKEN'],
-                                           "Content-Type": "application/json"}).json()
-    return jira_issue
+        return {"headers": get_jira_headers(args)}
+    if args.get('jira_username') and args.get('jira_password'):
+        return {"auth": (args['jira_username'], args['jira_password']),
+                "headers": {"Content-Type": "application/json"}}
+    args['jt'] = os.environ['JIRA_TOKEN']
+    return {"headers": get_jira_headers(args)}
+
+
+def jira_request(args, method, path, **kwargs):
+    return http_request(method, jira_rest_api_url + path, rate_limiter=jira_rate_limiter,
+                        **get_jira_request_options(args), **kwargs)
+
+
+def get_issue_details(args, issue_key):
+    return jira_request(args, 'GET', "/issue/" + issue_key).json()
 
 
 def get_issue_details_with_token(issue_key):
-    return requests.get(jira_rest_api_url + "/issue/" + issue_key,
-                                  headers={"Authorization": "Bearer " + os.environ['JIRA_TOKEN'],
-                                           "Content-Type": "application/json"}).json()
+    return get_issue_details({}, issue_key)
 
 
 def get_user_details(args, user_key):
-    jira_user = None
-    if args.get('jt'):
-        jira_user = requests.get(jira_rest_api_url + "/user/search?username=" + user_key, headers=get_jira_headers(args)).json()
-    elif args.get('jira_username') and args.get('jira_password'):
-        jira_user = requests.get(jira_rest_api_url + "/user/search?username=" + user_key,
-                                auth=(args['jira_username'], args['jira_password']),
-                                headers={"Content-Type": "application/json"}).json()
-    elif os.environ['JIRA_TOKEN']:
-        args['jt'] = os.environ['JIRA_TOKEN']
-        jira_user = requests.get(jira_rest_api_url + "/user/search?username=" + user_key,
-                                headers={"Authorization": "Bearer " + os.environ['JIRA_TOKEN'],
-                                         "Content-Type": "application/json"}).json()
+    jira_user = jira_request(args, 'GET', "/user/search", params={"username": user_key}).json()
     return jira_user[0]
 
 
 def get_issue_type(args, issue_key):
     issue_key = issue_key.strip()
-    jira_issue = None
     print(f'Getting issue type for {issue_key}')
-    if args.get('jt'):
-        print('Using JIRA token from command line arguments')
-        jira_issue = requests.get(jira_rest_api_url + "/issue/" + issue_key + "?fields=issuetype,parent",
-                                  headers=get_jira_headers(args)).json()
-    elif args.get('jira_username') and args.get('jira_password'):
-        print('Using JIRA username and password from command line arguments')
-        jira_issue = requests.get(jira_rest_api_url + "/issue/" + issue_key + "?fields=issuetype,parent",
-                                  auth=(args['jira_username'], args['jira_password']),
-                                  headers={"Content-Type": "application/json"}).json()
-    else:
-        print('Using JIRA token from environment variables')
+    issue_type, issue_key = resolve_issue_types(args, [issue_key])[issue_key]
+    if not issue_type:
+        print(f'Unable to get issue details for {issue_key}')
+    return issue_type, issue_key
+
+
+def resolve_issue_types(args, issue_keys):
+    """Resolve issue types, following sub-task parents, with one JQL search per level of the parent chain.
+
+    Returns {issue_key: (issue_type, resolved_issue_key)} where resolved_issue_key is the issue the type was taken from.
+    """
+    issue_keys = {issue_key.strip() for issue_key in issue_keys}
+    with issue_type_cache_lock:
+        load_issue_type_cache()
+        pending_issue_keys = issue_keys
+        # Parent chains looping back to an issue, as misconfigured parent fields make them, are walked once
+        seen_issue_keys = set()
+        while pending_issue_keys:
+            seen_issue_keys.update(pending_issue_keys)
+            missing_issue_keys = [issue_key for issue_key in pending_issue_keys
+                                  if not is_issue_type_cached(issue_key)]
+            if missing_issue_keys:
+                fetch_issue_types(args, missing_issue_keys)
+            pending_issue_keys = {issue_type_cache[issue_key]['parent'] for issue_key in pending_issue_keys
+                                  if is_issue_type_cached(issue_key)
+                                  and issue_type_cache[issue_key]['issuetype'] in sub_task_issue_types
+                                  and issue_type_cache[issue_key]['parent']} - seen_issue_keys
+        save_issue_type_cache()
+        return {issue_key: resolve_cached_issue_type(issue_key) for issue_key in issue_keys}
+
+
+def get_issue_type_offline(issue_key):
+    # Same as get_issue_type, from the issue types cached by earlier runs only
+    issue_key = issue_key.strip()
+    with issue_type_cache_lock:
+        load_issue_type_cache()
+        return resolve_cached_issue_type(issue_key)
+
+
+def get_cached_issue_type(issue_key):
+    cached_issue = issue_type_cache.get(issue_key.strip())
+    return cached_issue['issuetype'] if cached_issue else None
+
+
+def resolve_cached_issue_type(issue_key):
+    visited_issue_keys = set()
+    while is_issue_type_cached(issue_key) and issue_key not in visited_issue_keys:
+        visited_issue_keys.add(issue_key)
+        cached_issue = issue_type_cache[issue_key]
+        if cached_issue['issuetype'] not in sub_task_issue_types or not cached_issue['parent']:
+            return cached_issue['issuetype'], issue_key
+        issue_key = cached_issue['parent']
+    return None, issue_key
+
+
+def fetch_issue_types(args, issue_keys):
+    for start in range(0, len(issue_keys), jira_search_batch_size):
+        batch = issue_keys[start:start + jira_search_batch_size]
         try:
-            jira_issue_response = requests.get(jira_rest_api_url + "/issue/" + issue_key + "?fields=issuetype,parent",
-                                               headers={"Authorization": "Bearer " + os.environ['JIRA_TOKEN'],
-                                                        "Content-Type": "application/json"})
-            jira_issue_response.raise_for_status()
-            jira_issue = jira_issue_response.json()
+            # validateQuery=warn keeps unknown keys from failing the whole search
+            response = jira_request(args, 'GET', "/search",
+                                    params={"jql": "key in (" + ','.join(batch) + ")", "fields": "issuetype,parent",
+                                            "maxResults": len(batch), "validateQuery": "warn"})
+            response.raise_for_status()
+            jira_issues = response.json()['issues']
         except Exception as e:
-            print(f'Error occurred while getting issue details for {issue_key}. Error: {e}')
-        print(f'JIRA issue details for {issue_key}')
-    if jira_issue:
-        print(f'{jira_issue}')
-        issue_type = jira_issue['fields']['issuetype']['name']
-        if issue_type == "Sub-task" or issue_type == "Dev Task" or issue_type == "DB Task":
-            issue_key = jira_issue['fields']['parent']['key']
-            return get_issue_type(args, issue_key), issue_key
-        return jira_issue['fields']['issuetype']['name'], issue_key
-    else:
-        print(f'Unable to get issue details for {issue_key}')
-        return None, issue_key
+            print(f'Error occurred while getting issue types for {", ".join(batch)}. Error: {e}')
+            continue
+        for jira_issue in jira_issues:
+            parent = jira_issue['fields'].get('parent')
+            issue_type_cache[jira_issue['key']] = {'issuetype': jira_issue['fields']['issuetype']['name'],
+                                                   'parent': parent['key'] if parent else None,
+                                                   'fetched_at': time.time()}
+
+
+def is_issue_type_cached(issue_key):
+    return issue_key in issue_type_cache and \
+        time.time() - issue_type_cache[issue_key]['fetched_at'] < issue_type_cache_ttl
+
+
+def set_issue_type_cache_dir(cache_dir):
+    """Keep the issue types looked up in JIRA in cache_dir between runs. None keeps them in memory only."""
+    global issue_type_cache_file
+    issue_type_cache_file = Path(cache_dir) / issue_type_cache_file_name if cache_dir else None
+
+
+def load_issue_type_cache():
+    if issue_type_cache or not issue_type_cache_file or not issue_type_cache_file.exists():
+        return
+    try:
+        issue_type_cache.update(json.loads(issue_type_cache_file.read_text()))
+    except (OSError, ValueError) as e:
+        print(f'Ignoring unreadable issue type cache {issue_type_cache_file}. Error: {e}')
+
+
+def save_issue_type_cache():
+    if not issue_type_cache_file:
+        return
+    try:
+        issue_type_cache_file.parent.mkdir(parents=True, exist_ok=True)
+        write_file_atomically(issue_type_cache_file, json.dumps(
+            {issue_key: cached_issue for issue_key, cached_issue in issue_type_cache.items()
+             if is_issue_type_cached(issue_key)}).encode())
+    except OSError as e:
+        print(f'Unable to save issue type cache {issue_type_cache_file}. Error: {e}')
 
 
 def post_comment(args, issue_key, dev_resolution_template):
-    if args.get('jt'):
-        jira_issue = requests.post(jira_rest_api_url + "/issue/" + issue_key + "/comment",
-                                   headers=get_jira_headers(args), json={"body": dev_resolution_template})
-    else:
-        jira_issue = requests.post(jira_rest_api_url + "/issue/" + issue_key + "/comment",
-                                   auth=(args['jira_username'], args['jira_password']),
-                                   headers={"Content-Type": "application/json"}, json={"body": dev_resolution_template})
+    jira_issue = jira_request(args, 'POST', "/issue/" + issue_key + "/comment", json={"body": dev_resolution_template})
     print(f'Comment added to JIRA issue {issue_key}')
     return jira_issue
 
 
 def post_comment_on_jira_with_token(issue_key, dev_resolution_template):
-    jira_issue = requests.post(jira_rest_api_url + "/issue/" + issue_key + "/comment",
-                               headers={"Authorization": "Bearer " + os.environ['JIRA_TOKEN'], "Content-Type": "application/json"}, json={"body": dev_resolution_template})
-    print(jira_issue)
-    print(f'Comment added to JIRA issue {issue_key}')
+    return post_comment({}, issue_key, dev_resolution_template)
+
+
+def update_comment(args, issue_key, comment_id, dev_resolution_template):
+    jira_issue = jira_request(args, 'PUT', "/issue/" + issue_key + "/comment/" + str(comment_id),
+                              json={"body": dev_resolution_template})
+    print(f'Comment {comment_id} updated on JIRA issue {issue_key}')
     return jira_issue
 
 
+def upsert_dev_resolution_comment(args, issue_key, dev_resolution_template, previous_comment=None):
+    """Post the dev resolution comment, or update the one posted by an earlier run if it changed.
+
+    previous_comment is the earlier comment as found by find_dev_resolution_comments(), raised if it could not be
+    looked up, so that a second comment is not posted. Returns 'comment added', 'comment updated' or
+    'comment unchanged'.
+    """
+    if isinstance(previous_comment, Exception):
+        raise previous_comment
+    if previous_comment is None:
+        post_comment(args, issue_key, dev_resolution_template).raise_for_status()
+        return 'comment added'
+    if get_comment_hash(previous_comment['body']) == get_comment_hash(dev_resolution_template):
+        print(f'Comment {previous_comment["id"]} on JIRA issue {issue_key} is up to date')
+        return 'comment unchanged'
+    update_comment(args, issue_key, previous_comment['id'], dev_resolution_template).raise_for_status()
+    return 'comment updated'
+
+
+def get_comment_hash(comment_body):
+    # JIRA may store the comment with other line endings or without trailing white space
+    normalized_body = '\n'.join(line.rstrip() for line in comment_body.strip().splitlines())
+    return hashlib.sha256(normalized_body.encode()).hexdigest()
+
+
+def find_dev_resolution_comments(args, issue_keys):
+    """Find the dev resolution comments posted by earlier runs, with one JQL search per batch of issue keys.
+
+    Returns {issue_key: comment} for the issues having one, where comment is the latest comment starting with header.
+    When a search fails, the comments of each issue of its batch are read one issue at a time instead. The issues
+    whose comments can not be read either are returned with the exception saying why, see
+    upsert_dev_resolution_comment().
+    """
+    issue_keys = sorted({issue_key.strip() for issue_key in issue_keys})
+    dev_resolution_comments = {}
+    for start in range(0, len(issue_keys), jira_search_batch_size):
+        batch = issue_keys[start:start + jira_search_batch_size]
+        try:
+            response = jira_request(args, 'GET', "/search",
+                                    params={"jql": "key in (" + ','.join(batch) + ")", "fields": "comment",
+                                            "maxResults": len(batch), "validateQuery": "warn"})
+            response.raise_for_status()
+            jira_issues = response.json()['issues']
+        except Exception as e:
+            print(f'Error occurred while searching the comments of {", ".join(batch)}, reading them one issue at a '
+                  f'time. Error: {e}')
+            for issue_key in batch:
+                comment = find_issue_dev_resolution_comment(args, issue_key)
+                if comment is not None:
+                    dev_resolution_comments[issue_key] = comment
+            continue
+        for jira_issue in jira_issues:
+            comments = jira_issue['fields']['comment']
+            if comments['total'] > len(comments['comments']):
+                # Searches return only the first comments of an issue
+                comment = find_issue_dev_resolution_comment(args, jira_issue['key'])
+            else:
+                comment = find_dev_resolution_comment(comments['comments'])
+            if comment is not None:
+                dev_resolution_comments[jira_issue['key']] = comment
+    return dev_resolution_comments
+
+
+def find_issue_dev_resolution_comment(args, issue_key):
+    try:
+        return find_dev_resolution_comment(get_comments(args, issue_key))
+    except Exception as e:
+        return Exception(f'Unable to read the comments of JIRA issue {issue_key}. Error: {e}')
+
+
+def find_dev_resolution_comment(comments):
+    dev_resolution_comment = None
+    for comment in comments:
+        if comment['body'].lstrip().startswith(header):
+            dev_resolution_comment = comment
+    return dev_resolution_comment
+
+
+def get_comments(args, issue_key):
+    comments = []
+    while True:
+        response = jira_request(args, 'GET', "/issue/" + issue_key + "/comment",
+                                params={"startAt": len(comments), "maxResults": jira_comment_page_size})
+        response.raise_for_status()
+        page = response.json()
+        comments.extend(page['comments'])
+        if not page['comments'] or len(comments) >= page['total']:
+            return comments
+
+
 def post_update(args, issue_key, fields):
     fields_to_update = {"fields": fields}
-    if args.get('jt'):
-        jira_issue = requests.put(jira_rest_api_url + "/issue/" + issue_key, headers=get_jira_headers(args),
-                                  json=fields_to_update)
-    else:
-        jira_issue = requests.put(jira_rest_api_url + "/issue/" + issue_key,
-                                  auth=(args['jira_username'], args['jira_password']),
-                                  headers={"Content-Type": "application/json"}, json=fields_to_update)
+    jira_issue = jira_request(args, 'PUT', "/issue/" + issue_key, json=fields_to_update)
     print(f'Fields updated to JIRA issue {issue_key} are\n {fields}')
     return jira_issue
 
 
 def post_update_on_jira_with_token(issue_key, fields):
-    fields_to_update = {"fields": fields}
-    jira_issue = requests.put(jira_rest_api_url + "/issue/" + issue_key, headers={"Authorization": "Bearer " + os.environ['JIRA_TOKEN'], "Content-Type": "application/json"},
-                                  json=fields_to_update)
-    print(f'Fields updated to JIRA issue {issue_key} are\n {fields}')
-    return jira_issue
+    return post_update({}, issue_key, fields)
 
 
 def is_defect(issue):
@@ -168,40 +335,68 @@ def transform_text_from_markdown_to_jira_syntax(value):
         return 'Yes' if value else 'No'
     if not value:
         return value
-    value = value.replace('**', '*')
-    text_lines = value.splitlines()
-    for i, line in enumerate(text_lines):
-        if line and line.strip().startswith("```"):
-            if len(line.strip()) == 3:
-                text_lines[i] = "{code}"
+    jira_text = io.StringIO()
+    write_markdown_as_jira(value, jira_text)
+    return jira_text.getvalue()
+
+
+def write_markdown_as_jira(value, out):
+    """Write markdown converted to JIRA wiki syntax to a file-like object, one line at a time."""
+    for i, line in enumerate(iter_markdown_as_jira_lines(io.StringIO(value, newline=None))):
+        if i:
+            out.write(os.linesep)
+        out.write(line)
+
+
+def iter_markdown_as_jira_lines(markdown_lines):
+    """Convert markdown lines to JIRA wiki syntax in a single pass, yielding the non-empty converted lines.
+
+    Fenced code blocks become {code} blocks with their content left as is. Outside of them, headings, bold text,
+    inline code and checkboxes are converted. Inline code may span lines, as in the markdown.
+    """
+    in_code_block = False
+    back_tick_count = 0
+    for line in markdown_lines:
+        line = line.rstrip("\r\n")
+        stripped_line = line.strip()
+        if stripped_line.startswith("```"):
+            in_code_block = not in_code_block
+            if len(stripped_line) == 3:
+                line = "{code}"
             else:
-                text_lines[i] = "{code:" + line.strip()[3:].strip() + "}"
-        elif line and line.strip().startswith("```"):
-            text_lines[i] = "{code}"
-        elif line and line.strip().startswith("#####"):
-            text_lines[i] = "h5. " + line.strip()[5:]
-        elif line and line.strip().startswith("####"):
-            text_lines[i] = "h4. " + line.strip()[4:]
-        elif line and line.strip().startswith("###"):
-            text_lines[i] = "h3. " + line.strip()[3:]
-        elif line and line.strip().startswith("##"):
-            text_lines[i] = "h2. " + line.strip()[2:]
-    value = "\n".join(text_lines)
-    value = inline_code(value)
-    value = markdown_checkboxes_to_jira_syntax(value)
-    value = os.linesep.join([s for s in value.splitlines() if s])
-    return value
+                line = "{code:" + stripped_line[3:].strip() + "}"
+        elif not in_code_block and line:
+            line = line.replace('**', '*')
+            stripped_line = line.strip()
+            for markdown_heading, jira_heading in markdown_jira_headings:
+                if stripped_line.startswith(markdown_heading):
+                    line = jira_heading + stripped_line[len(markdown_heading):]
+                    break
+            line, back_tick_count = convert_inline_code(line, back_tick_count)
+            line = markdown_checkboxes_to_jira_syntax(line)
+        if line:
+            yield line
 
 
 def populate_jira_comment(pull_request_details):
     pull_request_details[REVIEWERS] = ', '.join(pull_request_details[REVIEWER_USERNAMES])
     print(pull_request_details)
-    jira_comment = header + "\n"
-    for key in JIRA_DEV_RESOLUTION_COMMENT_KEYS:
-        jira_comment = jira_comment + "|*" + \
-                       key + "*|" + transform_text_from_markdown_to_jira_syntax(pull_request_details[key]) + "|\n"
-    jira_comment = jira_comment + footer
-    pull_request_details['jira_comment'] = jira_comment
+    jira_comment = io.StringIO()
+    jira_comment.write(header + "\n")
+    for key in JIRA_DEV_RESOLUTION_COMMENT_KEYS + [category for category in changed_file_categories
+                                                   if category not in JIRA_DEV_RESOLUTION_COMMENT_KEYS]:
+        if key not in pull_request_details:
+            # A changed file category the changed file rules do not define
+            continue
+        jira_comment.write("|*" + key + "*|")
+        value = pull_request_details[key]
+        if isinstance(value, str) and value:
+            write_markdown_as_jira(value, jira_comment)
+        else:
+            jira_comment.write(str(transform_text_from_markdown_to_jira_syntax(value)))
+        jira_comment.write("|\n")
+    jira_comment.write(footer)
+    pull_request_details['jira_comment'] = jira_comment.getvalue()
 
 
 def main():
@@ -220,7 +415,9 @@ def main():
         # if fields:
         #     post_update(args, issue_key, fields)
         if pull_request_details['jira_comment']:
-            post_comment(args, issue_key, pull_request_details['jira_comment'])
+            previous_comments = find_dev_resolution_comments(args, [issue_key])
+            upsert_dev_resolution_comment(args, issue_key, pull_request_details['jira_comment'],
+                                          previous_comments.get(issue_key))
     else:
         print(pull_request_details['jira_comment'])
 
@@ -0,0 +1,116 @@
+import json
+import re
+
+# Characters that open or close JSON values or separate them. They are ASCII, which never occurs inside a UTF-8
+# encoded character, so bytes are scanned without decoding them
+json_structure_pattern = re.compile(rb'["{}\[\],:]')
+
+
+def iter_json_array_items(chunks, fields):
+    """Decode a JSON array of objects from an iterable of byte chunks, such as response.iter_content().
+
+    Yields every object with only its keys in fields. The values of the other keys are skipped while they are read,
+    without ever being decoded or held in memory as a whole, however long they are.
+    """
+    fields = set(fields)
+    chunks = iter(chunks)
+    buffer = b''
+    # Position in buffer the scan continues from
+    position = 0
+    # 1 inside the array, 2 inside one of its objects, deeper inside the value of a key
+    depth = 0
+    item = None
+    key = None
+    expecting_key = False
+    # Position in buffer of the value of a key in fields, None while reading any other value
+    value_start = None
+    while True:
+        match = json_structure_pattern.search(buffer, position)
+        if match is None:
+            # Only white space and parts of numbers, true, false or null are left, which a value being kept needs
+            keep = len(buffer) if value_start is None else value_start
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError('Incomplete JSON array')
+            buffer, position = buffer[keep:] + chunk, len(buffer) - keep
+            if value_start is not None:
+                value_start = 0
+            continue
+        character = match.group()
+        start = match.start()
+        position = match.end()
+        if character == b'"':
+            is_key = depth == 2 and expecting_key
+            while True:
+                string_end = find_string_end(buffer, position)
+                if string_end >= 0:
+                    break
+                # The string goes on in the next chunk. Only keys and kept values are kept, and the backslashes
+                # the buffer ends with, which escape what the next chunk starts with
+                if is_key:
+                    keep = start
+                elif value_start is not None:
+                    keep = value_start
+                else:
+                    keep = len(buffer.rstrip(b'\\'))
+                chunk = next(chunks, None)
+                if chunk is None:
+                    raise ValueError('Incomplete JSON string')
+                buffer, position = buffer[keep:] + chunk, max(position, keep) - keep
+                start -= keep
+                if value_start is not None:
+                    value_start -= keep
+            if is_key:
+                key = json.loads(buffer[start:string_end + 1])
+                expecting_key = False
+            position = string_end + 1
+        elif character in b'[{':
+            if depth == 0 and character != b'[':
+                raise ValueError('Expected a JSON array')
+            depth += 1
+            if depth == 2:
+                if character != b'{':
+                    raise ValueError('Expected a JSON object in the array')
+                item = {}
+                expecting_key = True
+        elif character in b']}':
+            if depth == 2 and key is not None:
+                item_value(item, key, fields, buffer, value_start, start)
+                key, value_start = None, None
+            depth -= 1
+            if depth == 1:
+                yield item
+                item = None
+            elif depth == 0:
+                return
+        elif depth == 2 and character == b':':
+            if key in fields:
+                value_start = position
+        elif depth == 2 and character == b',':
+            item_value(item, key, fields, buffer, value_start, start)
+            key, value_start = None, None
+            expecting_key = True
+        # Other separators of the array or of nested values need nothing more than keeping track of the depth
+        if value_start is None and position > 64 * 1024:
+            # Drop what was scanned, so that the buffer does not grow with the values skipped
+            buffer, position = buffer[position:], 0
+
+
+def find_string_end(buffer, position):
+    # Position of the quote closing the string the buffer holds at position, -1 if the buffer does not hold it
+    while True:
+        end = buffer.find(b'"', position)
+        if end < 0:
+            return -1
+        # A quote is escaped by an odd number of backslashes before it
+        backslash_start = end
+        while backslash_start > 0 and buffer[backslash_start - 1] == 0x5c:
+            backslash_start -= 1
+        if (end - backslash_start) % 2 == 0:
+            return end
+        position = end + 1
+
+
+def item_value(item, key, fields, buffer, value_start, value_end):
+    if key in fields:
+        item[key] = json.loads(buffer[value_start:value_end])
@@ -0,0 +1,247 @@
+import atexit
+import json
+import sqlite3
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from http_utils import default_cache_dir
+
+# Index of the pull requests the dev resolution scripts fetched, next to the GitHub response cache by default
+index_file_name = 'pull-request-index.sqlite'
+default_index_path = str(Path(default_cache_dir) / index_file_name)
+index_version = 1
+query_formats = ['text', 'json']
+# Numbers looked up in a single query, below the oldest SQLite limit of 999 parameters
+query_chunk_size = 500
+index_schema = '''
+CREATE TABLE IF NOT EXISTS pull_requests (
+    repository TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    base_ref TEXT,
+    merged_at TEXT,
+    url TEXT,
+    file_categories TEXT NOT NULL,
+    pull_request TEXT NOT NULL,
+    reviews TEXT NOT NULL,
+    classifying_files TEXT NOT NULL,
+    rules_fingerprint TEXT,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (repository, number)
+);
+CREATE TABLE IF NOT EXISTS issue_keys (
+    issue_key TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    PRIMARY KEY (issue_key, repository, number)
+) WITHOUT ROWID;
+-- Number first, so that the issue keys of a pull request are found with or without its repository
+CREATE INDEX IF NOT EXISTS issue_keys_by_pull_request ON issue_keys (number, repository);
+'''
+
+
+class PullRequestIndex:
+    """Pull requests fetched by the dev resolution scripts in a SQLite file, by issue key and by number.
+
+    A pull request is kept with what rebuilding its dev resolution needs: its title, body, links and reviews, and the
+    files that put it in each of its changed file categories. Merged pull requests do not change any more, so they are
+    taken from the index instead of being fetched again, as long as the changed file rules are the same.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = Path(path)
+        self.reused = 0
+        self.indexed = 0
+        self.lock = threading.Lock()
+        try:
+            if read_only:
+                self.connection = sqlite3.connect(self.path.resolve().as_uri() + '?mode=ro', uri=True,
+                                                  check_same_thread=False)
+            else:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                # Concurrent runs wait for each other's writes instead of failing
+                self.connection = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+            version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+            if version not in (0, index_version):
+                raise Exception('Pull request index ' + str(self.path) + ' has version ' + str(version) +
+                                ', expected ' + str(index_version))
+            if not read_only and version == 0:
+                self.connection.execute('PRAGMA journal_mode=WAL')
+                with self.connection:
+                    self.connection.executescript(index_schema)
+                    self.connection.execute('PRAGMA user_version=' + str(index_version))
+        except (OSError, sqlite3.Error) as e:
+            raise Exception('Unable to open pull request index ' + str(self.path) + '. Error: ' + str(e))
+
+    def get_pull_requests(self, repository, numbers, rules_fingerprint):
+        """Merged pull requests of repository among numbers, indexed with the same changed file rules.
+
+        Returns {number: (pr, reviews, files)}, shaped like fetched ones, with the number as a string.
+        """
+        pull_requests = {}
+        numbers = [int(number) for number in numbers]
+        with self.lock:
+            for start in range(0, len(numbers), query_chunk_size):
+                chunk = numbers[start:start + query_chunk_size]
+                rows = self.connection.execute(
+                    'SELECT number, pull_request, reviews, classifying_files FROM pull_requests '
+                    'WHERE repository = ? AND merged_at IS NOT NULL AND rules_fingerprint = ? AND number IN (' +
+                    ','.join('?' * len(chunk)) + ')', [repository, rules_fingerprint] + chunk)
+                for number, pull_request, reviews, classifying_files in rows:
+                    pull_requests[str(number)] = (json.loads(pull_request), json.loads(reviews),
+                                                  json.loads(classifying_files))
+            self.reused += len(pull_requests)
+        return pull_requests
+
+    def update(self, repository, entries):
+        """Add or replace the pull requests of entries, in a single transaction."""
+        if not entries:
+            return
+        indexed_at = time.time()
+        with self.lock, self.connection:
+            for entry in entries:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO pull_requests (repository, number, title, base_ref, merged_at, url, '
+                    'file_categories, pull_request, reviews, classifying_files, rules_fingerprint, indexed_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (repository, entry['number'], entry['title'], entry['base_ref'], entry['merged_at'], entry['url'],
+                     json.dumps(entry['file_categories']), json.dumps(entry['pull_request']),
+                     json.dumps(entry['reviews']), json.dumps(entry['classifying_files']),
+                     entry['rules_fingerprint'], indexed_at))
+                # Issue keys the pull request no longer references are dropped
+                self.connection.execute('DELETE FROM issue_keys WHERE repository = ? AND number = ?',
+                                        (repository, entry['number']))
+                self.connection.executemany('INSERT INTO issue_keys (issue_key, repository, number) VALUES (?, ?, ?)',
+                                            [(issue_key, repository, entry['number'])
+                                             for issue_key in entry['issue_keys']])
+            self.indexed += len(entries)
+
+    def find_pull_requests(self, issue_key):
+        """Pull requests referencing issue_key, in merge order, the ones not merged last."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT p.repository, p.number, p.title, p.base_ref, p.merged_at, p.url, p.file_categories '
+                'FROM issue_keys k JOIN pull_requests p ON p.repository = k.repository AND p.number = k.number '
+                'WHERE k.issue_key = ? ORDER BY p.merged_at IS NULL, p.merged_at, p.repository, p.number',
+                (issue_key,)).fetchall()
+        return [{'issue_key': issue_key, 'repository': repository, 'number': number, 'title': title,
+                 'base_ref': base_ref, 'merged_at': merged_at, 'url': url,
+                 'file_categories': json.loads(file_categories)}
+                for repository, number, title, base_ref, merged_at, url, file_categories in rows]
+
+    def find_issue_keys(self, number, repository=None):
+        """Issue keys referenced by pull request number, of repository or of any repository."""
+        query = 'SELECT repository, issue_key FROM issue_keys WHERE number = ?'
+        parameters = [int(number)]
+        if repository:
+            query += ' AND repository = ?'
+            parameters.append(repository)
+        with self.lock:
+            rows = self.connection.execute(query + ' ORDER BY repository, issue_key', parameters).fetchall()
+        issue_keys = {}
+        for row_repository, issue_key in rows:
+            issue_keys.setdefault(row_repository, []).append(issue_key)
+        return [{'repository': row_repository, 'number': int(number), 'issue_keys': keys}
+                for row_repository, keys in issue_keys.items()]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def report(self):
+        self.close()
+        # stderr, so that the report does not mix with output meant for other tools, such as the JIRA comment
+        print(f'Pull request index {self.path}: {self.reused} pull request(s) reused, {self.indexed} indexed',
+              file=sys.stderr)
+
+
+def enable_pull_request_index(path):
+    """Index the pull requests fetched in the SQLite file at path, and take merged ones from it."""
+    # Imported here, so that looking up the index does not pay for importing the GitHub client
+    from github_pull_request_utils import set_pull_request_index
+
+    index = PullRequestIndex(path)
+    set_pull_request_index(index)
+    atexit.register(index.report)
+    return index
+
+
+def add_pull_request_index_arguments(parser):
+    parser.add_argument('--index', dest='index', action='store', type=str,
+                        required=False,
+                        help='SQLite file indexing the pull requests fetched by issue key. Merged pull requests '
+                             'already in it are not fetched again, unless --no-cache is given. Default is ' +
+                             index_file_name + ' in --cache-dir')
+    parser.add_argument('--no-index', dest='no_index', action='store_true',
+                        required=False,
+                        help='Neither read nor update the pull request index')
+
+
+def get_pull_request_index_path(args):
+    """The --index of args, else the index file in the --cache-dir of args."""
+    return args.get('index') or str(Path(args.get('cache_dir') or default_cache_dir) / index_file_name)
+
+
+def print_rows(rows, output_format, columns):
+    for row in rows:
+        if output_format == 'json':
+            print(json.dumps(row))
+        else:
+            print('\t'.join(', '.join(value) if isinstance(value, list) else str(value or '')
+                            for value in (row[column] for column in columns)))
+
+
+def parse_cli_arguments():
+    parser = ArgumentParser(description='Look up the pull request index of the dev resolution scripts')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    query_parser = subparsers.add_parser('query', help='Find the pull requests referencing issue keys, or the issue '
+                                                       'keys a pull request references')
+    query_parser.add_argument('issue_keys', nargs='*', metavar='ISSUE_KEY',
+                              help='Issue keys to find the pull requests of')
+    query_parser.add_argument('-p', '--pr', dest='pr', action='store', type=int,
+                              required=False, help='Pull request number to find the issue keys of')
+    query_parser.add_argument('-r', '--repo', dest='repo', action='store', type=str,
+                              required=False,
+                              help='Repository owner/name of the pull request of --pr. Default is any repository')
+    query_parser.add_argument('--index', dest='index', action='store', type=str,
+                              required=False, default=default_index_path,
+                              help='SQLite file of the index. Default is ' + default_index_path)
+    query_parser.add_argument('-f', '--format', dest='format', action='store', type=str,
+                              required=False, default='text', choices=query_formats,
+                              help='text prints tab separated columns, json an object per line. Default is text')
+    args = vars(parser.parse_args())
+    if not args['issue_keys'] and args['pr'] is None:
+        query_parser.error('either issue keys or -p/--pr is required')
+    return args
+
+
+def main():
+    args = parse_cli_arguments()
+    if not Path(args['index']).exists():
+        print(f'No pull request index at {args["index"]}', file=sys.stderr)
+        sys.exit(1)
+    try:
+        index = PullRequestIndex(args['index'], read_only=True)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    found = False
+    for issue_key in args['issue_keys']:
+        pull_requests = index.find_pull_requests(issue_key)
+        found = found or bool(pull_requests)
+        print_rows(pull_requests, args['format'], ['issue_key', 'repository', 'number', 'base_ref', 'merged_at',
+                                                   'file_categories', 'title'])
+    if args['pr'] is not None:
+        issue_keys = index.find_issue_keys(args['pr'], args['repo'])
+        found = found or bool(issue_keys)
+        print_rows(issue_keys, args['format'], ['repository', 'number', 'issue_keys'])
+    index.close()
+    # Like grep, nothing found is not an error but is told apart
+    sys.exit(0 if found else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import atexit
+import gzip
+import hashlib
+import json
+import sys
+import threading
+from http import HTTPStatus
+from pathlib import Path
+
+from http_utils import get_retry_after, prepare_url, set_response_store, write_file_atomically
+
+# Modes of a snapshot. replay answers from the snapshot and records what is missing from it, record sends every
+# request again and replaces what the snapshot held for it
+snapshot_modes = ['replay', 'record']
+# Response headers not kept in a snapshot, bodies are kept decoded and the others describe the connection
+snapshot_excluded_headers = ['Connection', 'Content-Encoding', 'Content-Length', 'Date', 'Keep-Alive', 'Set-Cookie',
+                             'Transfer-Encoding']
+snapshot_version = 1
+
+
+class SnapshotStore:
+    """GitHub and JIRA responses recorded in a gzipped JSON file, keyed by method, URL and request body.
+
+    Identical bodies, such as pages fetched by several requests, are stored once. Responses to the same request are
+    replayed in the order they were recorded, the last one repeated, so that a request sent before and after an
+    update, such as the comments of a JIRA issue, gets the answer it got when recorded.
+    """
+
+    def __init__(self, path, mode='replay'):
+        self.path = Path(path)
+        self.mode = mode
+        self.responses = {}
+        self.bodies = {}
+        # Requests replayed so far, and those recorded in this run
+        self.replay_counts = {}
+        self.recorded_keys = set()
+        self.replayed = 0
+        self.recorded = 0
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            raise Exception('Unable to read snapshot ' + str(self.path) + '. Error: ' + str(e))
+        if snapshot.get('version') != snapshot_version:
+            raise Exception('Snapshot ' + str(self.path) + ' has version ' + str(snapshot.get('version')) +
+                            ', expected ' + str(snapshot_version))
+        self.responses = snapshot['responses']
+        self.bodies = snapshot['bodies']
+
+    def replay(self, method, url, kwargs):
+        if self.mode != 'replay':
+            return None
+        key = get_request_key(method, url, kwargs)
+        with self.lock:
+            entries = self.responses.get(key)
+            if not entries:
+                return None
+            count = self.replay_counts.get(key, 0)
+            self.replay_counts[key] = count + 1
+            self.replayed += 1
+            entry = entries[min(count, len(entries) - 1)]
+            body = self.bodies[entry['body']] if entry['body'] else ''
+        return build_response(entry, body.encode('utf-8', 'surrogateescape'))
+
+    def record(self, method, url, kwargs, response):
+        # Answers that would not be the same when asked again are not worth replaying
+        if response.status_code >= 500 or get_retry_after(response) is not None:
+            return
+        key = get_request_key(method, url, kwargs)
+        body = response.content or b''
+        body_hash = hashlib.sha256(body).hexdigest() if body else None
+        entry = {'status': response.status_code, 'url': response.url or key.split(' ')[1],
+                 'encoding': response.encoding,
+                 'headers': {name: value for name, value in response.headers.items()
+                             if name.title() not in snapshot_excluded_headers}, 'body': body_hash}
+        with self.lock:
+            if key not in self.recorded_keys:
+                # What the snapshot held for this request is replaced by the responses of this run
+                self.recorded_keys.add(key)
+                self.responses[key] = []
+            self.responses[key].append(entry)
+            if body_hash:
+                self.bodies[body_hash] = body.decode('utf-8', 'surrogateescape')
+            self.recorded += 1
+
+    def save(self):
+        with self.lock:
+            if not self.recorded:
+                return
+            # Bodies only referenced by replaced responses are dropped
+            body_hashes = {entry['body'] for entries in self.responses.values() for entry in entries}
+            snapshot = {'version': snapshot_version, 'responses': self.responses,
+                        'bodies': {body_hash: body for body_hash, body in self.bodies.items()
+                                   if body_hash in body_hashes}}
+            content = gzip.compress(json.dumps(snapshot, separators=(',', ':')).encode(), mtime=0)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_file_atomically(self.path, content)
+        except OSError as e:
+            print(f'Unable to write snapshot {self.path}. Error: {e}', file=sys.stderr)
+
+    def report(self):
+        self.save()
+        # stderr, so that the report does not mix with output meant for other tools, such as the JIRA comment
+        print(f'Snapshot {self.path}: {self.replayed} response(s) replayed, {self.recorded} recorded',
+              file=sys.stderr)
+
+
+def get_request_key(method, url, kwargs):
+    key = method.upper() + ' ' + prepare_url(url, kwargs.get('params'))
+    if kwargs.get('json') is not None:
+        body = json.dumps(kwargs['json'], sort_keys=True).encode()
+    else:
+        body = kwargs.get('data')
+    if body:
+        # Requests to the same URL with different bodies, such as GraphQL queries, are different requests
+        key += ' ' + hashlib.sha256(body if isinstance(body, bytes) else str(body).encode()).hexdigest()
+    return key
+
+
+def build_response(entry, body):
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
+    response = requests.Response()
+    response.status_code = entry['status']
+    try:
+        response.reason = HTTPStatus(entry['status']).phrase
+    except ValueError:
+        response.reason = ''
+    response.url = entry['url']
+    response.encoding = entry['encoding']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response.headers['Content-Length'] = str(len(body))
+    response._content = body
+    response._content_consumed = True
+    response.from_snapshot = True
+    return response
+
+
+def enable_snapshot(path, mode='replay'):
+    """Answer GitHub and JIRA requests from the snapshot at path, and write it when the script exits."""
+    store = SnapshotStore(path, mode)
+    set_response_store(store)
+    atexit.register(store.report)
+    return store
+
+
+def add_snapshot_arguments(parser):
+    parser.add_argument('--snapshot', dest='snapshot', action='store', type=str,
+                        required=False,
+                        help='Gzipped file the GitHub and JIRA responses are replayed from. Requests missing from it '
+                             'are sent and their responses added to it. It holds the response bodies, not the tokens')
+    parser.add_argument('--snapshot-mode', dest='snapshot_mode', action='store', type=str,
+                        required=False,
+                        default='replay',
+                        choices=snapshot_modes,
+                        help='replay answers from the snapshot, record sends every request again and replaces its '
+                             'responses in the snapshot. Default is replay')
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(tests_dir, '..')
+sys.path[:0] = [repo_dir, os.path.join(repo_dir, 'benchmarks')]
+
+import github_pull_request_utils
+import http_utils
+import jira_utils
+from fake_api_server import start_fake_api_server
+
+
+@pytest.fixture
+def fake_api(monkeypatch, tmp_path):
+    """Start the fake GitHub and JIRA server of the benchmarks with a config, and point the scripts to it."""
+    servers = []
+
+    def start(config=None):
+        server = start_fake_api_server(dict({'etag': False}, **(config or {})))
+        servers.append(server)
+        server.url = 'http://127.0.0.1:' + str(server.server_address[1])
+        monkeypatch.setattr(github_pull_request_utils, 'base_url', server.url + '/repos')
+        monkeypatch.setattr(jira_utils, 'jira_rest_api_url', server.url + '/rest/api/latest')
+        return server
+
+    monkeypatch.setenv('GIT_TOKEN', 'test')
+    monkeypatch.setenv('JIRA_TOKEN', 'test')
+    # Pull request the dev resolution is commented on in GitHub mode
+    monkeypatch.setenv('REPO_NAME', github_pull_request_utils.org_name + '/test')
+    monkeypatch.setenv('PR_NUMBER', '1')
+    monkeypatch.setattr(http_utils, 'default_cache_dir', str(tmp_path / 'cache'))
+    monkeypatch.setattr(jira_utils, 'issue_type_cache', {})
+    monkeypatch.setattr(jira_utils, 'issue_type_cache_file', None)
+    monkeypatch.setattr(http_utils, 'request_hooks', [])
+    # Quotas and concurrency learnt from another server are not carried over
+    monkeypatch.setattr(github_pull_request_utils, 'github_rate_limiter',
+                        http_utils.RateLimitScheduler('GitHub', github_pull_request_utils.default_workers))
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
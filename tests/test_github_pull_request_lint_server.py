@@ -0,0 +1,98 @@
+import hashlib
+import hmac
+import http.client
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+import github_pull_request_lint_server as lint_server
+from pr_body_corpus import generate_pr_body
+
+secret = 'test-secret'
+
+
+@pytest.fixture
+def lint_server_url(monkeypatch):
+    """Start the webhook server on a free port, linting the pull requests of pccofvns/test."""
+    monkeypatch.setattr(lint_server, 'server_properties', {'secret': secret, 'repositories': {'pccofvns/test'},
+                                                           'debounce': 0.3})
+    monkeypatch.setattr(lint_server, 'pending_lints', {})
+    server = lint_server.start_server('127.0.0.1', 0, 2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:' + str(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+    lint_server.lint_executor.shutdown(wait=True)
+
+
+def pull_request_event(repo_name='pccofvns/test', action='edited'):
+    return {'action': action, 'repository': {'full_name': repo_name},
+            'pull_request': {'number': 1, 'title': 'Change', 'body': generate_pr_body('small', 1),
+                             'head': {'ref': 'feature/change'}}}
+
+
+def post_event(url, payload, signing_secret=secret):
+    payload_bytes = json.dumps(payload).encode()
+    signature = 'sha256=' + hmac.new(signing_secret.encode(), payload_bytes, hashlib.sha256).hexdigest()
+    return requests.post(url, data=payload_bytes, timeout=5,
+                         headers={'X-GitHub-Event': 'pull_request', 'X-Hub-Signature-256': signature})
+
+
+def test_event_with_a_bad_signature_is_rejected(fake_api, lint_server_url):
+    server = fake_api()
+
+    response = post_event(lint_server_url, pull_request_event(), signing_secret='other-secret')
+
+    assert response.status_code == 401
+    assert server.stats == {}
+
+
+def test_event_of_an_unlisted_repository_is_rejected(fake_api, lint_server_url):
+    server = fake_api()
+
+    response = post_event(lint_server_url, pull_request_event(repo_name='pccofvns/other'))
+
+    assert response.status_code == 403
+    assert server.stats == {}
+
+
+def test_negative_content_length_is_rejected(lint_server_url):
+    connection = http.client.HTTPConnection(lint_server_url.split('//')[1], timeout=5)
+    connection.putrequest('POST', '/')
+    connection.putheader('Content-Length', '-1')
+    connection.endheaders()
+
+    assert connection.getresponse().status == 400
+    connection.close()
+
+
+def test_payload_over_the_limit_is_rejected_before_being_read(lint_server_url, monkeypatch):
+    monkeypatch.setattr(lint_server, 'max_payload_bytes', 16)
+
+    response = post_event(lint_server_url, pull_request_event())
+
+    assert response.status_code == 413
+
+
+def test_burst_of_events_is_linted_once_and_updates_the_title(fake_api, lint_server_url, monkeypatch):
+    server = fake_api()
+    linted_payloads = []
+    lint_webhook_payload = lint_server.lint_webhook_payload
+
+    def count_lint(payload):
+        linted_payloads.append(payload)
+        return lint_webhook_payload(payload)
+
+    monkeypatch.setattr(lint_server, 'lint_webhook_payload', count_lint)
+
+    statuses = [post_event(lint_server_url, pull_request_event()).status_code for _ in range(5)]
+    time.sleep(lint_server.server_properties['debounce'] + 0.5)
+    lint_server.lint_executor.shutdown(wait=True)
+
+    assert statuses == [202] * 5
+    assert len(linted_payloads) == 1
+    assert server.stats['PATCH /repos/{repo}/pulls/{number}']['calls'] == 1
+    assert server.pull_request_updates[1]['title'] == 'feat: JIRA-1: Change'
@@ -0,0 +1,33 @@
+import json
+
+import github_pull_request_linter
+from pr_body_corpus import generate_pr_body
+
+
+def test_batch_verdicts_keep_warnings_apart_from_reasons():
+    github_pull_request_linter.load_lint_rules(github_pull_request_linter.default_lint_rules_path)
+    # The issue key is only in the body, which is a warning, the title is updated with it
+    valid_record = {'id': 1, 'title': 'feat: Change', 'body': generate_pr_body('small', 1), 'branch': 'feature/change'}
+    invalid_record = {'id': 2, 'title': 'feat: Change', 'body': 'No sections', 'branch': 'feature/change'}
+
+    valid_verdict = github_pull_request_linter.lint_jsonl_line(json.dumps(valid_record))
+    invalid_verdict = github_pull_request_linter.lint_jsonl_line(json.dumps(invalid_record))
+
+    assert valid_verdict['valid'] is True
+    assert valid_verdict['reasons'] == []
+    assert valid_verdict['warnings'] == ["Missing JIRA number in title 'feat: Change'"]
+    assert invalid_verdict['valid'] is False
+    assert len(invalid_verdict['reasons']) == 1
+    assert invalid_verdict['reasons'][0].startswith('Missing mandatory sections')
+    assert invalid_verdict['warnings'] == []
+
+
+def test_warnings_are_printed_as_before_outside_of_batch_mode(capsys):
+    github_pull_request_linter.load_lint_rules(github_pull_request_linter.default_lint_rules_path)
+
+    is_valid_pr, new_pr_title = github_pull_request_linter.lint_pull_request(
+        'feat: Change', generate_pr_body('small', 1), 'feature/change', offline=True)
+
+    assert is_valid_pr is True
+    assert capsys.readouterr().err == "Missing JIRA number in title 'feat: Change'\n"
+    assert github_pull_request_linter.batch_warnings is None
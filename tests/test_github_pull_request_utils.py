@@ -0,0 +1,56 @@
+import github_pull_request_utils
+import pull_request_index
+
+
+def fetch_details(backend, pr_count):
+    args = {'pr': [str(pr_number) for pr_number in range(1, pr_count + 1)], 'repo': 'test', 'gt': None,
+            'backend': backend, 'no_cache': True, 'no_local_git': True, 'workers': 4}
+    return github_pull_request_utils.generate_pull_request_details(args)
+
+
+def test_graphql_backend_fetches_batches_of_pull_requests_in_few_round_trips(fake_api):
+    # 250 files take 3 pages of 100, every batch of graphql_batch_size pull requests pages through them together
+    server = fake_api({'files_per_pr': 250, 'reviews_per_pr': 5})
+    pr_count = github_pull_request_utils.graphql_batch_size + 5
+
+    graphql_details = fetch_details('graphql', pr_count)
+
+    assert list(server.stats) == ['POST /graphql']
+    assert server.stats['POST /graphql']['calls'] == 2 * 3
+    server.stats.clear()
+    rest_details = fetch_details('rest', pr_count)
+    assert sum(stats['calls'] for stats in server.stats.values()) == pr_count * (1 + 1 + 3)
+    assert graphql_details == rest_details
+    assert len(graphql_details[github_pull_request_utils.PULL_REQUEST_LINKS].splitlines()) == pr_count
+
+
+def test_bulk_mode_groups_the_details_of_pull_requests_by_issue_key(fake_api, monkeypatch, tmp_path):
+    fake_api({'merged_prs': 12, 'prs_per_issue': 3, 'files_per_pr': 5})
+    # Issues referenced across chunks
+    monkeypatch.setattr(github_pull_request_utils, 'bulk_chunk_size', 5)
+    args = {'pr': None, 'merged_since': '2024-01-01', 'repo': 'test', 'gt': None, 'backend': 'rest',
+            'no_cache': True, 'no_local_git': True, 'workers': 4}
+
+    index = pull_request_index.PullRequestIndex(tmp_path / 'index.sqlite')
+    monkeypatch.setattr(github_pull_request_utils, 'pull_request_index', index)
+    merged_prs = []
+    merge_pull_request = github_pull_request_utils.merge_pull_request
+
+    def count_merge(args, pull_request_details, pr, pr_reviews, pr_files):
+        merged_prs.append(pr['number'])
+        merge_pull_request(args, pull_request_details, pr, pr_reviews, pr_files)
+
+    monkeypatch.setattr(github_pull_request_utils, 'merge_pull_request', count_merge)
+
+    details_by_issue_key = list(github_pull_request_utils.iter_pull_request_details_by_issue_key(args))
+
+    # Once for the index and the issues together
+    assert sorted(merged_prs) == list(range(1, 13))
+    assert index.indexed == 12
+    monkeypatch.setattr(github_pull_request_utils, 'pull_request_index', None)
+    index.close()
+    assert [issue_key for issue_key, details in details_by_issue_key] == ['JIRA-1', 'JIRA-2', 'JIRA-3', 'JIRA-4']
+    for issue_number, (issue_key, details) in enumerate(details_by_issue_key):
+        pr_numbers = range(3 * issue_number + 1, 3 * issue_number + 4)
+        assert details == github_pull_request_utils.generate_pull_request_details(
+            dict(args, pr=[str(pr_number) for pr_number in pr_numbers]))
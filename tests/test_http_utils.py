@@ -0,0 +1,139 @@
+import math
+import threading
+import time
+
+import api_report
+import github_pull_request_utils
+import http_utils
+
+
+def test_projected_chunked_response_reports_bytes_streamed(fake_api, monkeypatch):
+    server = fake_api({'chunked': True, 'files_per_pr': 250, 'patch_bytes': 2000})
+    monkeypatch.setattr(api_report, 'api_calls', [])
+    api_report.add_request_hook(api_report.record_api_call)
+
+    files = github_pull_request_utils.get_pull_request_files({'no_cache': True}, 1, 'repo')
+
+    assert len(files) == 250
+    [endpoint] = api_report.summarize_api_calls()
+    assert endpoint['endpoint'].endswith('/pulls/{number}/files')
+    assert endpoint['calls'] == 3
+    assert endpoint['bytes'] == server.stats['GET /repos/{repo}/pulls/{number}/files']['bytes']
+
+
+def pull_request_url(server, pr_number):
+    return server.url + '/repos/pccofvns/test/pulls/' + str(pr_number)
+
+
+def get_pull_requests(server, scheduler, pr_numbers, workers):
+    results = http_utils.fan_out(lambda pr_number: http_utils.http_get(pull_request_url(server, pr_number),
+                                                                       rate_limiter=scheduler),
+                                 pr_numbers, workers)
+    return [response.status_code for pr_number, response, error in results]
+
+
+def test_scheduler_never_goes_past_the_quota(fake_api):
+    server = fake_api({'rate_limit': 10, 'rate_limit_window_seconds': 1})
+    scheduler = http_utils.RateLimitScheduler('GitHub', 4)
+    started_at = time.monotonic()
+
+    statuses = get_pull_requests(server, scheduler, range(1, 16), 4)
+
+    assert statuses == [200] * 15
+    assert server.stats['GET /repos/{repo}/pulls/{number}']['calls'] == 15
+    assert server.stats['GET /repos/{repo}/pulls/{number}']['rate_limited'] == 0
+    # 15 requests of a quota of 10 wait for it to reset
+    assert time.monotonic() - started_at >= 1
+
+
+def test_scheduler_waits_for_a_rate_limit_reset_and_retries(fake_api):
+    server = fake_api({'rate_limit': 5, 'rate_limit_window_seconds': 60})
+    # Used up by another client, unknown to the scheduler
+    server.quota_used = 5
+    server.quota_reset_at = reset_at = math.ceil(time.time() + 1)
+    scheduler = http_utils.RateLimitScheduler('GitHub', 4)
+
+    response = http_utils.http_get(pull_request_url(server, 1), rate_limiter=scheduler)
+
+    assert response.status_code == 200
+    assert time.time() >= reset_at
+    assert server.stats['GET /repos/{repo}/pulls/{number}']['rate_limited'] == 1
+
+
+def test_scheduler_halves_concurrency_when_asked_to_slow_down(fake_api):
+    server = fake_api({'secondary_rate_limit': 2, 'secondary_retry_after_seconds': 0.2, 'latency_ms': 50})
+    scheduler = http_utils.RateLimitScheduler('GitHub', 8)
+
+    statuses = get_pull_requests(server, scheduler, range(1, 17), 8)
+
+    assert statuses == [200] * 16
+    assert server.stats['GET /repos/{repo}/pulls/{number}']['rate_limited'] > 0
+    assert scheduler.concurrency <= 4
+
+
+def test_scheduler_starts_waiting_requests_highest_priority_first(fake_api, monkeypatch):
+    server = fake_api({'latency_ms': 300})
+    scheduler = http_utils.RateLimitScheduler('GitHub', 1)
+    started = []
+    monkeypatch.setattr(http_utils, 'request_hooks', [lambda method, url, response, seconds: started.append(url)])
+    threads = []
+    # The first request holds the only slot while the others queue up, lowest priority first
+    for pr_number, priority in [(1, 0), (2, 2), (3, 2), (4, 1), (5, 0)]:
+        thread = threading.Thread(target=http_utils.http_get, args=(pull_request_url(server, pr_number),),
+                                  kwargs={'rate_limiter': scheduler, 'priority': priority})
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+
+    assert [int(url.rsplit('/', 1)[1]) for url in started] == [1, 5, 4, 2, 3]
+
+
+def test_scheduler_backs_off_and_retries_unavailable_answers_without_retry_after(fake_api, monkeypatch):
+    server = fake_api({'unavailable_requests': 2})
+    monkeypatch.setattr(http_utils, 'backoff_factor', 0.05)
+    scheduler = http_utils.RateLimitScheduler('GitHub', 4)
+
+    response = http_utils.http_get(pull_request_url(server, 1), rate_limiter=scheduler)
+
+    assert response.status_code == 200
+    assert server.stats['GET /repos/{repo}/pulls/{number}']['calls'] == 3
+    assert server.stats['GET /repos/{repo}/pulls/{number}']['rate_limited'] == 2
+
+
+def test_requests_without_a_rate_limiter_wait_out_a_retry_after(fake_api):
+    server = fake_api({'secondary_rate_limit': 1, 'secondary_retry_after_seconds': 0.2, 'latency_ms': 100})
+
+    results = http_utils.fan_out(lambda pr_number: http_utils.http_get(pull_request_url(server, pr_number)),
+                                 [1, 2], 2)
+
+    assert [response.status_code for pr_number, response, error in results] == [200, 200]
+    assert server.stats['GET /repos/{repo}/pulls/{number}']['rate_limited'] > 0
+
+
+def test_cache_directory_is_only_walked_to_read_its_size_and_to_evict(fake_api, monkeypatch, tmp_path):
+    server = fake_api({'etag': True})
+    cache_dir = tmp_path / 'responses'
+    monkeypatch.setattr(http_utils, 'cache_sizes', {})
+    walks = []
+    iter_cache_entries = http_utils.iter_cache_entries
+
+    def count_walk(walked_dir):
+        walks.append(walked_dir)
+        return iter_cache_entries(walked_dir)
+
+    monkeypatch.setattr(http_utils, 'iter_cache_entries', count_walk)
+    body_bytes = len(http_utils.http_get(pull_request_url(server, 1)).content)
+    # Room for 5 bodies
+    monkeypatch.setattr(http_utils, 'cache_max_bytes', 5 * body_bytes + body_bytes // 2)
+
+    for pr_number in range(1, 6):
+        http_utils.cached_http_get(pull_request_url(server, pr_number), cache_dir)
+    assert len(walks) == 1
+    assert http_utils.cache_sizes[cache_dir] == 5 * body_bytes
+
+    http_utils.cached_http_get(pull_request_url(server, 6), cache_dir)
+    assert len(walks) == 2
+    assert len(list(cache_dir.glob('*.body'))) == 5
+    assert http_utils.cache_sizes[cache_dir] == 5 * body_bytes
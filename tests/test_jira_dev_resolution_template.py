@@ -0,0 +1,43 @@
+import asyncio
+import sys
+
+import pytest
+
+import jira_dev_resolution_template
+
+
+def parse_arguments(monkeypatch, tmp_path, *argv):
+    monkeypatch.setattr(sys, 'argv', ['jira_dev_resolution_template.py', '-m', 'github', '-r', 'test',
+                                      '--cache-dir', str(tmp_path / 'cache'), '--no-local-git', '--no-index', *argv])
+    return jira_dev_resolution_template.parse_cli_arguments()
+
+
+def test_failed_github_comment_is_reported_after_the_jira_updates(fake_api, monkeypatch, tmp_path, capsys):
+    server = fake_api()
+    args = parse_arguments(monkeypatch, tmp_path, '-p', '1')
+
+    def post_resolution_comment(args, context):
+        raise Exception('GitHub is down')
+
+    monkeypatch.setattr(jira_dev_resolution_template, 'post_resolution_comment', post_resolution_comment)
+
+    with pytest.raises(SystemExit) as exit_info:
+        asyncio.run(jira_dev_resolution_template.generate_dev_resolution(args))
+
+    assert exit_info.value.code == 1
+    output = capsys.readouterr()
+    assert 'Updated 1 of 1 JIRA issue(s)' in output.out
+    assert 'JIRA-1: comment added' in output.out
+    assert 'GitHub comment: FAILED - GitHub is down' in output.err
+    assert len(server.comments['JIRA-1']) == 1
+
+
+def test_rca_of_a_defect_is_posted_when_its_type_can_not_be_searched_for(fake_api, monkeypatch, tmp_path, capsys):
+    server = fake_api({'rejected_endpoints': ['GET /rest/api/latest/search']})
+    args = parse_arguments(monkeypatch, tmp_path, '-p', '1')
+
+    asyncio.run(jira_dev_resolution_template.generate_dev_resolution(args))
+
+    assert 'JIRA-1: comment added; fields updated: ' in capsys.readouterr().out
+    assert server.stats['GET /rest/api/latest/issue/{key}']['calls'] == 1
+    assert server.stats['PUT /rest/api/latest/issue/{key}']['calls'] == 1
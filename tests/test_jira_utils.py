@@ -0,0 +1,39 @@
+import pytest
+
+import jira_utils
+
+
+def upsert(issue_key, body):
+    previous_comment = jira_utils.find_dev_resolution_comments({}, [issue_key]).get(issue_key)
+    return jira_utils.upsert_dev_resolution_comment({}, issue_key, jira_utils.header + '\n' + body, previous_comment)
+
+
+def test_dev_resolution_comment_is_added_then_left_unchanged_then_updated(fake_api):
+    server = fake_api()
+
+    assert upsert('JIRA-1', 'First run') == 'comment added'
+    assert upsert('JIRA-1', 'First run') == 'comment unchanged'
+    assert upsert('JIRA-1', 'Second run') == 'comment updated'
+
+    assert [comment['body'] for comment in server.comments['JIRA-1']] == [jira_utils.header + '\nSecond run']
+    assert server.stats['GET /rest/api/latest/search']['calls'] == 3
+
+
+def test_comments_are_read_one_issue_at_a_time_when_the_search_fails(fake_api):
+    server = fake_api({'rejected_endpoints': ['GET /rest/api/latest/search']})
+
+    assert upsert('JIRA-1', 'First run') == 'comment added'
+    assert upsert('JIRA-1', 'Second run') == 'comment updated'
+
+    assert [comment['body'] for comment in server.comments['JIRA-1']] == [jira_utils.header + '\nSecond run']
+    assert server.stats['GET /rest/api/latest/issue/{key}/comment']['calls'] == 2
+
+
+def test_no_comment_is_posted_when_the_comments_can_not_be_read(fake_api):
+    server = fake_api({'rejected_endpoints': ['GET /rest/api/latest/search',
+                                              'GET /rest/api/latest/issue/{key}/comment']})
+
+    with pytest.raises(Exception, match='Unable to read the comments of JIRA issue JIRA-1'):
+        upsert('JIRA-1', 'First run')
+
+    assert 'JIRA-1' not in server.comments